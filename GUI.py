@@ -4,22 +4,33 @@ from tkcalendar import DateEntry
 import cv2
 import os
 from datetime import datetime
-import pandas as pd
-from deepface import DeepFace
 from PIL import Image, ImageTk
 import shutil
+import threading
+from model_registry import ModelRegistry
+from loader import startup
+from pipeline import RecognitionWorker
+from metrics import metrics
+from attendance_log import AttendanceWriter
+from attendance_store import AttendanceStore
+from sessions import SessionTable
 
 # === Configuration ===
 DB_PATH = "database"
 CSV_FILE = "attendance.csv"
+STORE_DIR = "attendance_store"
 EXIT_TIMEOUT_SEC = 10
 MODELS = ["Facenet", "VGG-Face", "ArcFace", "DeepFace"]
+DEFAULT_MODEL = "Facenet"
+RECOGNITION_INTERVAL_SEC = 1.0  # minimum time between recognitions on the worker thread
+POLL_INTERVAL_MS = 100          # how often the UI collects recognition results
+METRICS_PORT = None             # e.g. 9100 to serve Prometheus metrics at /metrics
+PAGE_SIZE = 100                 # attendance rows shown per table page
 
 # Ensure directories
 os.makedirs(DB_PATH, exist_ok=True)
-if not os.path.exists(CSV_FILE):
-    df = pd.DataFrame(columns=["Name", "Entry Time", "Exit Time"])
-    df.to_csv(CSV_FILE, index=False)
+store = AttendanceStore.open(STORE_DIR, CSV_FILE)
+writer = AttendanceWriter(CSV_FILE, store=store)
 
 # === GUI Setup ===
 root = tk.Tk()
@@ -28,9 +39,23 @@ root.geometry("1000x700")
 
 # State
 cap = cv2.VideoCapture(0)
-attendance = {}
-last_seen = {}
-selected_model = tk.StringVar(value="Facenet")
+sessions = SessionTable(EXIT_TIMEOUT_SEC)
+selected_model = tk.StringVar(value=DEFAULT_MODEL)
+
+# Galleries for every model are built in the background, the default first, so
+# the window, preview, enrollment and table work while TensorFlow loads; only
+# the first max_resident networks are loaded, the rest load when selected
+registry = ModelRegistry(DB_PATH, detector_backend='opencv')
+registry.request(DEFAULT_MODEL)
+registry.preload([DEFAULT_MODEL] + [m for m in MODELS if m != DEFAULT_MODEL])
+
+# Sessions left open by a crash resume; they exit normally if the person is gone
+for name, entry_time in writer.recover().items():
+    sessions.restore(name, entry_time)
+
+def enroll_image(name, filepath, frame):
+    # Embed just the new photo for every loaded gallery, off the Tk thread
+    threading.Thread(target=registry.enroll, args=(name, filepath, frame), daemon=True).start()
 
 # === Frames ===
 video_frame = tk.Label(root)
@@ -48,8 +73,11 @@ tk.Button(form_frame, text="Start Attendance", command=lambda: start_attendance(
 
 # === Model Selection ===
 tk.Label(form_frame, text="Model:").grid(row=0, column=4, padx=5)
-model_menu = ttk.Combobox(form_frame, textvariable=selected_model, values=MODELS)
+model_menu = ttk.Combobox(form_frame, textvariable=selected_model, values=MODELS, state="readonly")
 model_menu.grid(row=0, column=5, padx=5)
+model_menu.bind("<<ComboboxSelected>>", lambda e: registry.request(selected_model.get()))
+model_status = tk.Label(form_frame, text="")
+model_status.grid(row=0, column=6, padx=5)
 
 # === Attendance Table ===
 tree_frame = tk.Frame(root)
@@ -62,12 +90,41 @@ for col in columns:
     attendance_table.column(col, width=250)
 attendance_table.pack()
 
-def update_table():
+# Paged view: only PAGE_SIZE rows live in the Treeview at once
+table_rows = []
+table_page = 0
+
+page_frame = tk.Frame(tree_frame)
+page_frame.pack()
+tk.Button(page_frame, text="< Prev", command=lambda: show_page(table_page - 1)).grid(row=0, column=0, padx=5)
+page_label = tk.Label(page_frame, text="Page 1/1")
+page_label.grid(row=0, column=1, padx=5)
+tk.Button(page_frame, text="Next >", command=lambda: show_page(table_page + 1)).grid(row=0, column=2, padx=5)
+
+def page_count():
+    return max(1, (len(table_rows) + PAGE_SIZE - 1) // PAGE_SIZE)
+
+def show_page(page):
+    global table_page
+    table_page = max(0, min(page, page_count() - 1))
     for row in attendance_table.get_children():
         attendance_table.delete(row)
-    df = pd.read_csv(CSV_FILE)
-    for _, row in df.iterrows():
-        attendance_table.insert('', 'end', values=(row["Name"], row["Entry Time"], row["Exit Time"]))
+    for values in table_rows[table_page * PAGE_SIZE:(table_page + 1) * PAGE_SIZE]:
+        attendance_table.insert('', 'end', values=values)
+    page_label.config(text=f"Page {table_page + 1}/{page_count()}")
+
+def add_table_row(row):
+    # Incremental update: insert just the new row if it lands on the visible page
+    table_rows.append((row["Name"], row["Entry Time"], row["Exit Time"]))
+    if (len(table_rows) - 1) // PAGE_SIZE == table_page:
+        attendance_table.insert('', 'end', values=table_rows[-1])
+    page_label.config(text=f"Page {table_page + 1}/{page_count()}")
+
+def update_table():
+    # Today's sessions only, read from today's partition
+    df = store.today()
+    table_rows[:] = [(row["Name"], row["Entry Time"], row["Exit Time"]) for row in df.to_dict("records")]
+    show_page(page_count() - 1)
 
 # === Export by Date ===
 export_frame = tk.Frame(root)
@@ -79,8 +136,7 @@ tk.Button(export_frame, text="Export by Date", command=lambda: export_by_date())
 
 def export_by_date():
     date_str = export_date.get()
-    df = pd.read_csv(CSV_FILE)
-    filtered = df[df['Entry Time'].str.startswith(date_str)]
+    filtered = store.read_day(date_str)
     out_path = f"attendance_{date_str}.csv"
     filtered.to_csv(out_path, index=False)
     messagebox.showinfo("Exported", f"Data exported to {out_path}")
@@ -98,6 +154,8 @@ def delete_person():
     if not person:
         return
     path = os.path.join(DB_PATH, person)
+    for gallery in registry.galleries():
+        gallery.remove_person(person)
     if os.path.exists(path):
         shutil.rmtree(path)
         messagebox.showinfo("Deleted", f"Deleted {person}")
@@ -112,7 +170,9 @@ def update_person():
         path = os.path.join(DB_PATH, person)
         os.makedirs(path, exist_ok=True)
         filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        cv2.imwrite(os.path.join(path, filename), frame)
+        filepath = os.path.join(path, filename)
+        cv2.imwrite(filepath, frame)
+        enroll_image(person, filepath, frame)
         messagebox.showinfo("Updated", f"Image added to {person}")
 
 person_var = tk.StringVar()
@@ -134,72 +194,76 @@ def capture_face():
     person_path = os.path.join(DB_PATH, name)
     os.makedirs(person_path, exist_ok=True)
     filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-    cv2.imwrite(os.path.join(person_path, filename), frame)
+    filepath = os.path.join(person_path, filename)
+    cv2.imwrite(filepath, frame)
+    enroll_image(name, filepath, frame)
     messagebox.showinfo("Saved", f"Image saved to {person_path}")
     refresh_people()
 
+recognition_worker = None
+
+def recognize_frame(frame):
+    # Uses the selected model once it is warm, the previous one until then
+    faces = registry.recognize(frame)
+    if faces is None:
+        return []
+    startup.mark("first_recognition")
+    return faces
+
 def start_attendance():
-    def detect_loop():
-        ret, frame = cap.read()
-        if not ret:
-            root.after(1000, detect_loop)
-            return
-
-        try:
-            res = DeepFace.find(
-                frame,
-                db_path=DB_PATH,
-                enforce_detection=False,
-                model_name=selected_model.get(),
-                detector_backend='opencv'
-            )
-            if len(res) > 0 and len(res[0]) > 0:
-                best = res[0].iloc[0]
-                name = best['identity'].split(os.path.sep)[-2]
-                now = datetime.now()
-                if name not in attendance:
-                    attendance[name] = {"entry": now.strftime("%Y-%m-%d %H:%M:%S"), "exit": None}
-                last_seen[name] = now
-
-        except Exception as e:
-            print("[WARN]", e)
-
-        now = datetime.now()
-        for name in list(attendance.keys()):
-            if name in last_seen:
-                if (now - last_seen[name]).total_seconds() > EXIT_TIMEOUT_SEC and attendance[name]["exit"] is None:
-                    attendance[name]["exit"] = now.strftime("%Y-%m-%d %H:%M:%S")
-                    df = pd.read_csv(CSV_FILE)
-                    df = pd.concat([df, pd.DataFrame([{
-                        "Name": name,
-                        "Entry Time": attendance[name]["entry"],
-                        "Exit Time": attendance[name]["exit"]
-                    }])], ignore_index=True)
-                    df.to_csv(CSV_FILE, index=False)
-                    update_table()
-                    del attendance[name]
-                    del last_seen[name]
-
-        root.after(1000, detect_loop)
-
-    detect_loop()
+    # Recognition runs on a worker thread; the Tk thread only collects results
+    global recognition_worker
+    if recognition_worker is not None:
+        return
+    recognition_worker = RecognitionWorker(recognize_frame, min_interval=RECOGNITION_INTERVAL_SEC).start()
+    poll_results()
+
+def poll_results():
+    for timestamp, res in recognition_worker.poll():
+        faces = [f for f in res if f["name"] is not None]
+        if faces:
+            name = faces[0]["name"]
+            session = sessions.seen(name, wall_time=timestamp)
+            if session is not None:
+                writer.open_session(name, session.entry_time)
+
+    # Exits due since the last poll, without scanning everyone present
+    for session in sessions.expire():
+        row = sessions.row(session)
+        writer.close_session(session.name, row)
+        add_table_row(row)
+
+    root.after(POLL_INTERVAL_MS, poll_results)
 
 # === Live Camera Feed ===
 def update_frame():
     ret, frame = cap.read()
     if ret:
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame)
-        imgtk = ImageTk.PhotoImage(image=img)
-        video_frame.imgtk = imgtk
-        video_frame.configure(image=imgtk)
+        startup.mark("first_frame")
+        metrics.incr("frames_captured")
+        if recognition_worker is not None:
+            recognition_worker.submit(frame)
+        with metrics.timer("display"):
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            img = Image.fromarray(frame)
+            imgtk = ImageTk.PhotoImage(image=img)
+            video_frame.imgtk = imgtk
+            video_frame.configure(image=imgtk)
+    model_status.config(text=registry.status())
     root.after(10, update_frame)
 
 update_table()
 update_frame()
+metrics.start_logging()
+if METRICS_PORT:
+    metrics.serve(METRICS_PORT)
 
 # === Graceful Exit ===
 def on_close():
+    if recognition_worker is not None:
+        recognition_worker.stop()
+    registry.stop()
+    writer.close()
     cap.release()
     root.destroy()
 
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+# === Configuration ===
+INDEX_KIND = "ivf"          # "flat" (exact) or "ivf" (clustered, approximate)
+INDEX_AGGREGATE = True      # search one prototype per person, then rerank that person's images
+INDEX_MIN_IMAGES = 20000    # below this an exhaustive scan is already sub-millisecond
+NPROBE = 16                 # IVF lists scanned per query: higher is slower with better recall
+RERANK_PEOPLE = 8           # people whose images are compared exactly per query (aggregate mode)
+KMEANS_ITERS = 20
+TRAIN_SAMPLE = 50000        # rows used to train the IVF centroids
+ASSIGN_CHUNK = 8192         # rows per assignment matmul, bounds temporary memory
+
+
+# === Helpers ===
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def fingerprint(matrix):
+    """Cheap identity of a gallery matrix: row count plus a hash of ~1000 sampled rows."""
+    step = max(1, len(matrix) // 1024)
+    digest = hashlib.sha1(np.ascontiguousarray(matrix[::step], dtype=np.float32).tobytes()).hexdigest()
+    return f"{len(matrix)}:{digest}"
+
+
+def assign(vectors, centroids):
+    """Index of the most similar centroid for every row, computed in chunks."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        labels[start:start + ASSIGN_CHUNK] = np.argmax(vectors[start:start + ASSIGN_CHUNK] @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(vectors, k, iters=KMEANS_ITERS, seed=0):
+    """Spherical k-means on unit vectors; returns k unit-norm centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iters):
+        labels = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=k)
+        empty = np.flatnonzero(counts == 0)
+        # Empty clusters restart from random rows
+        sums[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def top_k(candidates, similarity, k):
+    """The k best (ids, similarities) of one query, best first."""
+    if len(candidates) > k:
+        best = np.argpartition(-similarity, k - 1)[:k]
+        candidates, similarity = candidates[best], similarity[best]
+    order = np.argsort(-similarity)
+    return candidates[order], similarity[order]
+
+
+def pad_results(results, k):
+    """Stack per-query results into (n, k) arrays; missing slots are id -1 at similarity -1."""
+    ids = np.full((len(results), k), -1, dtype=np.int64)
+    sims = np.full((len(results), k), -1.0, dtype=np.float32)
+    for i, (row_ids, row_sims) in enumerate(results):
+        ids[i, :len(row_ids)] = row_ids
+        sims[i, :len(row_sims)] = row_sims
+    return ids, sims
+
+
+def to_csr(lists):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ids) for ids in lists])
+    flat = np.concatenate(lists).astype(np.int64) if lists else np.zeros(0, dtype=np.int64)
+    return flat, offsets
+
+
+def from_csr(flat, offsets):
+    return [flat[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+# === Indexes ===
+# Every index maps query vectors to row numbers of the gallery matrix it was
+# built on. search() is handed that matrix, so the vectors are never copied.
+class FlatIndex:
+    """Exact search: every row is compared. The baseline for recall checks."""
+
+    kind = "flat"
+
+    def build(self, matrix, names=None, centroids=None):
+        return self
+
+    def search(self, queries, matrix, k):
+        results = []
+        for query in queries:
+            similarity = matrix @ query
+            results.append(top_k(np.arange(len(matrix)), similarity, min(k, len(matrix))))
+        return pad_results(results, k)
+
+    def add(self, row, vector, name=None):
+        pass
+
+    def remap(self, keep, old_count, matrix, names):
+        return self
+
+    def params(self):
+        return {}
+
+    def arrays(self):
+        return {}
+
+    @classmethod
+    def restore(cls, params, arrays):
+        return cls()
+
+
+class IVFIndex:
+    """Inverted-file index: rows are bucketed by their nearest k-means centroid.
+
+    A query scans only the nprobe buckets whose centroids are closest, so the
+    cost is about nprobe / nlist of an exhaustive scan. Raising nprobe trades
+    speed for recall; nprobe = nlist is exact.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, nlist=None, nprobe=NPROBE):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.lists = []
+
+    def build(self, matrix, names=None, centroids=None):
+        """Train centroids (unless given, e.g. from a previous index) and bucket every row."""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if centroids is None:
+            nlist = self.nlist or int(4 * np.sqrt(len(matrix)))
+            nlist = max(1, min(nlist, len(matrix)))
+            rng = np.random.default_rng(0)
+            sample = matrix[rng.choice(len(matrix), size=min(TRAIN_SAMPLE, len(matrix)), replace=False)]
+            centroids = kmeans(sample, nlist)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nlist = len(self.centroids)
+        labels = assign(matrix, self.centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.searchsorted(labels[order], np.arange(self.nlist + 1))
+        self.lists = from_csr(order.astype(np.int64), offsets)
+        return self
+
+    def search(self, queries, matrix, k):
+        nprobe = min(self.nprobe, self.nlist)
+        probe_sims = queries @ self.centroids.T
+        if nprobe < self.nlist:
+            probes = np.argpartition(-probe_sims, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.nlist), (len(queries), self.nlist))
+        results = []
+        for query, probe in zip(queries, probes):
+            candidates = np.concatenate([self.lists[c] for c in probe])
+            # Rows added after the caller took its matrix snapshot are not visible yet
+            candidates = candidates[candidates < len(matrix)]
+            similarity = matrix[candidates] @ query
+            results.append(top_k(candidates, similarity, min(k, len(candidates))))
+        return pad_results(results, k)
+
+    def add(self, row, vector, name=None):
+        c = int(np.argmax(self.centroids @ vector))
+        # Replace rather than grow in place so concurrent searches see a whole list
+        self.lists[c] = np.append(self.lists[c], row)
+
+    def remap(self, keep, old_count, matrix, names):
+        """New index for the gallery that kept only old rows `keep` (in their new order)."""
+        new_ids = np.full(old_count, -1, dtype=np.int64)
+        new_ids[keep] = np.arange(len(keep))
+        index = IVFIndex(self.nlist, self.nprobe)
+        index.centroids = self.centroids
+        for ids in self.lists:
+            ids = new_ids[ids]
+            index.lists.append(ids[ids >= 0])
+        return index
+
+    def params(self):
+        return {"nlist": self.nlist, "nprobe": self.nprobe}
+
+    def arrays(self):
+        flat, offsets = to_csr(self.lists)
+        return {"centroids": self.centroids, "list_ids": flat, "list_offsets": offsets}
+
+    @classmethod
+    def restore(cls, params, arrays):
+        index = cls(params["nlist"], params["nprobe"])
+        index.centroids = arrays["centroids"]
+        index.lists = from_csr(arrays["list_ids"], arrays["list_offsets"])
+        return index
+
+
+class PersonIndex:
+    """Two-stage search over the database/<name>/*.jpg layout.
+
+    Each person is represented by the normalized mean of their images. The
+    base index (flat or IVF) finds the `rerank` closest people, and only
+    their images are then compared exactly. Results are still image rows
+    with exact distances, so the gallery threshold keeps its meaning, but
+    the first stage searches people instead of images.
+    """
+
+    kind = "person"
+
+    def __init__(self, base, rerank=RERANK_PEOPLE):
+        self.base = base
+        self.rerank = rerank
+        self.people = []
+        self.person_ids = {}
+        self.rows = []
+        self.sums = None
+        self.prototypes = None
+
+    def build(self, matrix, names, centroids=None):
+        names = np.asarray(names, dtype=object)
+        self.people = list(dict.fromkeys(names))
+        self.person_ids = {name: i for i, name in enumerate(self.people)}
+        labels = np.array([self.person_ids[name] for name in names], dtype=np.int64)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.searchsorted(labels[order], np.arange(len(self.people) + 1))
+        self.rows = from_csr(order.astype(np.int64), offsets)
+        self.sums = np.zeros((len(self.people), matrix.shape[1]), dtype=np.float32)
+        np.add.at(self.sums, labels, matrix)
+        self.prototypes = normalize(self.sums)
+        self.base.build(self.prototypes, self.people, centroids=centroids)
+        return self
+
+    def search(self, queries, matrix, k):
+        person_ids, _ = self.base.search(queries, self.prototypes, min(self.rerank, len(self.people)))
+        results = []
+        for query, people in zip(queries, person_ids):
+            candidates = np.concatenate([self.rows[p] for p in people if p >= 0] or [np.zeros(0, np.int64)])
+            candidates = candidates[candidates < len(matrix)]
+            similarity = matrix[candidates] @ query
+            results.append(top_k(candidates, similarity, min(k, len(candidates))))
+        return pad_results(results, k)
+
+    def add(self, row, vector, name=None):
+        pid = self.person_ids.get(name)
+        if pid is None:
+            # New person: grow the prototype arrays (copies, so readers keep a consistent view)
+            pid = len(self.people)
+            self.sums = np.vstack([self.sums, vector[np.newaxis]])
+            self.prototypes = np.vstack([self.prototypes, normalize(vector)[np.newaxis]])
+            self.rows.append(np.array([row], dtype=np.int64))
+            self.people.append(name)
+            self.person_ids[name] = pid
+            self.base.add(pid, self.prototypes[pid], name)
+            return
+        self.rows[pid] = np.append(self.rows[pid], row)
+        self.sums[pid] += vector
+        self.prototypes[pid] = normalize(self.sums[pid])
+
+    def remap(self, keep, old_count, matrix, names):
+        """New index rebuilt after rows were dropped (a person was deleted); IVF centroids are reused."""
+        index = PersonIndex(type(self.base)(**self.base.params()), self.rerank)
+        return index.build(matrix, names, getattr(self.base, "centroids", None))
+
+    def params(self):
+        return {"rerank": self.rerank, "base_kind": self.base.kind, "base": self.base.params()}
+
+    def arrays(self):
+        flat, offsets = to_csr(self.rows)
+        arrays = {"person_rows": flat, "person_offsets": offsets, "sums": self.sums,
+                  "people": np.array(self.people, dtype=np.str_)}
+        arrays.update({f"base_{key}": value for key, value in self.base.arrays().items()})
+        return arrays
+
+    @classmethod
+    def restore(cls, params, arrays):
+        base_arrays = {key[5:]: value for key, value in arrays.items() if key.startswith("base_")}
+        base = INDEX_TYPES[params["base_kind"]].restore(params["base"], base_arrays)
+        index = cls(base, params["rerank"])
+        index.people = [str(name) for name in arrays["people"]]
+        index.person_ids = {name: i for i, name in enumerate(index.people)}
+        index.rows = from_csr(arrays["person_rows"], arrays["person_offsets"])
+        index.sums = np.array(arrays["sums"], dtype=np.float32)
+        index.prototypes = normalize(index.sums)
+        return index
+
+
+INDEX_TYPES = {"flat": FlatIndex, "ivf": IVFIndex, "person": PersonIndex}
+
+
+# === Construction and Persistence ===
+def create_index(kind=INDEX_KIND, aggregate=INDEX_AGGREGATE, nprobe=NPROBE, rerank=RERANK_PEOPLE):
+    base = IVFIndex(nprobe=nprobe) if kind == "ivf" else FlatIndex()
+    return PersonIndex(base, rerank) if aggregate else base
+
+
+def save_index(index, path, matrix):
+    """Write index to path (.npz) together with the fingerprint of the matrix it indexes."""
+    meta = {"kind": index.kind, "params": index.params(), "fingerprint": fingerprint(matrix)}
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, meta=np.array(json.dumps(meta)), **index.arrays())
+    os.replace(tmp_path, path)
+
+
+def load_index(path):
+    """(index, fingerprint) from a file written by save_index."""
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data["meta"]))
+        arrays = {key: data[key] for key in data.files if key != "meta"}
+    return INDEX_TYPES[meta["kind"]].restore(meta["params"], arrays), meta["fingerprint"]
+
+
+def open_index(path, matrix, names, kind=INDEX_KIND, aggregate=INDEX_AGGREGATE, nprobe=NPROBE,
+               rerank=RERANK_PEOPLE):
+    """Load the index at path if it still matches matrix, otherwise (re)build and save it.
+
+    A stale IVF index keeps its trained centroids, so after enrollments only
+    the cheap bucket assignment is redone, not k-means.
+    """
+    start = time.time()
+    index = create_index(kind, aggregate, nprobe, rerank)
+    previous = None
+    if path and os.path.exists(path):
+        try:
+            previous, stored_fingerprint = load_index(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] Ignoring unreadable index {path}:", str(e))
+        else:
+            if previous.kind == index.kind and stored_fingerprint == fingerprint(matrix):
+                print(f"[INFO] Index loaded from {path} in {time.time() - start:.2f}s")
+                return previous
+
+    centroids = getattr(getattr(previous, "base", previous), "centroids", None)
+    if centroids is not None and centroids.shape[1] != matrix.shape[1]:
+        centroids = None
+    index.build(matrix, names, centroids=centroids)
+    if path:
+        save_index(index, path, matrix)
+    print(f"[INFO] Index built ({index.kind}) for {len(matrix)} images in {time.time() - start:.2f}s")
+    return index
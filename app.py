@@ -2,25 +2,41 @@ import tkinter as tk
 from tkinter import messagebox
 import cv2
 import os
+import threading
 from datetime import datetime
-import pandas as pd
-from deepface import DeepFace
 from PIL import Image, ImageTk
+from gallery import Gallery
+from loader import BackgroundLoader, load_gallery, startup
+from pipeline import RecognitionWorker
+from metrics import metrics
+from attendance_log import AttendanceWriter
+from attendance_store import AttendanceStore
+from sessions import SessionTable
 
 # Paths
 DB_PATH = "database"
 CSV_FILE = "attendance.csv"
+STORE_DIR = "attendance_store"
 EXIT_TIMEOUT_SEC = 10
+RECOGNITION_INTERVAL_SEC = 1.0  # minimum time between recognitions on the worker thread
+POLL_INTERVAL_MS = 100          # how often the UI collects recognition results
+METRICS_PORT = None             # e.g. 9100 to serve Prometheus metrics at /metrics
 
 # Attendance state
-attendance = {}
-last_seen = {}
+sessions = SessionTable(EXIT_TIMEOUT_SEC)
 
 # Ensure folders
 os.makedirs(DB_PATH, exist_ok=True)
-if not os.path.exists(CSV_FILE):
-    df = pd.DataFrame(columns=["Name", "Entry Time", "Exit Time"])
-    df.to_csv(CSV_FILE, index=False)
+store = AttendanceStore.open(STORE_DIR, CSV_FILE)
+writer = AttendanceWriter(CSV_FILE, store=store)
+
+# Sessions left open by a crash resume; they exit normally if the person is gone
+for name, entry_time in writer.recover().items():
+    sessions.restore(name, entry_time)
+
+# Recognition gallery (embeddings loaded once, matched in memory). TensorFlow and
+# the model load in the background so the window and preview appear at once
+loader = BackgroundLoader(lambda l: load_gallery(l, DB_PATH, model_name='Facenet', detector_backend='opencv')).start()
 
 # === GUI Setup ===
 root = tk.Tk()
@@ -36,6 +52,10 @@ name_label.grid(row=1, column=0, padx=5, pady=5)
 name_entry = tk.Entry(root)
 name_entry.grid(row=1, column=1, padx=5, pady=5)
 
+# Recognition status
+status_label = tk.Label(root, text=loader.status)
+status_label.grid(row=3, column=0, columnspan=3)
+
 # Initialize Camera
 cap = cv2.VideoCapture(0)
 
@@ -43,11 +63,17 @@ cap = cv2.VideoCapture(0)
 def update_frame():
     ret, frame = cap.read()
     if ret:
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
-        imgtk = ImageTk.PhotoImage(image=img)
-        camera_label.imgtk = imgtk
-        camera_label.configure(image=imgtk)
+        startup.mark("first_frame")
+        metrics.incr("frames_captured")
+        if recognition_worker is not None:
+            recognition_worker.submit(frame)
+        with metrics.timer("display"):
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            img = Image.fromarray(frame_rgb)
+            imgtk = ImageTk.PhotoImage(image=img)
+            camera_label.imgtk = imgtk
+            camera_label.configure(image=imgtk)
+    status_label.config(text=loader.status)
     camera_label.after(10, update_frame)
 
 # Capture and Save Face
@@ -65,64 +91,48 @@ def capture_face():
     filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
     filepath = os.path.join(person_path, filename)
     cv2.imwrite(filepath, frame)
+    # Embed only the new photo, in the background (once the gallery has loaded)
+    threading.Thread(target=loader.when_ready, args=(Gallery.enroll, name, filepath, frame), daemon=True).start()
     messagebox.showinfo("Success", f"Image saved to {filepath}")
 
 # Start Attendance Monitoring
+recognition_worker = None
+
+def recognize_frame(frame):
+    # No faces until the gallery and model are loaded; exits are still checked
+    gallery = loader.get()
+    if gallery is None:
+        return []
+    faces = gallery.recognize(frame)
+    startup.mark("first_recognition")
+    return faces
+
 def start_attendance():
-    global attendance, last_seen
+    # Recognition runs on a worker thread; the Tk thread only collects results
+    global recognition_worker
+    if recognition_worker is not None:
+        return
     print("[INFO] Attendance system started...")
-
-    def detect_loop():
-        ret, frame = cap.read()
-        if not ret:
-            root.after(1000, detect_loop)
-            return
-
-        try:
-            res = DeepFace.find(
-                frame,
-                db_path=DB_PATH,
-                enforce_detection=False,
-                model_name='Facenet',
-                detector_backend='opencv'
-            )
-
-            if len(res) > 0 and len(res[0]) > 0:
-                best = res[0].iloc[0]
-                name = best['identity'].split(os.path.sep)[-2]
-
-                now = datetime.now()
-                if name not in attendance:
-                    attendance[name] = {"entry": now.strftime("%Y-%m-%d %H:%M:%S"), "exit": None}
-                    print(f"[ENTRY] {name} at {attendance[name]['entry']}")
-
-                last_seen[name] = now
-
-        except Exception as e:
-            print("[WARN]", str(e))
-
-        now = datetime.now()
-        for name in list(attendance.keys()):
-            if name in last_seen:
-                if (now - last_seen[name]).total_seconds() > EXIT_TIMEOUT_SEC and attendance[name]["exit"] is None:
-                    attendance[name]["exit"] = now.strftime("%Y-%m-%d %H:%M:%S")
-                    print(f"[EXIT] {name} at {attendance[name]['exit']}")
-
-                    # Save to CSV
-                    df = pd.read_csv(CSV_FILE)
-                    df = pd.concat([df, pd.DataFrame([{
-                        "Name": name,
-                        "Entry Time": attendance[name]["entry"],
-                        "Exit Time": attendance[name]["exit"]
-                    }])], ignore_index=True)
-                    df.to_csv(CSV_FILE, index=False)
-
-                    del attendance[name]
-                    del last_seen[name]
-
-        root.after(1000, detect_loop)
-
-    detect_loop()
+    recognition_worker = RecognitionWorker(recognize_frame, min_interval=RECOGNITION_INTERVAL_SEC).start()
+    poll_results()
+
+def poll_results():
+    for timestamp, res in recognition_worker.poll():
+        faces = [f for f in res if f["name"] is not None]
+        if faces:
+            name = faces[0]["name"]
+            session = sessions.seen(name, wall_time=timestamp)
+            if session is not None:
+                writer.open_session(name, session.entry_time)
+                print(f"[ENTRY] {name} at {session.entry_time}")
+
+    # Exits due since the last poll, without scanning everyone present
+    for session in sessions.expire():
+        row = sessions.row(session)
+        print(f"[EXIT] {session.name} at {row['Exit Time']}")
+        writer.close_session(session.name, row)
+
+    root.after(POLL_INTERVAL_MS, poll_results)
 
 # Buttons
 tk.Button(root, text="Capture & Save", command=capture_face).grid(row=1, column=2, padx=5, pady=5)
@@ -130,9 +140,15 @@ tk.Button(root, text="Start Attendance", command=start_attendance).grid(row=2, c
 
 # Start webcam loop
 update_frame()
+metrics.start_logging()
+if METRICS_PORT:
+    metrics.serve(METRICS_PORT)
 
 # Exit cleanup
 def on_closing():
+    if recognition_worker is not None:
+        recognition_worker.stop()
+    writer.close()
     cap.release()
     root.destroy()
 
@@ -0,0 +1,171 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+from metrics import metrics
+
+# === Configuration ===
+ATTENDANCE_COLUMNS = ["Name", "Entry Time", "Exit Time"]
+FLUSH_INTERVAL_SEC = 1.0
+FLUSH_BATCH_SIZE = 64
+FSYNC_POLICY = "batch"  # "always": after every row, "batch": once per flush, "never": leave it to the OS
+
+
+# === Attendance Writer ===
+class AttendanceWriter:
+    """Append-only attendance CSV fed by a background flush thread.
+
+    Rows are queued by write() and appended to the CSV in batches, so the
+    video loop never reads or rewrites the existing history. Open sessions
+    are recorded in a small JSON-lines journal next to the CSV
+    (<csv>.sessions); a session is marked closed only after its row has been
+    written, so after a crash recover() returns every session that had been
+    opened but not yet logged.
+
+    With a `store` (attendance_store.AttendanceStore) every flushed batch is
+    also added to the day-partitioned store used for queries.
+    """
+
+    def __init__(self, csv_file, columns=ATTENDANCE_COLUMNS, flush_interval=FLUSH_INTERVAL_SEC,
+                 batch_size=FLUSH_BATCH_SIZE, fsync=FSYNC_POLICY, store=None):
+        if fsync not in ("always", "batch", "never"):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.csv_file = csv_file
+        self.journal_file = csv_file + ".sessions"
+        self.columns = list(columns)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.store = store
+        self.pending = queue.Queue()
+        self.flushed = threading.Condition()
+        self.enqueued = 0
+        self.written = 0
+        self.rows_written = 0
+
+        if not os.path.exists(csv_file) or os.path.getsize(csv_file) == 0:
+            with open(csv_file, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow(self.columns)
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self.thread.start()
+
+    # --- Public API ---
+    def write(self, row):
+        """Queue one attendance row (a dict keyed by column name)."""
+        self._enqueue(("row", row, None))
+
+    def open_session(self, key, data):
+        """Journal an open session so it survives a crash.
+
+        key is a string or a tuple of strings (e.g. (door, name)), kept as
+        separate fields rather than joined; data must be JSON-serializable.
+        """
+        self._enqueue(("open", key, data))
+
+    def close_session(self, key, row):
+        """Queue the session's attendance row and mark it closed once the row is on disk."""
+        self._enqueue(("row", row, key))
+
+    def recover(self):
+        """Sessions opened but never closed by a previous run, as {key: data}.
+
+        The journal is compacted to exactly these sessions, so callers that
+        resume them keep them protected.
+        """
+        sessions = {}
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn write at crash time
+                    key = record["key"]
+                    key = tuple(key) if isinstance(key, list) else key  # JSON stores tuple keys as lists
+                    if record["op"] == "open":
+                        sessions[key] = record["data"]
+                    elif record["op"] == "close":
+                        sessions.pop(key, None)
+
+        tmp_file = self.journal_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for key, data in sessions.items():
+                f.write(json.dumps({"op": "open", "key": key, "data": data}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+        if sessions:
+            print(f"[INFO] Recovered {len(sessions)} open session(s) from {self.journal_file}")
+        return sessions
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far is on disk."""
+        with self.flushed:
+            target = self.enqueued
+            return self.flushed.wait_for(lambda: self.written >= target, timeout)
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=10)
+        self._flush_pending()
+
+    # --- Flush Thread ---
+    def _enqueue(self, item):
+        with self.flushed:
+            self.enqueued += 1
+        self.pending.put(item)
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.flush_interval)
+            self._flush_pending()
+
+    def _flush_pending(self):
+        while not self.pending.empty():
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            with metrics.timer("log_flush"):
+                self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        rows = [(row, key) for kind, row, key in batch if kind == "row"]
+        journal = [{"op": "open", "key": key, "data": data} for kind, key, data in batch if kind == "open"]
+
+        if rows:
+            with open(self.csv_file, "a", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=self.columns, extrasaction="ignore")
+                for row, _ in rows:
+                    writer.writerow(row)
+                    if self.fsync == "always":
+                        f.flush()
+                        os.fsync(f.fileno())
+                if self.fsync == "batch":
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.rows_written += len(rows)
+            metrics.incr("rows_logged", len(rows))
+            if self.store is not None:
+                self.store.append([row for row, _ in rows])
+
+        # Close records go after their rows are durable
+        journal.extend({"op": "close", "key": key} for _, key in rows if key is not None)
+        if journal:
+            with open(self.journal_file, "a", encoding="utf-8") as f:
+                for record in journal:
+                    f.write(json.dumps(record) + "\n")
+                if self.fsync != "never":
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        with self.flushed:
+            self.written += len(batch)
+            self.flushed.notify_all()
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# === Configuration ===
+STORE_COLUMNS = ["Name", "Entry Time", "Exit Time", "Camera"]
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# === Attendance Store ===
+class AttendanceStore:
+    """Attendance sessions partitioned by day into compressed columnar files.
+
+    Each day is one <root>/<YYYY-MM-DD>.npz holding one array per column,
+    partitioned by the session's entry date. index.json records the row count
+    of every day and the days each person appears on, so a day export, a
+    person's history or today's table read only the partitions they need.
+
+    Several processes (GUI.py, app.py, face.py) may share one root: append()
+    holds an exclusive lock on <root>/.lock while it re-reads the index and
+    rewrites a partition, so no writer overwrites another's rows.
+    """
+
+    def __init__(self, root, columns=STORE_COLUMNS):
+        self.root = root
+        self.columns = list(columns)
+        self.index_file = os.path.join(root, "index.json")
+        self.lock_file = os.path.join(root, ".lock")
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.index = {"dates": {}, "names": {}}
+        self.index_mtime = None
+        self.refresh()
+
+    @classmethod
+    def open(cls, root, csv_file=None):
+        """Open the store, migrating csv_file into it the first time."""
+        first_run = not os.path.exists(os.path.join(root, "index.json"))
+        store = cls(root)
+        if first_run and csv_file and os.path.exists(csv_file):
+            migrate(csv_file, store)
+        return store
+
+    def refresh(self):
+        """Reload index.json if another process has changed it."""
+        with self.lock:
+            self._load_index()
+
+    def _load_index(self, force=False):
+        if not os.path.exists(self.index_file):
+            return
+        mtime = os.path.getmtime(self.index_file)
+        if force or mtime != self.index_mtime:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+            self.index_mtime = mtime
+
+    # --- Writing ---
+    def append(self, rows):
+        """Add session rows (dicts keyed by column); rewrites only the affected days."""
+        by_date = {}
+        for row in rows:
+            date_str = str(row.get("Entry Time", ""))[:10]
+            try:
+                datetime.strptime(date_str, "%Y-%m-%d")
+            except ValueError:
+                print(f"[WARN] Skipping attendance row without a valid entry time: {row}")
+                continue
+            by_date.setdefault(date_str, []).append(row)
+
+        if not by_date:
+            return
+        with self.lock, FileLock(self.lock_file):
+            # Another process may have appended since our last look
+            self._load_index(force=True)
+            for date_str, day_rows in by_date.items():
+                existing = self._read_partition(date_str)
+                added = pd.DataFrame(day_rows).reindex(columns=self.columns)
+                day = pd.concat([existing, added], ignore_index=True) if len(existing) else added
+                self._write_partition(date_str, day)
+                self.index["dates"][date_str] = len(day)
+                for name in added["Name"].astype(str).unique():
+                    dates = self.index["names"].setdefault(name, [])
+                    if date_str not in dates:
+                        dates.append(date_str)
+                        dates.sort()
+            self._save_index()
+
+    def _partition_file(self, date_str):
+        return os.path.join(self.root, f"{date_str}.npz")
+
+    def _write_partition(self, date_str, df):
+        tmp_file = os.path.join(self.root, f"{date_str}.tmp.npz")
+        columns = {f"col{i}": df[col].fillna("").astype(str).to_numpy(dtype=np.str_)
+                   for i, col in enumerate(self.columns)}
+        np.savez_compressed(tmp_file, **columns)
+        os.replace(tmp_file, self._partition_file(date_str))
+
+    def _save_index(self):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self.index_file)
+        self.index_mtime = os.path.getmtime(self.index_file)
+
+    # --- Queries ---
+    def _read_partition(self, date_str):
+        path = self._partition_file(date_str)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=self.columns)
+        with np.load(path) as data:
+            # Partitions written before a column existed read it as empty
+            return pd.DataFrame({col: data[f"col{i}"] if f"col{i}" in data.files else ""
+                                 for i, col in enumerate(self.columns)})
+
+    def read_day(self, date_str):
+        """All sessions that started on date_str (YYYY-MM-DD)."""
+        with self.lock:
+            return self._read_partition(date_str)
+
+    def today(self):
+        return self.read_day(datetime.now().strftime("%Y-%m-%d"))
+
+    def history(self, name):
+        """Every session of one person, reading only the days they appear on."""
+        with self.lock:
+            dates = list(self.index["names"].get(name, []))
+            frames = [self._read_partition(d) for d in dates]
+        if not frames:
+            return pd.DataFrame(columns=self.columns)
+        df = pd.concat(frames, ignore_index=True)
+        return df[df["Name"] == name].reset_index(drop=True)
+
+    def dates(self):
+        return sorted(self.index["dates"])
+
+    def people(self):
+        return sorted(self.index["names"])
+
+
+class FileLock:
+    """Exclusive lock on path shared by every process, held for a with block."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+
+# === Migration ===
+def sessions_from_events(df):
+    """Convert face_demo.py's Name/Status/Time/Duration event log into sessions."""
+    rows = []
+    open_entries = {}
+    for _, event in df.iterrows():
+        name, status, time_str = str(event["Name"]), str(event["Status"]), str(event["Time"])
+        if status == "PRESENT":
+            open_entries[name] = time_str
+            continue
+        duration = parse_duration(event.get("Duration"))
+        entry = open_entries.pop(name, None)
+        if entry is None and duration is not None:
+            entry = (datetime.strptime(time_str, TIME_FORMAT) - duration).strftime(TIME_FORMAT)
+        if entry is None:
+            entry = time_str
+        exit_time = time_str
+        if status == "LEFT" and duration is not None:
+            # LEFT is logged EXIT_TIMEOUT_SEC after the last sighting; Duration ends at it
+            exit_time = (datetime.strptime(entry, TIME_FORMAT) + duration).strftime(TIME_FORMAT)
+        rows.append({"Name": name, "Entry Time": entry, "Exit Time": exit_time})
+    for name, entry in open_entries.items():
+        rows.append({"Name": name, "Entry Time": entry, "Exit Time": ""})
+    return rows
+
+
+def parse_duration(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == "":
+        return None
+    try:
+        return pd.to_timedelta(str(value)).to_pytimedelta()
+    except ValueError:
+        return None
+
+
+def migrate(csv_file, store):
+    """Load an attendance CSV of either schema into store. Returns the number of sessions."""
+    df = pd.read_csv(csv_file, dtype=str)
+    if {"Status", "Time"}.issubset(df.columns):
+        rows = sessions_from_events(df)
+    elif {"Entry Time", "Exit Time"}.issubset(df.columns):
+        rows = df.reindex(columns=STORE_COLUMNS).fillna("").to_dict("records")
+    else:
+        raise ValueError(f"Unrecognized attendance schema in {csv_file}: {list(df.columns)}")
+    store.append(rows)
+    print(f"[INFO] Migrated {len(rows)} sessions from {csv_file} into {store.root}")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate attendance CSV files into the partitioned store.")
+    parser.add_argument("csv_files", nargs="+", help="attendance CSV files (Entry/Exit or Status/Time schema)")
+    parser.add_argument("--store", default="attendance_store", help="store directory")
+    args = parser.parse_args()
+
+    store = AttendanceStore(args.store)
+    for csv_file in args.csv_files:
+        migrate(csv_file, store)
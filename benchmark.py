@@ -0,0 +1,302 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+# === Configuration ===
+DB_PATH = "database"
+OUTPUT_FILE = "benchmark.json"
+DETECTORS = ["opencv", "mtcnn", "ssd", "retinaface", "yolov8", "fastmtcnn"]
+MODELS = ["Facenet", "VGG-Face", "ArcFace", "DeepFace"]
+WARMUP_FRAMES = 2       # processed but not timed (graph tracing, lazy detector init)
+STAGES = ["decode", "detect", "align", "preprocess", "embed", "match", "log"]
+
+
+# === Inputs ===
+def iter_frames(source, stride=1, max_frames=None):
+    """(label, key, frame, decode_sec) for every frame of a video file or image folder.
+
+    Images inside person sub-folders (the database layout) are labeled with
+    the folder name, so matching accuracy can be scored; video frames and
+    loose images have label None.
+    """
+    from gallery import list_images, person_name
+
+    count = 0
+    if os.path.isdir(source):
+        for i, path in enumerate(list_images(source)):
+            if i % stride:
+                continue
+            start = time.perf_counter()
+            frame = cv2.imread(path)
+            decode_sec = time.perf_counter() - start
+            if frame is None:
+                print(f"[WARN] Could not read {path}")
+                continue
+            nested = os.path.dirname(os.path.abspath(path)) != os.path.abspath(source)
+            yield (person_name(path) if nested else None), os.path.abspath(path), frame, decode_sec
+            count += 1
+            if max_frames and count >= max_frames:
+                return
+        return
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open {source}")
+    index = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            decode_sec = time.perf_counter() - start
+            if not ret:
+                break
+            index += 1
+            if (index - 1) % stride:
+                continue
+            yield None, f"{os.path.basename(source)}#{index}", frame, decode_sec
+            count += 1
+            if max_frames and count >= max_frames:
+                break
+    finally:
+        cap.release()
+
+
+# === Measurement ===
+def summarize(samples):
+    """Latency percentiles in milliseconds for one stage."""
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it cannot be read."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS bytes
+        return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def align_faces(frame, faces):
+    """Eye-aligned crops of extract_faces(align=False) results, cut the way extract_faces(align=True) does.
+
+    DeepFace aligns inside extract_faces, so detection is run without it and
+    the same rotation is repeated here to time the two apart.
+    """
+    from deepface.modules.detection import align_img_wrt_eyes, project_facial_area
+
+    height, width = frame.shape[:2]
+    border_y, border_x = int(0.5 * height), int(0.5 * width)
+    img = cv2.copyMakeBorder(frame, border_y, border_y, border_x, border_x, cv2.BORDER_CONSTANT, value=[0, 0, 0])
+    for face in faces:
+        area = face["facial_area"]
+        eyes = [(e[0] + border_x, e[1] + border_y) if e is not None else None
+                for e in (area.get("left_eye"), area.get("right_eye"))]
+        aligned, angle = align_img_wrt_eyes(img, *eyes)
+        x1, y1 = area["x"] + border_x, area["y"] + border_y
+        x1, y1, x2, y2 = project_facial_area((x1, y1, x1 + area["w"], y1 + area["h"]), angle, img.shape[:2])
+        crop = aligned[int(y1):int(y2), int(x1):int(x2)]
+        if crop.size:
+            face["face"] = crop[:, :, ::-1] / 255.0
+    return faces
+
+
+def best_match(gallery, embedding, exclude_key):
+    """(name, distance) of the closest gallery row whose image is not exclude_key (leave-one-out)."""
+    indices, distances = gallery.match(embedding[np.newaxis], k=2)
+    for idx, dist in zip(indices[0], distances[0]):
+        if idx >= 0 and os.path.abspath(gallery.paths[idx]) != exclude_key:
+            return (gallery.names[idx] if dist <= gallery.threshold else None), float(dist)
+    return None, 1.0
+
+
+# === Benchmark Run ===
+def run_combination(config):
+    """Replay every input through detector -> model -> gallery -> log; runs in its own process."""
+    # Imported here so only the benchmark process, not the parent, loads TensorFlow
+    from deepface import DeepFace
+    from gallery import Gallery, store_file
+    from embedder import Embedder
+    from attendance_log import AttendanceWriter
+
+    detector, model = config["detector"], config["model"]
+    print(f"[INFO] Benchmarking {detector} x {model}...")
+    timings = {stage: [] for stage in STAGES}
+    accuracy = {"images": 0, "correct": 0, "wrong": 0, "unknown": 0, "no_face": 0}
+    frames = faces_total = 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The store log and index live in tmp_dir so the user's database folder is never written;
+        # an existing store is copied in so only images it does not cover are embedded
+        store_path = os.path.join(tmp_dir, "gallery.jsonl")
+        db_store = store_file(config["db"], model, detector)
+        if os.path.exists(db_store):
+            shutil.copyfile(db_store, store_path)
+        start = time.perf_counter()
+        gallery = Gallery.from_database(config["db"], model_name=model, detector_backend=detector,
+                                        store_path=store_path, index_path=os.path.join(tmp_dir, "index.npz"))
+        embedder = Embedder(model)
+        gallery_load_sec = time.perf_counter() - start
+        gallery_keys = {os.path.abspath(path) for path in gallery.paths}
+
+        writer = AttendanceWriter(os.path.join(tmp_dir, "attendance.csv"), columns=["Name", "Time"])
+        wall_start = None
+        for source in config["inputs"]:
+            for label, key, frame, decode_sec in iter_frames(source, config["stride"], config["max_frames"]):
+                warm = frames < config["warmup"]
+                if not warm and wall_start is None:
+                    wall_start = time.perf_counter()
+                sample = {"decode": decode_sec}
+
+                t0 = time.perf_counter()
+                try:
+                    faces = DeepFace.extract_faces(frame, detector_backend=detector, enforce_detection=False, align=False)
+                except ValueError:
+                    faces = []
+                faces.sort(key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"], reverse=True)
+                t1 = time.perf_counter()
+                sample["detect"] = t1 - t0
+                names = []
+                if faces:
+                    faces = align_faces(frame, faces)
+                    t2 = time.perf_counter()
+                    batch = embedder.prepare([f["face"] for f in faces])
+                    t3 = time.perf_counter()
+                    embeddings = embedder.forward(batch)
+                    t4 = time.perf_counter()
+                    if key in gallery_keys:
+                        matches = [best_match(gallery, e, key) for e in embeddings]
+                    else:
+                        matches = gallery.identify(embeddings)
+                    t5 = time.perf_counter()
+                    for name, _ in matches:
+                        if name is not None:
+                            writer.write({"Name": name, "Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+                    t6 = time.perf_counter()
+                    sample.update(align=t2 - t1, preprocess=t3 - t2, embed=t4 - t3, match=t5 - t4, log=t6 - t5)
+                    names = [name for name, _ in matches]
+
+                frames += 1
+                if warm:
+                    continue
+                faces_total += len(faces)
+                for stage, sec in sample.items():
+                    timings[stage].append(sec)
+                if label is not None:
+                    # Scored on the largest face, as enrollment does
+                    accuracy["images"] += 1
+                    if not names:
+                        accuracy["no_face"] += 1
+                    elif names[0] is None:
+                        accuracy["unknown"] += 1
+                    elif names[0] == label:
+                        accuracy["correct"] += 1
+                    else:
+                        accuracy["wrong"] += 1
+        wall_sec = time.perf_counter() - wall_start if wall_start is not None else 0.0
+        writer.close()
+
+    timed_frames = max(0, frames - config["warmup"])
+    if accuracy["images"]:
+        accuracy["accuracy"] = round(accuracy["correct"] / accuracy["images"], 4)
+    return {
+        "detector": detector,
+        "model": model,
+        "gallery_images": len(gallery),
+        "gallery_load_sec": round(gallery_load_sec, 2),
+        "frames": timed_frames,
+        "faces": faces_total,
+        "wall_sec": round(wall_sec, 3),
+        "fps": round(timed_frames / wall_sec, 2) if wall_sec else None,
+        "stages": {stage: summarize(samples) for stage, samples in timings.items()},
+        "peak_rss_mb": peak_rss_mb(),
+        "accuracy": accuracy if accuracy["images"] else None,
+    }
+
+
+def run_isolated(config):
+    """Run one combination in a fresh process so models and peak RSS do not leak between runs."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        try:
+            return pool.apply(run_combination, (config,))
+        except Exception as e:
+            print(f"[ERROR] {config['detector']} x {config['model']}:", str(e))
+            return {"detector": config["detector"], "model": config["model"], "error": str(e)}
+
+
+def print_table(runs):
+    print(f"{'detector':<12}{'model':<10}{'fps':>8}{'detect p50':>12}{'align p50':>11}{'embed p50':>11}"
+          f"{'rss MB':>9}{'acc':>8}")
+    for run in runs:
+        if "error" in run:
+            print(f"{run['detector']:<12}{run['model']:<10}  error: {run['error']}")
+            continue
+        acc = run["accuracy"]["accuracy"] if run["accuracy"] else "-"
+        print(f"{run['detector']:<12}{run['model']:<10}{run['fps'] or 0:>8}"
+              f"{run['stages']['detect'].get('p50_ms', '-'):>12}{run['stages']['align'].get('p50_ms', '-'):>11}"
+              f"{run['stages']['embed'].get('p50_ms', '-'):>11}"
+              f"{run['peak_rss_mb'] or '-':>9}{acc:>8}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay videos or image folders through the recognition pipeline.")
+    parser.add_argument("inputs", nargs="+", help="video files or image folders (person sub-folders are scored)")
+    parser.add_argument("--db", default=DB_PATH, help="face database folder the galleries are built from")
+    parser.add_argument("--detectors", nargs="+", default=["opencv"], help=f"any of {DETECTORS}")
+    parser.add_argument("--models", nargs="+", default=["Facenet"], help=f"any of {MODELS}")
+    parser.add_argument("--stride", type=int, default=1, help="use every Nth frame/image")
+    parser.add_argument("--max-frames", type=int, default=None, help="frames per input")
+    parser.add_argument("--warmup", type=int, default=WARMUP_FRAMES, help="untimed frames at the start")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="JSON report")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    runs = []
+    for detector in args.detectors:
+        for model in args.models:
+            runs.append(run_isolated({
+                "detector": detector, "model": model, "db": args.db, "inputs": args.inputs,
+                "stride": args.stride, "max_frames": args.max_frames, "warmup": args.warmup,
+            }))
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(),
+                 "cpus": os.cpu_count()},
+        "inputs": args.inputs,
+        "db": args.db,
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print_table(runs)
+    print(f"[INFO] Report written to {args.output}")
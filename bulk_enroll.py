@@ -0,0 +1,319 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+import zipfile
+from collections import Counter, deque
+
+import cv2
+import numpy as np
+
+from embedding_cache import open_cache, data_hash
+from gallery import (GalleryStore, IMAGE_EXTENSIONS, ALIGN, NORMALIZATION, normalize_rows,
+                     person_name, store_file)
+from procpool import PROCESS_WORKERS, limit_threads
+
+# === Configuration ===
+DB_PATH = "database"
+MODEL_NAME = "Facenet"
+DETECTOR_BACKEND = "opencv"
+BATCH_SIZE = 32             # images per worker task; their faces share one model forward pass
+IN_FLIGHT_PER_WORKER = 2    # tasks queued per worker, so a huge zip is never read into memory at once
+MIN_IMAGE_PX = 80           # shorter image side below this: rejected as too small
+MIN_FACE_PX = 60            # shorter face side below this: rejected as too small
+MIN_FACE_CONFIDENCE = 0.9   # detections below this do not count as faces
+BLUR_THRESHOLD = 60.0       # variance of the Laplacian of the face (resized to BLUR_SIZE) below this: blurry
+BLUR_SIZE = 160
+DUPLICATE_DISTANCE = 0.03   # cosine distance to one of the person's photos below this: near duplicate
+PROGRESS_INTERVAL_SEC = 5
+
+
+# === Sources ===
+def is_image(path):
+    parts = path.replace("\\", "/").split("/")
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS and "__MACOSX" not in parts
+
+
+def list_source(source):
+    """Relative paths of the images in a directory tree or zip archive (database/<name>/<file> layout)."""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir() and is_image(info.filename)]
+    paths = []
+    for root_dir, _, files in os.walk(source):
+        for file in sorted(files):
+            path = os.path.relpath(os.path.join(root_dir, file), source)
+            if is_image(path):
+                paths.append(path.replace("\\", "/"))
+    return paths
+
+
+def read_source(source, paths):
+    """(path, bytes) per image, read one at a time; zip members are never extracted to disk."""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for path in paths:
+                yield path, archive.read(path)
+        return
+    for path in paths:
+        with open(os.path.join(source, path), "rb") as f:
+            yield path, f.read()
+
+
+# === Quality Checks ===
+def sharpness(img, box):
+    """Variance of the Laplacian over the face box, at a fixed size so the threshold does not depend on it."""
+    x, y, w, h = box
+    face = img[max(0, y):y + h, max(0, x):x + w]
+    if face.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(cv2.resize(face, (BLUR_SIZE, BLUR_SIZE)), cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def check_image(img, detector_backend):
+    """(reason, face): the face to embed, or why the photo cannot be enrolled.
+
+    The face is an aligned RGB crop from DeepFace.extract_faces, or with the
+    skip backend the whole BGR photo, as DeepFace.represent would take it.
+    """
+    if img is None:
+        return "unreadable", None
+    if min(img.shape[:2]) < MIN_IMAGE_PX:
+        return "image too small", None
+    if detector_backend == "skip":
+        # Photos are already face crops: no detection to gate on, only blur over the whole image
+        if sharpness(img, (0, 0, img.shape[1], img.shape[0])) < BLUR_THRESHOLD:
+            return "blurry", None
+        return None, img
+    from deepface import DeepFace
+    try:
+        faces = DeepFace.extract_faces(img, detector_backend=detector_backend, enforce_detection=False, align=ALIGN)
+    except ValueError:
+        faces = []
+    faces = [f for f in faces if f.get("confidence", 0) >= MIN_FACE_CONFIDENCE]
+    if not faces:
+        return "no face", None
+    if len(faces) > 1:
+        return "several faces", None
+    area = faces[0]["facial_area"]
+    box = (area["x"], area["y"], area["w"], area["h"])
+    if min(box[2], box[3]) < MIN_FACE_PX:
+        return "face too small", None
+    if sharpness(img, box) < BLUR_THRESHOLD:
+        return "blurry", None
+    return None, faces[0]["face"]
+
+
+# === Workers ===
+_embedder = None
+_detector_backend = None
+
+
+def init_worker(model_name, detector_backend, threads):
+    global _embedder, _detector_backend
+    limit_threads(threads)
+    from embedder import Embedder
+    _embedder = Embedder(model_name)
+    _detector_backend = detector_backend
+
+
+def process_batch(items):
+    """[(index, bytes)] -> [(index, reason, embedding)]; faces passing the checks are embedded together."""
+    results, faces, owners = [], [], []
+    for index, data in items:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        reason, face = check_image(img, _detector_backend)
+        if reason is not None:
+            results.append((index, reason, None))
+        else:
+            faces.append(face)
+            owners.append(index)
+    if faces:
+        # Whole photos (skip backend) are raw BGR crops; detected faces come back from DeepFace as RGB
+        embed = _embedder.embed_crops if _detector_backend == "skip" else _embedder.embed_faces
+        for index, embedding in zip(owners, embed(faces)):
+            results.append((index, None, embedding))
+    return results
+
+
+# === Enrollment ===
+class BulkEnroller:
+    """Streams images into the gallery store of db_path for one model/detector.
+
+    Accepted photos are copied to db_path/<name>/ and their embeddings are
+    appended to the GalleryStore log and the embedding cache, so the next
+    Gallery.from_database picks them up without embedding anything.
+    Photos the cache already knows skip the workers entirely.
+    """
+
+    def __init__(self, db_path=DB_PATH, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, dry_run=False):
+        self.db_path = db_path
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.dry_run = dry_run
+        self.store = GalleryStore(store_file(db_path, model_name, detector_backend))
+        self.stored = self.store.load()
+        self.cache = open_cache()
+        self.cache_key = (model_name, detector_backend, ALIGN, NORMALIZATION)
+        self.people = {}        # name -> normalized rows already enrolled
+        for name, embedding in self.stored.values():
+            self.people.setdefault(name, []).append(normalize_rows(embedding)[0])
+        self.digests = set()
+        self.enrolled = set()   # people who got at least one new photo
+        self.pending = []
+        self.counts = Counter()
+        self.rejects = []
+
+    def screen(self, path, data):
+        """Checks that need no model: (name, digest, cached embedding), or None if rejected here."""
+        name = person_name(path)
+        if "/" not in path.replace("\\", "/"):
+            return self.reject(path, "no person folder")
+        digest = data_hash(data)
+        if f"{name}/{os.path.basename(path)}" in self.stored:
+            return self.reject(path, "already enrolled")
+        if digest in self.digests:
+            return self.reject(path, "duplicate file")
+        self.digests.add(digest)
+        cached = self.cache.get(digest, *self.cache_key) if self.cache is not None else None
+        return name, digest, cached
+
+    def reject(self, path, reason):
+        self.counts[reason] += 1
+        self.rejects.append((path, reason))
+        return None
+
+    def accept(self, path, name, digest, data, embedding):
+        row = normalize_rows(embedding)[0]
+        rows = self.people.get(name, [])
+        if rows and 1.0 - float(np.max(np.vstack(rows) @ row)) < DUPLICATE_DISTANCE:
+            return self.reject(path, "near duplicate")
+        self.people.setdefault(name, []).append(row)
+        self.counts["enrolled"] += 1
+        self.enrolled.add(name)
+        if self.dry_run:
+            return
+        target = self.target_path(name, os.path.basename(path))
+        with open(target, "wb") as f:
+            f.write(data)
+        key = f"{name}/{os.path.basename(target)}"
+        self.stored[key] = (name, embedding)
+        self.pending.append({"op": "add", "key": key, "name": name,
+                             "embedding": [float(v) for v in embedding], "hash": digest})
+        if self.cache is not None:
+            self.cache.put(digest, *self.cache_key, embedding)
+
+    def target_path(self, name, file):
+        """db_path/<name>/<file>, numbered if a different photo already has that name."""
+        folder = os.path.join(self.db_path, name)
+        os.makedirs(folder, exist_ok=True)
+        stem, ext = os.path.splitext(file)
+        target, n = os.path.join(folder, file), 1
+        while os.path.exists(target):
+            n += 1
+            target = os.path.join(folder, f"{stem}_{n}{ext}")
+        return target
+
+    def flush(self):
+        if self.pending:
+            self.store.append(self.pending)
+            self.pending = []
+        if self.cache is not None and not self.dry_run:
+            self.cache.flush()
+
+
+def format_progress(done, total, counts, started):
+    elapsed = max(time.time() - started, 1e-9)
+    rate = done / elapsed
+    eta = (total - done) / rate if rate else 0
+    rejected = done - counts["enrolled"]
+    return (f"{done}/{total} images ({100 * done / max(total, 1):.0f}%), {rate:.1f} img/s, "
+            f"{counts['enrolled']} enrolled, {rejected} rejected, ETA {eta / 60:.1f} min")
+
+
+def run(source, db_path=DB_PATH, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND,
+        workers=PROCESS_WORKERS, batch_size=BATCH_SIZE, dry_run=False):
+    paths = list_source(source)
+    enroller = BulkEnroller(db_path, model_name, detector_backend, dry_run)
+    print(f"[INFO] {len(paths)} images in {source}; {len(enroller.stored)} already in the "
+          f"{model_name}/{detector_backend} gallery. Enrolling on {workers} workers...")
+
+    started = last_report = time.time()
+    done = 0
+    items = {}          # index -> (path, name, digest, data) until its batch returns
+    batch = []
+    jobs = deque()
+    context = multiprocessing.get_context("spawn")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    def collect(job):
+        nonlocal done
+        for index, reason, embedding in job.get():
+            path, name, digest, data = items.pop(index)
+            if reason is not None:
+                enroller.reject(path, reason)
+            else:
+                enroller.accept(path, name, digest, data, embedding)
+            done += 1
+        enroller.flush()
+
+    with context.Pool(workers, initializer=init_worker, initargs=(model_name, detector_backend, threads)) as pool:
+        for index, (path, data) in enumerate(read_source(source, paths)):
+            screened = enroller.screen(path, data)
+            if screened is None:
+                done += 1
+                continue
+            name, digest, cached = screened
+            if cached is not None:
+                enroller.accept(path, name, digest, data, cached)
+                done += 1
+                continue
+            items[index] = (path, name, digest, data)
+            batch.append((index, data))
+            if len(batch) >= batch_size:
+                jobs.append(pool.apply_async(process_batch, (batch,)))
+                batch = []
+            while len(jobs) >= workers * IN_FLIGHT_PER_WORKER:
+                collect(jobs.popleft())
+            if time.time() - last_report > PROGRESS_INTERVAL_SEC:
+                print("[INFO]", format_progress(done, len(paths), enroller.counts, started))
+                last_report = time.time()
+        if batch:
+            jobs.append(pool.apply_async(process_batch, (batch,)))
+        while jobs:
+            collect(jobs.popleft())
+    enroller.flush()
+
+    elapsed = time.time() - started
+    counts = enroller.counts
+    print("[INFO]", format_progress(done, len(paths), counts, started))
+    print(f"[INFO] {counts['enrolled']} photos of {len(enroller.enrolled)} people enrolled in {elapsed:.1f}s"
+          + (" (dry run, nothing written)." if dry_run else "."))
+    for reason, count in counts.most_common():
+        if reason != "enrolled":
+            print(f"[INFO]   rejected, {reason}: {count}")
+    return enroller
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Enroll a folder tree or zip of <name>/<photo> images into the gallery.")
+    parser.add_argument("source", help="directory or .zip with one folder per person")
+    parser.add_argument("--db", default=DB_PATH, help="face database folder to enroll into")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--detector", default=DETECTOR_BACKEND, help="'skip' if the photos are already face crops")
+    parser.add_argument("--workers", type=int, default=PROCESS_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--rejects", default=None, help="write rejected images and reasons to this CSV")
+    parser.add_argument("--dry-run", action="store_true", help="check and embed, but write nothing")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    enroller = run(args.source, args.db, args.model, args.detector, args.workers, args.batch_size, args.dry_run)
+    if args.rejects:
+        with open(args.rejects, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([("Image", "Reason")] + enroller.rejects)
+        print(f"[INFO] {len(enroller.rejects)} rejected images listed in {args.rejects}")
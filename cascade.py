@@ -0,0 +1,107 @@
+import cv2
+
+from metrics import metrics
+from scaling import FrameScaler
+from tracker import iou
+
+# === Configuration ===
+CASCADE_SCALE = 0.5         # the fast detector sees the frame at this fraction of full size
+ROI_PADDING = 0.5           # candidate boxes grow by this fraction of their size on each side
+MIN_ROI_SIZE = 160          # smaller regions are upscaled to this before the accurate detector
+MIN_FACE_CONFIDENCE = 0.9   # accurate-detector confidence needed to keep a face
+DUPLICATE_IOU = 0.5         # faces found twice in overlapping regions are merged
+HAAR_MIN_NEIGHBORS = 3      # low on purpose: stage one favours recall, stage two removes false hits
+
+
+def box_of(face):
+    area = face["facial_area"]
+    return area["x"], area["y"], area["w"], area["h"]
+
+
+# === Cascaded Detection ===
+class CascadeDetector:
+    """Two-tier face detection for large frames.
+
+    A Haar cascade runs on a downscaled grayscale frame and proposes
+    candidate boxes. Only the padded candidate regions, cut from the
+    full-resolution frame (and upscaled if small), go through the accurate
+    DeepFace backend, which confirms the face and aligns it. Boxes are mapped
+    back to full-frame pixels, so results look like DeepFace.extract_faces
+    output for the whole frame at a fraction of its cost.
+    """
+
+    def __init__(self, accurate_backend="retinaface", scale=CASCADE_SCALE,
+                 min_confidence=MIN_FACE_CONFIDENCE, align=True):
+        self.accurate_backend = accurate_backend
+        self.scale = scale
+        self.min_confidence = min_confidence
+        self.align = align
+        self.scaler = FrameScaler(scale)
+        self.haar = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        if self.haar.empty():
+            raise ValueError("OpenCV Haar cascade for frontal faces not found.")
+        self.candidates = 0
+        self.confirmed = 0
+
+    def propose(self, frame):
+        """Candidate (x, y, w, h) regions in full-frame pixels, padded and clipped."""
+        small, factor = self.scaler.resize(frame)
+        gray = self.scaler.gray(small)
+        cv2.equalizeHist(gray, dst=gray)
+        boxes = self.haar.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=HAAR_MIN_NEIGHBORS,
+                                           minSize=(20, 20))
+        height, width = frame.shape[:2]
+        regions = []
+        for x, y, w, h in (boxes if len(boxes) else []):
+            x, y, w, h = (int(v / factor) for v in (x, y, w, h))
+            pad_x, pad_y = int(w * ROI_PADDING), int(h * ROI_PADDING)
+            x1, y1 = max(0, x - pad_x), max(0, y - pad_y)
+            x2, y2 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+            regions.append((x1, y1, x2 - x1, y2 - y1))
+        return regions
+
+    def confirm(self, frame, region):
+        """Faces the accurate backend finds inside region, with full-frame facial areas."""
+        x, y, w, h = region
+        roi = frame[y:y + h, x:x + w]
+        zoom = max(1.0, MIN_ROI_SIZE / max(1, min(w, h)))
+        if zoom > 1.0:
+            roi = cv2.resize(roi, None, fx=zoom, fy=zoom, interpolation=cv2.INTER_LINEAR)
+        from deepface import DeepFace
+        try:
+            faces = DeepFace.extract_faces(roi, detector_backend=self.accurate_backend,
+                                           enforce_detection=False, align=self.align)
+        except ValueError as e:
+            print("[WARN]", str(e))
+            return []
+        confirmed = []
+        for face in faces:
+            if face.get("confidence", 0) < self.min_confidence:
+                continue
+            area = dict(face["facial_area"])
+            area.update(x=x + int(area["x"] / zoom), y=y + int(area["y"] / zoom),
+                        w=int(area["w"] / zoom), h=int(area["h"] / zoom))
+            for eye in ("left_eye", "right_eye"):
+                if area.get(eye) is not None:
+                    area[eye] = (x + int(area[eye][0] / zoom), y + int(area[eye][1] / zoom))
+            face["facial_area"] = area
+            confirmed.append(face)
+        return confirmed
+
+    def detect(self, frame):
+        """Confirmed faces in frame, largest first, as DeepFace.extract_faces dicts."""
+        with metrics.timer("cascade_propose"):
+            regions = self.propose(frame)
+        self.candidates += len(regions)
+        faces = []
+        with metrics.timer("cascade_confirm"):
+            for region in regions:
+                for face in self.confirm(frame, region):
+                    # Overlapping regions can contain the same face
+                    if any(iou(box_of(face), box_of(f)) > DUPLICATE_IOU for f in faces):
+                        continue
+                    faces.append(face)
+        self.confirmed += len(faces)
+        metrics.incr("cascade_candidates", len(regions))
+        metrics.incr("cascade_confirmed", len(faces))
+        return sorted(faces, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"], reverse=True)
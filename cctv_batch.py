@@ -0,0 +1,237 @@
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+import cv2
+
+from attendance_store import AttendanceStore, TIME_FORMAT
+from motion import MotionGate, IDLE_DETECT_INTERVAL_SEC, crop
+from procpool import PROCESS_WORKERS, limit_threads
+
+# === Configuration ===
+DB_PATH = "database"
+STORE_DIR = "attendance_store"
+GALLERY_FILE = os.path.join("gallery_cache", "cctv_batch.fgal")
+MODEL_NAME = "Facenet"
+DETECTOR_BACKEND = "opencv"
+EXIT_TIMEOUT_SEC = 10       # same meaning as face.py: absent this long on the video timeline = exit
+CHUNK_SEC = 300             # footage is split into chunks of this length, processed in parallel
+SAMPLE_FPS = 2.0            # frames recognized per second of footage (the rest are only grabbed)
+MOTION_GATING = True        # skip sampled frames of a static scene (keep-alive within EXIT_TIMEOUT_SEC)
+FILENAME_TIME = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})[_T -]?(\d{2})[-:]?(\d{2})[-:]?(\d{2})")
+
+
+# === Footage ===
+def recording_start(path, default=None):
+    """Wall-clock start of a recording: from its file name (DVR style
+    20240115_083000 / 2024-01-15 08-30-00), else default, else the file's
+    modification time minus its duration."""
+    match = FILENAME_TIME.search(os.path.basename(path))
+    if match:
+        try:
+            return datetime(*(int(v) for v in match.groups()))
+        except ValueError:
+            pass
+    if default is not None:
+        return default
+    _, _, duration = video_info(path)
+    return datetime.fromtimestamp(os.path.getmtime(path)) - timedelta(seconds=duration)
+
+
+def video_info(path):
+    """(fps, frame_count, duration_sec) from the container header."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return fps, frames, frames / fps
+
+
+def plan_chunks(videos, chunk_sec=CHUNK_SEC):
+    """One work item per chunk_sec of every video: (video, camera, start_frame, end_frame, fps)."""
+    chunks = []
+    for video in videos:
+        step = max(1, int(round(chunk_sec * video["fps"])))
+        for start in range(0, video["frames"], step):
+            chunks.append((video["path"], video["camera"], start, min(video["frames"], start + step), video["fps"]))
+    return chunks
+
+
+# === Chunk Workers ===
+_gallery = None
+
+
+def init_worker(gallery_file, threads):
+    global _gallery
+    limit_threads(threads)
+    from gallery import Gallery
+    _gallery = Gallery.from_file(gallery_file)
+    _gallery.get_embedder()
+
+
+def process_chunk(chunk, sample_fps=SAMPLE_FPS, motion_gating=MOTION_GATING):
+    """Sightings (video_sec, name) of one chunk, plus frame counts for the report."""
+    path, camera, start_frame, end_frame, fps = chunk
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    stride = max(1, int(round(fps / sample_fps)))
+    gate = MotionGate(idle_interval=min(IDLE_DETECT_INTERVAL_SEC, EXIT_TIMEOUT_SEC / 3)) if motion_gating else None
+    sightings = []
+    sampled = recognized = 0
+    index = start_frame
+    try:
+        while index < end_frame:
+            # grab() skips the colour conversion and copy of frames that are not sampled
+            if (index - start_frame) % stride:
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            video_sec = index / fps
+            index += 1
+            sampled += 1
+            region = None
+            if gate is not None:
+                run_detection, region = gate.update(frame, now=video_sec)
+                if not run_detection:
+                    continue
+            recognized += 1
+            for face in _gallery.recognize(crop(frame, region)):
+                if face["name"] is not None:
+                    sightings.append((video_sec, face["name"]))
+    finally:
+        cap.release()
+    return {"path": path, "camera": camera, "frames": index - start_frame, "sampled": sampled,
+            "recognized": recognized, "sightings": sightings}
+
+
+# === Sessions ===
+def merge_sessions(sightings, coverage, exit_timeout=EXIT_TIMEOUT_SEC):
+    """Entry/exit sessions from (time, camera, name) sightings on the wall-clock timeline.
+
+    As in face.py, a person exits once unseen for exit_timeout; the exit is
+    stamped when that timeout runs out, or at the end of the footage
+    covering their last sighting. Chunk boundaries play no part: sightings
+    of all chunks are merged before sessions are formed.
+    """
+    sessions = []
+    open_sessions = {}   # (camera, name) -> [entry, last_seen]
+
+    def close(key):
+        entry, last = open_sessions.pop(key)
+        end = coverage_end(coverage.get(key[0], []), last)
+        sessions.append({"Name": key[1], "Entry Time": entry.strftime(TIME_FORMAT),
+                         "Exit Time": min(last + timedelta(seconds=exit_timeout), end).strftime(TIME_FORMAT),
+                         "Camera": key[0]})
+
+    for seen_at, camera, name in sorted(sightings):
+        key = (camera, name)
+        current = open_sessions.get(key)
+        if current is not None and (seen_at - current[1]).total_seconds() > exit_timeout:
+            close(key)
+            current = None
+        if current is None:
+            open_sessions[key] = [seen_at, seen_at]
+        else:
+            current[1] = seen_at
+    for key in list(open_sessions):
+        close(key)
+    return sorted(sessions, key=lambda s: s["Entry Time"])
+
+
+def coverage_end(intervals, moment):
+    """End of the recording interval that contains moment (moment itself if none does)."""
+    for start, end in intervals:
+        if start <= moment <= end:
+            return end
+    return moment
+
+
+# === Runner ===
+def prepare_gallery(db_path, gallery_file):
+    """Sync the gallery with the database once, then share it with the workers as a mapped file."""
+    from gallery import Gallery
+    gallery = Gallery.from_database(db_path, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND)
+    os.makedirs(os.path.dirname(gallery_file) or ".", exist_ok=True)
+    gallery.save_file(gallery_file)
+
+
+def run(paths, camera=None, start=None, workers=PROCESS_WORKERS, chunk_sec=CHUNK_SEC,
+        sample_fps=SAMPLE_FPS, motion_gating=MOTION_GATING):
+    videos = []
+    for path in paths:
+        fps, frames, duration = video_info(path)
+        begin = recording_start(path, start)
+        videos.append({"path": path, "camera": camera or os.path.splitext(os.path.basename(path))[0],
+                       "fps": fps, "frames": frames, "start": begin,
+                       "end": begin + timedelta(seconds=duration)})
+    chunks = plan_chunks(videos, chunk_sec)
+    footage_sec = sum(v["frames"] / v["fps"] for v in videos)
+    print(f"[INFO] {len(videos)} videos, {footage_sec / 3600:.2f} h of footage, "
+          f"{len(chunks)} chunks on {workers} workers.")
+
+    by_path = {v["path"]: v for v in videos}
+    sightings = []
+    frames = sampled = recognized = 0
+    started = time.time()
+    context = multiprocessing.get_context("spawn")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with context.Pool(workers, initializer=init_worker, initargs=(GALLERY_FILE, threads)) as pool:
+        jobs = [pool.apply_async(process_chunk, (chunk, sample_fps, motion_gating)) for chunk in chunks]
+        for done, job in enumerate(jobs, 1):
+            result = job.get()
+            begin = by_path[result["path"]]["start"]
+            sightings.extend((begin + timedelta(seconds=sec), result["camera"], name)
+                             for sec, name in result["sightings"])
+            frames += result["frames"]
+            sampled += result["sampled"]
+            recognized += result["recognized"]
+            elapsed = time.time() - started
+            print(f"[INFO] Chunk {done}/{len(chunks)} done, {elapsed:.0f}s elapsed.")
+
+    coverage = {}
+    for video in videos:
+        coverage.setdefault(video["camera"], []).append((video["start"], video["end"]))
+    sessions = merge_sessions(sightings, coverage)
+    elapsed = time.time() - started
+    print(f"[INFO] {frames} frames read, {sampled} sampled, {recognized} recognized, "
+          f"{len(sightings)} sightings -> {len(sessions)} sessions in {elapsed:.1f}s "
+          f"({footage_sec / max(elapsed, 1e-9):.1f}x real time).")
+    return sessions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract attendance sessions from recorded CCTV footage.")
+    parser.add_argument("videos", nargs="+", help="recorded video files")
+    parser.add_argument("--db", default=DB_PATH, help="face database folder")
+    parser.add_argument("--store", default=STORE_DIR, help="attendance store folder")
+    parser.add_argument("--camera", default=None, help="camera name for every video (default: file name)")
+    parser.add_argument("--start", default=None,
+                        help=f"recording start ({TIME_FORMAT}) for videos whose name has no timestamp")
+    parser.add_argument("--workers", type=int, default=PROCESS_WORKERS)
+    parser.add_argument("--chunk-sec", type=float, default=CHUNK_SEC)
+    parser.add_argument("--sample-fps", type=float, default=SAMPLE_FPS)
+    parser.add_argument("--no-motion", action="store_true", help="recognize every sampled frame")
+    parser.add_argument("--dry-run", action="store_true", help="print sessions instead of storing them")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = datetime.strptime(args.start, TIME_FORMAT) if args.start else None
+    prepare_gallery(args.db, GALLERY_FILE)
+    sessions = run(args.videos, args.camera, start, args.workers, args.chunk_sec,
+                   args.sample_fps, not args.no_motion)
+    for session in sessions:
+        print(f"[SESSION] {session['Name']} {session['Entry Time']} -> {session['Exit Time']} ({session['Camera']})")
+    if sessions and not args.dry_run:
+        AttendanceStore.open(args.store).append(sessions)
+        print(f"[INFO] {len(sessions)} sessions written to {args.store}")
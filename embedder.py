@@ -0,0 +1,155 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import metrics
+
+# === Configuration ===
+MAX_BATCH_SIZE = 16
+MAX_WAIT_MS = 10
+
+
+# === Batch Embedding ===
+class Embedder:
+    """Runs the recognition model on many face crops in one forward pass.
+
+    Pre-processing matches DeepFace.represent exactly (channel flip, padded
+    resize to the model input, normalization), so batch embeddings can be
+    matched against galleries built with DeepFace.
+    """
+
+    def __init__(self, model_name="Facenet", normalization="base", max_batch_size=MAX_BATCH_SIZE):
+        self.model_name = model_name
+        self.normalization = normalization
+        self.max_batch_size = max_batch_size
+        from deepface import DeepFace
+        self.model = DeepFace.build_model(model_name)
+        self.input_shape = self.model.input_shape
+        self.lock = threading.Lock()
+
+    def preprocess(self, img):
+        """One (1, h, w, 3) model input; channels are flipped just as represent() does."""
+        from deepface.modules import preprocessing
+        img = np.ascontiguousarray(img[:, :, ::-1])
+        img = preprocessing.resize_image(img=img, target_size=(self.input_shape[1], self.input_shape[0]))
+        return preprocessing.normalize_input(img=img, normalization=self.normalization)
+
+    def embed_batch(self, images):
+        """N x D embedding matrix for N face images, max_batch_size per forward pass."""
+        if len(images) == 0:
+            return np.zeros((0, self.model.output_shape), dtype=np.float32)
+        return self.forward(self.prepare(images))
+
+    def prepare(self, images):
+        """Stack the pre-processed images into one (N, h, w, 3) float32 model input."""
+        with metrics.timer("preprocess"):
+            return np.concatenate([self.preprocess(img) for img in images], axis=0).astype(np.float32)
+
+    def forward(self, batch):
+        """Run a prepared batch through the model, max_batch_size rows per call."""
+        outputs = []
+        with self.lock, metrics.timer("embed"):
+            for start in range(0, len(batch), self.max_batch_size):
+                outputs.append(self._forward(batch[start:start + self.max_batch_size]))
+        metrics.incr("faces_embedded", len(batch))
+        return np.vstack(outputs)
+
+    def _forward(self, batch):
+        if hasattr(self.model.model, "layers"):
+            return np.asarray(self.model.model(batch, training=False), dtype=np.float32)
+        # Non-Keras backends (Dlib, SFace) only expose single-image forward()
+        return np.array([self.model.forward(img[np.newaxis]) for img in batch], dtype=np.float32)
+
+    def embed_crops(self, crops):
+        """Embed raw BGR frame crops, as DeepFace.represent(detector_backend='skip') would."""
+        return self.embed_batch(crops)
+
+    def embed_faces(self, faces):
+        """Embed RGB faces returned by DeepFace.extract_faces, as represent() with a detector would."""
+        return self.embed_batch(faces)
+
+
+# === Micro-batching ===
+class BatchEmbedder:
+    """Coalesces embedding requests from several threads into shared forward passes.
+
+    A request waits at most max_wait_ms for others to join its batch; once
+    max_batch_size crops are pending the batch runs immediately. Crops from
+    different cameras or clients therefore share one model call.
+    """
+
+    def __init__(self, embedder, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="batch-embedder", daemon=True)
+        self.thread.start()
+
+    def submit(self, crops):
+        """Future resolving to the N x D embeddings of crops (see Embedder.embed_batch)."""
+        future = Future()
+        if len(crops) == 0:
+            future.set_result(np.zeros((0, self.embedder.model.output_shape), dtype=np.float32))
+        else:
+            self.requests.put((list(crops), future))
+        return future
+
+    def embed(self, crops):
+        return self.submit(crops).result()
+
+    # Same interface as Embedder, so either can back a Gallery
+    embed_batch = embed
+    embed_crops = embed
+    embed_faces = embed
+
+    def _run(self):
+        while self.running:
+            try:
+                first = self.requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if first is None:
+                break
+            pending = [first]
+            size = len(first[0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.running = False
+                    break
+                pending.append(request)
+                size += len(request[0])
+            self._process(pending)
+
+    def _process(self, pending):
+        images = [img for crops, _ in pending for img in crops]
+        try:
+            embeddings = self.embedder.embed_batch(images)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(images)
+        start = 0
+        for crops, future in pending:
+            future.set_result(embeddings[start:start + len(crops)])
+            start += len(crops)
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join(timeout=2)
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from metrics import metrics
+
+# === Configuration ===
+CACHE_FILE = os.path.join("gallery_cache", "embeddings.sqlite")
+MAX_CACHE_MB = 512          # vectors beyond this are evicted, least recently used first
+EVICT_TO = 0.9              # eviction frees space down to this share of the limit
+CACHE_ENABLED = os.environ.get("FACE_EMBEDDING_CACHE", "1") != "0"
+
+
+def content_hash(path):
+    """Hex digest of the file's bytes: the same photo has the same key wherever it is stored."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def data_hash(data):
+    """content_hash of bytes already in memory (e.g. a member read from a zip)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# === Embedding Cache ===
+class EmbeddingCache:
+    """Embeddings keyed by (content hash, model, detector, align, normalization) in one SQLite file.
+
+    Unlike DeepFace's ds_model_*.pkl, which is tied to one database folder
+    and one configuration, entries survive renamed person folders, copied
+    databases and switching between models/detectors, so rebuilding any
+    gallery only embeds images the cache has never seen. Vectors are stored
+    as raw float32 bytes; the file stays under max_mb by evicting the least
+    recently used entries. Lookups only queue their access time, which is
+    written in one transaction by flush().
+    """
+
+    def __init__(self, path=CACHE_FILE, max_mb=MAX_CACHE_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+            hash TEXT, model TEXT, detector TEXT, align INTEGER, normalization TEXT,
+            vector BLOB, last_used REAL,
+            PRIMARY KEY (hash, model, detector, align, normalization)) WITHOUT ROWID""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.db.commit()
+        self.size = self.db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        self.touched = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest, model, detector, align, normalization):
+        key = (digest, model, detector, int(align), normalization)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT vector FROM embeddings WHERE hash=? AND model=? AND detector=? AND align=? "
+                "AND normalization=?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.incr("embedding_cache_misses")
+                return None
+            self.touched.append((time.time(),) + key)
+            self.hits += 1
+        metrics.incr("embedding_cache_hits")
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def put(self, digest, model, detector, align, normalization, embedding):
+        vector = np.asarray(embedding, dtype=np.float32).tobytes()
+        key = (digest, model, detector, int(align), normalization)
+        with self.lock:
+            old = self.db.execute(
+                "SELECT LENGTH(vector) FROM embeddings WHERE hash=? AND model=? AND detector=? AND align=? "
+                "AND normalization=?", key).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            key + (vector, time.time()))
+            self.size += len(vector) - (old[0] if old else 0)
+
+    def count(self, model, detector, align, normalization):
+        with self.lock:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model=? AND detector=? AND align=? AND normalization=?",
+                (model, detector, int(align), normalization)).fetchone()[0]
+
+    def flush(self):
+        """Write queued access times and new entries, then evict down to the size limit."""
+        with self.lock:
+            if self.touched:
+                self.db.executemany(
+                    "UPDATE embeddings SET last_used=? WHERE hash=? AND model=? AND detector=? AND align=? "
+                    "AND normalization=?", self.touched)
+                self.touched = []
+            if self.size > self.max_bytes:
+                self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        target = int(self.max_bytes * EVICT_TO)
+        evicted = 0
+        rows = self.db.execute(
+            "SELECT hash, model, detector, align, normalization, LENGTH(vector) FROM embeddings "
+            "ORDER BY last_used").fetchall()
+        doomed = []
+        for *key, length in rows:
+            if self.size <= target:
+                break
+            doomed.append(key)
+            self.size -= length
+            evicted += 1
+        self.db.executemany(
+            "DELETE FROM embeddings WHERE hash=? AND model=? AND detector=? AND align=? AND normalization=?",
+            doomed)
+        print(f"[INFO] Embedding cache: evicted {evicted} least recently used entries.")
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"entries": entries, "mb": round(self.size / 1024 / 1024, 1),
+                "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.db.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(path=CACHE_FILE):
+    """The process-wide cache for path, or None when FACE_EMBEDDING_CACHE=0."""
+    if not CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path)
+        return _caches[path]
@@ -1,120 +1,239 @@
 import cv2
-from deepface import DeepFace
-from datetime import datetime
-import pandas as pd
+import numpy as np
 import os
+import threading
 import time
+from attendance_log import AttendanceWriter
+from attendance_store import AttendanceStore
+from pipeline import StageQueue, LatestFrameCapture, Stage, format_stats, draw_faces
+from metrics import metrics
+from motion import MotionGate, IDLE_DETECT_INTERVAL_SEC, crop, shift_box
+from cascade import CascadeDetector
+from procpool import RecognitionPool
+from loader import BackgroundLoader, load_gallery, startup
+from hot_cache import HotCache
+from scaling import FrameScaler
+from sessions import SessionTable
 
 # === Configuration ===
 DB_PATH = "F:/CCTV ATTENDANCE/Fatima Saud Work/facerecognition-realtime/database"
 CSV_FILE = "F:/CCTV ATTENDANCE/Fatima Saud Work/facerecognition-realtime/attendance.csv"
+STORE_DIR = "F:/CCTV ATTENDANCE/Fatima Saud Work/facerecognition-realtime/attendance_store"
 EXIT_TIMEOUT_SEC = 10
+DETECTOR_BACKEND = 'opencv'
+CASCADE_DETECTION = False   # with 'retinaface'/'mtcnn': Haar proposals, DETECTOR_BACKEND on candidates only
+HOT_CACHE = True            # match people seen moments ago (hot_cache) before the whole gallery
+DETECTION_SCALE = 1.0       # e.g. 0.5 on 1080p/4K streams: detect on a smaller copy, embed full-res crops
+DETECTION_LETTERBOX = None  # e.g. (640, 384): detect on a fixed-size letterboxed copy instead
+
+# === Pipeline Configuration ===
+RECOGNITION_WORKERS = 1
+FRAME_QUEUE_SIZE = 2      # frames waiting for recognition (oldest dropped)
+RESULT_QUEUE_SIZE = 8     # recognition results waiting for the attendance stage
+STATS_INTERVAL_SEC = 10
+PROCESS_WORKERS = 0       # > 0: recognize in this many worker processes (procpool) instead of threads
+GALLERY_FILE = "F:/CCTV ATTENDANCE/Fatima Saud Work/facerecognition-realtime/gallery_cache/face.fgal"
+METRICS_PORT = None       # e.g. 9100 to serve Prometheus metrics at /metrics
+
+# === Motion Gating ===
+# Static scenes get a keep-alive detection well inside the exit timeout
+motion_gate = MotionGate(idle_interval=min(IDLE_DETECT_INTERVAL_SEC, EXIT_TIMEOUT_SEC / 3))
+gate_lock = threading.Lock()
+
+# Detection on a reduced copy of the frame; boxes and embedding crops stay full-resolution
+detection = (DETECTION_SCALE, DETECTION_LETTERBOX) if DETECTION_SCALE != 1.0 or DETECTION_LETTERBOX else None
 
 # === State Tracking ===
-attendance = {}
-last_seen = {}
-
-# === Load or Create CSV ===
-if os.path.exists(CSV_FILE):
-    df = pd.read_csv(CSV_FILE)
-else:
-    df = pd.DataFrame(columns=["Name", "Entry Time", "Exit Time"])
-    df.to_csv(CSV_FILE, index=False)
-
-# === Open Camera ===
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("[ERROR] Camera not accessible.")
-    exit()
-
-print("[INFO] Attendance system started...")
-
-try:
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("[WARN] Failed to read frame.")
-            break
-
-        try:
-            results = DeepFace.find(
-                frame,
-                db_path=DB_PATH,
-                enforce_detection=False,
-                model_name='Facenet',
-                detector_backend='opencv'
-            )
-
-            if len(results) > 0 and len(results[0]) > 0:
-                best_match = results[0].iloc[0]
-                identity_path = best_match['identity']
-                name = identity_path.split(os.path.sep)[-2]
-
-                xmin = int(best_match['source_x'])
-                ymin = int(best_match['source_y'])
-                xmax = int(xmin + best_match['source_w'])
-                ymax = int(ymin + best_match['source_h'])
-
-                cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
-                cv2.putText(frame, name, (xmin, ymin - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,0), 2)
-
-                now = datetime.now()
-
-                # Entry
-                if name not in attendance:
-                    entry_time = now.strftime("%Y-%m-%d %H:%M:%S")
-                    attendance[name] = {"entry": entry_time, "exit": None}
-                    print(f"[INFO] Entry marked: {name} at {entry_time}")
-                
-                last_seen[name] = now
-
-        except Exception as e:
-            print("[ERROR]", str(e))
-
-        # Exit Logic
-        now = datetime.now()
-        for name in list(attendance.keys()):
-            if name in last_seen:
-                seconds_absent = (now - last_seen[name]).total_seconds()
-                if seconds_absent > EXIT_TIMEOUT_SEC and attendance[name]["exit"] is None:
-                    exit_time = now.strftime("%Y-%m-%d %H:%M:%S")
-                    attendance[name]["exit"] = exit_time
-                    print(f"[INFO] Exit marked: {name} at {exit_time}")
-
-                    # Append to CSV
-                    df = pd.concat([df, pd.DataFrame([{
-                        "Name": name,
-                        "Entry Time": attendance[name]["entry"],
-                        "Exit Time": attendance[name]["exit"]
-                    }])], ignore_index=True)
-                    df.to_csv(CSV_FILE, index=False)
-
-                    del attendance[name]
-                    del last_seen[name]
-
-        # Show camera feed
-        cv2.imshow("Attendance System", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            print("[INFO] Exiting...")
-            break
-
-except KeyboardInterrupt:
-    print("[INFO] Interrupted by user.")
-
-finally:
-    # Handle unrecorded exits
-    print("[INFO] Saving remaining sessions...")
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for name, record in attendance.items():
-        if record["exit"] is None:
-            record["exit"] = now
-            df = pd.concat([df, pd.DataFrame([{
-                "Name": name,
-                "Entry Time": record["entry"],
-                "Exit Time": record["exit"]
-            }])], ignore_index=True)
-
-    df.to_csv(CSV_FILE, index=False)
-    cap.release()
-    cv2.destroyAllWindows()
-    print("[INFO] Done. CSV updated.")
+sessions = SessionTable(EXIT_TIMEOUT_SEC)
+latest_faces = []
+state_lock = threading.Lock()
+
+# === Stage Functions ===
+def load_recognition(loader):
+    # Runs on the loader thread while the camera window is already up
+    gallery = load_gallery(loader, DB_PATH, model_name='Facenet', detector_backend=DETECTOR_BACKEND,
+                           warm=not PROCESS_WORKERS)
+    if CASCADE_DETECTION:
+        gallery.detector = CascadeDetector(DETECTOR_BACKEND)
+    if detection is not None:
+        gallery.scaler = FrameScaler(*detection)
+    if not PROCESS_WORKERS:
+        if HOT_CACHE:
+            gallery.hot_cache = HotCache(gallery)
+        return gallery
+    # Workers map the gallery from a file instead of each embedding the database
+    loader.set_status("Starting worker processes...")
+    os.makedirs(os.path.dirname(GALLERY_FILE), exist_ok=True)
+    gallery.save_file(GALLERY_FILE)
+    return RecognitionPool(GALLERY_FILE, first_frame.shape, result_queue,
+                           workers=PROCESS_WORKERS, cascade=CASCADE_DETECTION, use_hot_cache=HOT_CACHE,
+                           detection=detection).start()
+
+def recognize(item):
+    seq, timestamp, frame = item
+    gallery = loader.get()
+    if gallery is None:
+        return seq, timestamp, None
+    with gate_lock:
+        run_detection, region = motion_gate.update(frame, timestamp)
+    if not run_detection:
+        return seq, timestamp, None
+    faces = gallery.recognize(crop(frame, region))
+    for face in faces:
+        face["box"] = shift_box(face["box"], region)
+    return seq, timestamp, faces
+
+def update_attendance(item):
+    global latest_faces
+    seq, timestamp, faces = item
+    if faces is None:
+        # Nothing moved: no new sightings, but exits still fall due
+        check_exits()
+        return
+    startup.mark("first_recognition")
+
+    with state_lock:
+        latest_faces = faces
+    for face in faces:
+        name = face["name"]
+        if name is None:
+            continue
+
+        # Entry; workers may finish out of order, the table keeps the newest sighting
+        session = sessions.seen(name, wall_time=timestamp)
+        if session is not None:
+            writer.open_session(name, session.entry_time)
+            print(f"[INFO] Entry marked: {name} at {session.entry_time}")
+
+    # People with an open session stay in the hot set however long they go unseen
+    # (a process pool's hot caches live in its workers, so there is nothing to pin here)
+    hot_cache = getattr(loader.get(), "hot_cache", None)
+    if isinstance(hot_cache, HotCache):
+        hot_cache.pin(sessions.names())
+
+    check_exits()
+
+def check_exits():
+    # Only sessions whose timeout fell due are looked at, not everyone present
+    for session in sessions.expire():
+        row = sessions.row(session)
+        print(f"[INFO] Exit marked: {session.name} at {row['Exit Time']}")
+        writer.close_session(session.name, row)
+
+def dispatch(item):
+    # Process-pool mode: gate here, recognize in a worker process, results come back in order
+    seq, timestamp, frame = item
+    pool = loader.get()
+    if pool is None:
+        result_queue.put((seq, timestamp, None))
+        return
+    with gate_lock:
+        run_detection, region = motion_gate.update(frame, timestamp)
+    if run_detection:
+        pool.submit(crop(frame, region), timestamp, region)
+    else:
+        pool.skip(timestamp)
+
+# Everything below runs only in the main process: pool workers are spawned
+# and import this module without opening the camera or the attendance log
+if __name__ == "__main__":
+    # === Attendance Log (append-only, flushed in the background) ===
+    store = AttendanceStore.open(STORE_DIR, CSV_FILE)
+    writer = AttendanceWriter(CSV_FILE, store=store)
+
+    # Sessions left open by a crash resume; they exit normally if the person is gone
+    for name, entry_time in writer.recover().items():
+        sessions.restore(name, entry_time)
+
+    # === Open Camera ===
+    cap = cv2.VideoCapture(0)
+    ret, first_frame = cap.read() if cap.isOpened() else (False, None)
+    if not ret:
+        print("[ERROR] Camera not accessible.")
+        exit()
+
+    # === Build Pipeline ===
+    frame_queue = StageQueue(FRAME_QUEUE_SIZE)
+    result_queue = StageQueue(RESULT_QUEUE_SIZE)
+
+    # Gallery, model (and worker processes) load in the background; until then
+    # frames are shown and passed on without recognition
+    loader = BackgroundLoader(load_recognition).start()
+
+    if PROCESS_WORKERS:
+        recognition_stage = Stage("dispatch", dispatch, frame_queue)
+    else:
+        recognition_stage = Stage("recognize", recognize, frame_queue, result_queue, workers=RECOGNITION_WORKERS)
+    attendance_stage = Stage("attendance", update_attendance, result_queue, on_idle=check_exits)
+    stages = [recognition_stage, attendance_stage]
+
+    capture = LatestFrameCapture(cap, output=frame_queue).start()
+    for stage in stages:
+        stage.start()
+
+    metrics.start_logging()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+
+    print("[INFO] Attendance system started...")
+
+    try:
+        last_seq = 0
+        display_frame = None
+        last_stats = time.time()
+        while True:
+            # Display runs at camera rate with the most recent recognition results
+            latest = capture.read(after_seq=last_seq)
+            if latest is None:
+                if not capture.running:
+                    break
+                continue
+            last_seq, _, latest_frame = latest
+            # Boxes are drawn on a reused copy; the captured frame may still be in recognition
+            if display_frame is None or display_frame.shape != latest_frame.shape:
+                display_frame = np.empty_like(latest_frame)
+            np.copyto(display_frame, latest_frame)
+            frame = display_frame
+            startup.mark("first_frame")
+
+            with state_lock:
+                faces = latest_faces
+            draw_faces(frame, faces)
+            if not loader.ready():
+                cv2.putText(frame, loader.status, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+
+            if time.time() - last_stats > STATS_INTERVAL_SEC:
+                print("[STATS]", format_stats(stages))
+                if PROCESS_WORKERS and loader.ready():
+                    print("[STATS] pool:", loader.get().stats())
+                elif isinstance(getattr(loader.get(), "hot_cache", None), HotCache):
+                    print("[STATS] hot cache:", loader.get().hot_cache.stats())
+                last_stats = time.time()
+
+            # Show camera feed
+            with metrics.timer("display"):
+                cv2.imshow("Attendance System", frame)
+                key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                print("[INFO] Exiting...")
+                break
+
+    except KeyboardInterrupt:
+        print("[INFO] Interrupted by user.")
+
+    finally:
+        capture.stop()
+        recognition_stage.stop()
+        if PROCESS_WORKERS and loader.ready():
+            loader.get().stop()
+        attendance_stage.stop()
+
+        # Handle unrecorded exits
+        print("[INFO] Saving remaining sessions...")
+        for session in sessions.close_all():
+            writer.close_session(session.name, sessions.row(session))
+
+        writer.close()
+        cap.release()
+        cv2.destroyAllWindows()
+        print("[INFO] Done. CSV updated.")
@@ -1,9 +1,17 @@
 import cv2
-from deepface import DeepFace
-from datetime import datetime, timedelta
-import pandas as pd
-import os
+from datetime import datetime
 import numpy as np
+from gallery import Gallery
+from tracker import FaceTracker
+from embedder import Embedder
+from attendance_log import AttendanceWriter
+from metrics import metrics
+from motion import MotionGate, IDLE_DETECT_INTERVAL_SEC, crop, shift_box
+from cascade import CascadeDetector
+from loader import BackgroundLoader, import_deepface, startup
+from hot_cache import HotCache
+from scaling import FrameScaler
+from sessions import SessionTable
 
 # === Configuration ===
 DB_PATH = "/home/aleema/facerecognition-realtime/database"
@@ -14,58 +22,102 @@ KNOWN_PERSON = "inzamam"  # The only person we want to recognize
 
 # Face detection backends to test
 DETECTORS = ['mtcnn', 'ssd', 'retinaface', 'yolov8', 'fastmtcnn']
+# Haar proposals on a downscaled frame, the detector above only on candidate regions
+CASCADE_DETECTION = True
+# Detect on a smaller copy of the frame (boxes map back; recognition crops are full-resolution)
+DETECTION_SCALE = 1.0       # e.g. 0.5 on 1080p/4K streams
+DETECTION_LETTERBOX = None  # e.g. (640, 384): a fixed-size letterboxed copy instead
+
+# Tracking: recognition runs once per track, not once per face per frame
+TRACKER_TYPE = None     # 'KCF' or 'CSRT' to follow faces between detections
+DETECT_INTERVAL = 1     # run the detector every N frames (needs TRACKER_TYPE when > 1)
+EMBED_BATCH_SIZE = 16   # face crops per model forward pass
+SHOW_METRICS = True     # per-stage timings in the sidebar
+IDLE_FRAME_DELAY_MS = 30  # display wait per frame while the scene is static (1 while active)
+METRICS_PORT = None     # e.g. 9100 to serve Prometheus metrics at /metrics
 
 # === State Tracking ===
-attendance = {}
-current_detections = set()
+sessions = SessionTable(EXIT_TIMEOUT_SEC)  # one per person, whichever track they are on
+tracker = FaceTracker(tracker_type=TRACKER_TYPE)
+scaler = FrameScaler(DETECTION_SCALE, DETECTION_LETTERBOX)
+sidebar = None  # display buffers, reused every frame
+combined = None
+# Static scenes get a keep-alive detection well inside the exit timeout
+motion_gate = MotionGate(idle_interval=min(IDLE_DETECT_INTERVAL_SEC, EXIT_TIMEOUT_SEC / 3))
+frame_index = 0
 status_text = "Waiting for detection..."
 last_status_change = datetime.now()
 
-# === Initialize CSV ===
-if not os.path.exists(CSV_FILE):
-    pd.DataFrame(columns=["Name", "Status", "Time", "Duration"]).to_csv(CSV_FILE, index=False)
+# === Initialize CSV (append-only, flushed in the background) ===
+writer = AttendanceWriter(CSV_FILE, columns=["Name", "Status", "Time", "Duration"])
+
+# Sessions left open by a crash resume until the person is matched again or times out
+for name, first_seen in writer.recover().items():
+    sessions.restore(name, first_seen)
 
 # === Face Detection ===
+cascades = {}
+
 def detect_faces(frame, detector_backend):
     try:
-        face_objs = DeepFace.extract_faces(
-            frame,
-            detector_backend=detector_backend,
-            enforce_detection=False,
-            align=True
-        )
-        return [f for f in face_objs if f['confidence'] > 0.95]  # Very high confidence
+        with metrics.timer("detect"):
+            if CASCADE_DETECTION:
+                if detector_backend not in cascades:
+                    cascades[detector_backend] = CascadeDetector(detector_backend)
+                face_objs = cascades[detector_backend].detect(frame)
+            else:
+                from deepface import DeepFace
+                face_objs = DeepFace.extract_faces(
+                    frame,
+                    detector_backend=detector_backend,
+                    enforce_detection=False,
+                    align=True
+                )
+        faces = [f for f in face_objs if f['confidence'] > 0.95]  # Very high confidence
+        metrics.incr("faces_detected", len(faces))
+        return faces
     except Exception as e:
         print(f"[{detector_backend.upper()} ERROR] {str(e)}")
         return []
 
 # === Face Recognition ===
-def recognize_face(face_img):
+def load_recognition(loader):
+    # Runs on a background thread; the preview starts before TensorFlow is imported
+    import_deepface(loader)
+    loader.set_status("Loading gallery...")
+    # Crops are already detected, so the gallery embeds them with the 'skip' backend
+    gallery = Gallery.from_database(DB_PATH, model_name='Facenet', detector_backend='skip')
+    loader.set_status("Loading Facenet...")
+    embedder = Embedder('Facenet', max_batch_size=EMBED_BATCH_SIZE)
+    loader.set_status("Loading detector...")
+    detect_faces(np.zeros((240, 320, 3), dtype=np.uint8), DETECTORS[0])
+    # People recognized moments ago are matched first, against a few rows only
+    return gallery, embedder, HotCache(gallery)
+
+loader = BackgroundLoader(load_recognition).start()
+
+def recognize_faces(face_imgs):
+    # All crops of the frame go through the model in one batched forward pass
+    if not face_imgs:
+        return []
+    gallery, embedder, hot_cache = loader.get()
     try:
-        df = DeepFace.find(
-            face_img,
-            db_path=DB_PATH,
-            enforce_detection=False,
-            model_name='Facenet',
-            detector_backend='skip',  # We already detected faces
-            silent=True,
-            distance_metric='cosine'
-        )
-        
-        if len(df) > 0 and len(df[0]) > 0:
-            best_match = df[0].iloc[0]
-            similarity = 1 - best_match['distance']
-            if similarity >= MIN_CONFIDENCE:
-                identity_path = best_match['identity']
-                name = os.path.basename(os.path.dirname(identity_path))
-                return name, similarity
-        return "Unknown", 0
+        embeddings = embedder.embed_crops(face_imgs)
+        results = []
+        for name, distance in hot_cache.identify(embeddings, threshold=1 - MIN_CONFIDENCE):
+            if name is not None:
+                results.append((name, 1 - distance))
+            else:
+                results.append(("Unknown", 0))
+        startup.mark("first_recognition")
+        return results
     except Exception as e:
         print(f"[RECOG ERROR] {str(e)}")
-        return "Unknown", 0
+        return [("Unknown", 0)] * len(face_imgs)
 
 # === Attendance Logging ===
-def log_attendance(name, status, duration=None):
+def log_attendance(session, status, duration=None):
+    name = session.name
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     entry = {
         "Name": name,
@@ -73,7 +125,11 @@ def log_attendance(name, status, duration=None):
         "Time": timestamp,
         "Duration": str(duration) if duration else ""
     }
-    pd.DataFrame([entry]).to_csv(CSV_FILE, mode='a', header=False, index=False)
+    if status == "PRESENT":
+        writer.write(entry)
+        writer.open_session(name, session.entry_time)
+    else:
+        writer.close_session(name, entry)
     print(f"[LOG] {status}: {name} at {timestamp}" + (f" (Duration: {duration})" if duration else ""))
 
 # === Main Loop ===
@@ -82,38 +138,83 @@ if not cap.isOpened():
     print("[ERROR] Camera not accessible.")
     exit()
 
+metrics.start_logging()
+if METRICS_PORT:
+    metrics.serve(METRICS_PORT)
+
 print("[INFO] System started. Press 'q' to quit.")
 
 try:
     while True:
-        ret, frame = cap.read()
+        with metrics.timer("capture"):
+            ret, frame = cap.read()
         if not ret:
             print("[WARN] Frame read failed.")
+            metrics.incr("frames_failed")
             continue
+        metrics.incr("frames_captured")
+        startup.mark("first_frame")
 
-        # Create a black sidebar for status info
-        sidebar = np.zeros((frame.shape[0], 300, 3), dtype=np.uint8)
+        # Black sidebar for status info
+        if combined is None or combined.shape[:2] != (frame.shape[0], frame.shape[1] + 300):
+            sidebar = np.zeros((frame.shape[0], 300, 3), dtype=np.uint8)
+            combined = np.zeros((frame.shape[0], frame.shape[1] + 300, 3), dtype=np.uint8)
+        sidebar.fill(0)
         
-        current_detections.clear()
         current_detector = DETECTORS[0]  # Start with MTCNN
+        frame_index += 1
         
-        faces = detect_faces(frame, current_detector)
+        # Until recognition has loaded the preview runs without detection
+        run_detection, region = motion_gate.update(frame) if loader.ready() else (False, None)
+        if not run_detection:
+            # Nothing moved: show the last boxes, but record no new sightings
+            for track in tracker.tracks.values():
+                if track.last_recognized is not None:
+                    x, y, w, h = track.box
+                    color = (0, 255, 0) if track.name == KNOWN_PERSON else (0, 0, 255)
+                    cv2.rectangle(frame, (x, y), (x+w, y+h), color, 1)
+            tracks = []
+        elif TRACKER_TYPE and frame_index % DETECT_INTERVAL:
+            with metrics.timer("track"):
+                tracks = tracker.predict(frame)
+        else:
+            # Only the moving part of the frame is searched for faces. The cascade downscales
+            # for its proposals itself and confirms them at full resolution; plain DeepFace
+            # detection runs on the roi at DETECTION_SCALE
+            roi = crop(frame, region)
+            small, factor = (roi, 1.0) if CASCADE_DETECTION else scaler.resize(roi)
+            faces = detect_faces(small, current_detector)
+            boxes = [shift_box(scaler.to_full((f['facial_area']['x'], f['facial_area']['y'],
+                                               f['facial_area']['w'], f['facial_area']['h']), factor, roi.shape),
+                               region) for f in faces]
+            with metrics.timer("track"):
+                tracks = tracker.update(boxes, frame)
         
-        for face in faces:
-            facial_area = face['facial_area']
-            x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
-            
-            # Crop with padding for better recognition
-            padding = 30
-            x1, y1 = max(0, x-padding), max(0, y-padding)
-            x2, y2 = min(frame.shape[1], x+w+padding), min(frame.shape[0], y+h+padding)
-            face_img = frame[y1:y2, x1:x2]
-            
-            if face_img.size == 0:
-                continue
+        # Recognize new, doubtful or due-for-reverification tracks only, in one batch
+        pending, face_imgs = [], []
+        for track in tracks:
+            if tracker.needs_recognition(track):
+                x, y, w, h = track.box
+                # Crop with padding for better recognition, from the full-resolution frame
+                padding = 30
+                x1, y1 = max(0, x-padding), max(0, y-padding)
+                x2, y2 = min(frame.shape[1], x+w+padding), min(frame.shape[0], y+h+padding)
+                face_img = frame[y1:y2, x1:x2]
                 
-            name, confidence = recognize_face(face_img)
-            current_detections.add(name)
+                if face_img.size == 0:
+                    continue
+                pending.append(track)
+                face_imgs.append(face_img)
+        
+        for track, (name, confidence) in zip(pending, recognize_faces(face_imgs)):
+            tracker.set_identity(track, name, confidence)
+        
+        for track in tracks:
+            if track.last_recognized is None:
+                continue
+            x, y, w, h = track.box
+            
+            name, confidence = track.name, track.confidence
             
             # Only process known person
             if name == KNOWN_PERSON:
@@ -123,44 +224,31 @@ try:
                 cv2.putText(frame, f"{name} ({confidence:.2f})", (x, y-10), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
                 
-                # Update attendance
-                now = datetime.now()
-                if name not in attendance:
-                    attendance[name] = {
-                        "first_seen": now,
-                        "last_seen": now,
-                        "logged": False
-                    }
-                    status_text = f"{KNOWN_PERSON} is present since {now.strftime('%H:%M:%S')}"
-                    last_status_change = now
+                # Sessions are per person, so one re-acquired on a new track continues theirs
+                session = sessions.seen(name)
+                if session is not None:
+                    status_text = f"{KNOWN_PERSON} is present since {session.entry_time[-8:]}"
+                    last_status_change = datetime.now()
+                    log_attendance(session, "PRESENT")
                 else:
-                    attendance[name]["last_seen"] = now
-                    duration = now - attendance[name]["first_seen"]
+                    session = sessions.get(name)
+                    duration = sessions.duration(session, sessions.clock.now())
                     status_text = (f"{KNOWN_PERSON} is present\n"
-                                 f"Since: {attendance[name]['first_seen'].strftime('%H:%M:%S')}\n"
+                                 f"Since: {session.entry_time[-8:]}\n"
                                  f"Duration: {str(duration).split('.')[0]}")
-                    
-                    # Log only once per session
-                    if not attendance[name]["logged"]:
-                        log_attendance(name, "PRESENT")
-                        attendance[name]["logged"] = True
             else:
                 # Draw red box for unknown
                 cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
                 cv2.putText(frame, "Unknown", (x, y-10), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
-        # Check for exits
-        now = datetime.now()
-        for name in list(attendance.keys()):
-            if name not in current_detections:
-                absence = (now - attendance[name]["last_seen"]).total_seconds()
-                if absence > EXIT_TIMEOUT_SEC:
-                    duration = attendance[name]["last_seen"] - attendance[name]["first_seen"]
-                    log_attendance(name, "LEFT", duration)
-                    del attendance[name]
-                    status_text = f"{KNOWN_PERSON} left at {now.strftime('%H:%M:%S')}"
-                    last_status_change = now
+        # Exits that fell due, not a pass over every open session
+        for session in sessions.expire():
+            log_attendance(session, "LEFT", sessions.duration(session))
+            status_text = f"{KNOWN_PERSON} left at {datetime.now().strftime('%H:%M:%S')}"
+            last_status_change = datetime.now()
+        if loader.ready():
+            loader.get()[2].pin(sessions.names())
 
         # Display status in sidebar
         y_offset = 30
@@ -169,23 +257,42 @@ try:
                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1)
             y_offset += 30
         
+        if not loader.ready():
+            cv2.putText(sidebar, loader.status, (10, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+
         # Add detector info
-        cv2.putText(sidebar, f"Detector: {current_detector.upper()}", (10, y_offset+30), 
+        cv2.putText(sidebar, f"Detector: {current_detector.upper()}" + ("  (idle)" if motion_gate.idle else ""),
+                   (10, y_offset+30), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        cv2.putText(sidebar, f"Tracks: {len(tracker.tracks)}  Recognitions: {tracker.recognition_calls}", 
+                   (10, y_offset+55), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        if loader.ready():
+            cv2.putText(sidebar, f"Hot cache hit rate: {loader.get()[2].hit_rate():.0%}",
+                       (10, y_offset+75), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        
+        # Stage timings (mean / p95) and counters
+        if SHOW_METRICS:
+            y_metrics = y_offset + 90
+            for line in metrics.summary_lines(counters=False):
+                cv2.putText(sidebar, line, (10, y_metrics), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (200, 200, 0), 1)
+                y_metrics += 18
         
         # Combine frames
-        combined = np.hstack((frame, sidebar))
+        combined[:, :frame.shape[1]] = frame
+        combined[:, frame.shape[1]:] = sidebar
         
-        cv2.imshow("Attendance System", combined)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        with metrics.timer("display"):
+            cv2.imshow("Attendance System", combined)
+            key = cv2.waitKey(IDLE_FRAME_DELAY_MS if motion_gate.idle else 1) & 0xFF
+        if key == ord('q'):
             break
 
 finally:
     # Finalize any remaining sessions
-    for name in attendance:
-        duration = datetime.now() - attendance[name]["first_seen"]
-        log_attendance(name, "SYSTEM CLOSED", duration)
+    for session in sessions.close_all():
+        log_attendance(session, "SYSTEM CLOSED", sessions.duration(session, sessions.clock.now()))
     
+    writer.close()
     cap.release()
     cv2.destroyAllWindows()
     print("[INFO] System stopped. Attendance log saved.")
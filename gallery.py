@@ -0,0 +1,552 @@
+import json
+import os
+import pickle
+import threading
+
+import numpy as np
+
+from embedder import Embedder
+from metrics import metrics
+from ann_index import open_index, INDEX_MIN_IMAGES
+from gallery_file import open_gallery, write_gallery, GALLERY_DTYPE
+from embedding_cache import open_cache, content_hash
+
+# === Configuration ===
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+DISTANCE_METRIC = "cosine"
+ALIGN = True                # DeepFace.represent settings; part of the embedding cache key
+NORMALIZATION = "base"
+
+
+# === Helpers ===
+def person_name(image_path):
+    """Name of the person folder an enrolled image lives in (database/<name>/<file>)."""
+    parts = image_path.replace("\\", "/").split("/")
+    return parts[-2] if len(parts) > 1 else ""
+
+
+def relative_key(image_path):
+    """'<name>/<file>' key that survives moving the database to another machine."""
+    parts = image_path.replace("\\", "/").split("/")
+    return "/".join(parts[-2:])
+
+
+def list_images(db_path):
+    images = []
+    for root_dir, _, files in os.walk(db_path):
+        for file in sorted(files):
+            if os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS:
+                images.append(os.path.join(root_dir, file))
+    return images
+
+
+def representation_file(db_path, model_name, detector_backend):
+    """Path of the ds_model_*.pkl file DeepFace.find keeps for this configuration."""
+    file_name = f"ds_model_{model_name}_detector_{detector_backend}_aligned_normalization_base_expand_0.pkl"
+    return os.path.join(db_path, file_name.replace("-", "").lower())
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# === On-disk Store ===
+class GalleryStore:
+    """Append-only JSON-lines log of enrollment operations for one model/detector.
+
+    Each line is {"op": "add", "key", "name", "embedding", "hash"} or
+    {"op": "remove", "key"} / {"op": "remove_person", "name"}. Replaying the
+    log rebuilds the gallery without touching the model; enrollment changes
+    only ever append a line. "hash" is the content_hash of the photo the row
+    was embedded from (missing in logs written before it was recorded), so a
+    photo replaced under the same file name can be told apart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.dead = 0
+        self.hashes = {}    # key -> content hash of its photo, for rows that recorded one
+
+    def load(self):
+        """Replay the log into an ordered {key: (name, embedding)} dict."""
+        entries = {}
+        self.dead = 0
+        self.hashes = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line after a crash; everything before it is intact
+                    print(f"[WARN] Skipping corrupt record in {self.path}")
+                    continue
+                op = record.get("op")
+                if op == "add":
+                    if record["key"] in entries:
+                        self.dead += 1
+                    entries[record["key"]] = (record["name"], record["embedding"])
+                    self._track(record)
+                elif op == "remove":
+                    if entries.pop(record["key"], None) is not None:
+                        self.dead += 2
+                    self.hashes.pop(record["key"], None)
+                elif op == "remove_person":
+                    for key in [k for k, (name, _) in entries.items() if name == record["name"]]:
+                        del entries[key]
+                        self.hashes.pop(key, None)
+                        self.dead += 1
+                    self.dead += 1
+        return entries
+
+    def _track(self, record):
+        if record.get("hash"):
+            self.hashes[record["key"]] = record["hash"]
+        else:
+            self.hashes.pop(record["key"], None)
+
+    def append(self, records):
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            for record in records:
+                if record.get("op") in ("add", "remove"):
+                    self._track(record)
+
+    def add(self, key, name, embedding, digest=None):
+        self.append([{"op": "add", "key": key, "name": name, "embedding": [float(v) for v in embedding],
+                      "hash": digest}])
+
+    def remove(self, key):
+        self.append([{"op": "remove", "key": key}])
+
+    def remove_person(self, name):
+        self.append([{"op": "remove_person", "name": name}])
+
+    def compact(self, entries):
+        """Rewrite the log with only the live entries."""
+        tmp_path = self.path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for key, (name, embedding) in entries.items():
+                    f.write(json.dumps({"op": "add", "key": key, "name": name,
+                                        "embedding": [float(v) for v in embedding],
+                                        "hash": self.hashes.get(key)}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        self.dead = 0
+
+
+def store_file(db_path, model_name, detector_backend):
+    file_name = f"gallery_{model_name}_{detector_backend}.jsonl"
+    return os.path.join(db_path, file_name.replace("-", "").lower())
+
+
+def index_file(db_path, model_name, detector_backend):
+    file_name = f"index_{model_name}_{detector_backend}.npz"
+    return os.path.join(db_path, file_name.replace("-", "").lower())
+
+
+def load_representations(pkl_path):
+    """{relative key: embedding} from an existing DeepFace ds_model_*.pkl file."""
+    known = {}
+    if not os.path.exists(pkl_path):
+        return known
+    with open(pkl_path, "rb") as f:
+        representations = pickle.load(f)
+    if hasattr(representations, "to_dict"):
+        representations = representations.to_dict("records")
+    for rep in representations:
+        if rep.get("embedding") is not None:
+            known[relative_key(rep["identity"])] = rep["embedding"]
+    return known
+
+
+# === Gallery ===
+class Gallery:
+    """Enrolled face embeddings kept in memory as one L2-normalized float32 matrix.
+
+    Row i of `matrix` belongs to `names[i]` / `paths[i]`. Matching a batch of
+    query embeddings is a single matrix multiply followed by a top-k selection,
+    so the per-frame cost no longer includes reloading the representation file.
+
+    Rows live in a buffer with spare capacity: enrolling a photo writes one
+    new row past the end, and matchers that already took a snapshot keep
+    reading their own view, so enrollment never blocks recognition.
+
+    Large galleries attach an ann_index index (attach_index), after which a
+    match scans only a few clusters / people instead of every row.
+
+    A gallery opened with from_file maps a (possibly float16/int8) gallery
+    file read-only instead; enrolling into it copies the rows to float32.
+    """
+
+    def __init__(self, model_name="Facenet", detector_backend="opencv", threshold=None, store=None, embedder=None):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        if threshold is None:
+            # DeepFace (and TensorFlow with it) is only imported when first needed
+            from deepface.modules.verification import find_threshold
+            threshold = find_threshold(model_name, DISTANCE_METRIC)
+        self.threshold = threshold
+        self.store = store
+        self.db_path = None
+        self.count = 0
+        self._buffer = np.zeros((0, 0), dtype=np.float32)
+        self._labels = np.array([], dtype=object)
+        self.paths = []
+        self.index = None
+        self.lock = threading.Lock()
+        self.embedder = embedder
+        self.detector = None
+        self.scaler = None
+        self.hot_cache = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def matrix(self):
+        return self._buffer[:self.count]
+
+    @property
+    def names(self):
+        return self._labels[:self.count]
+
+    def snapshot(self):
+        with self.lock:
+            return self._buffer[:self.count], self._labels[:self.count], self.index
+
+    # --- Loading ---
+    @classmethod
+    def from_database(cls, db_path, model_name="Facenet", detector_backend="opencv", threshold=None,
+                      store_path=None, index_path=None):
+        """Load the gallery for db_path.
+
+        Embeddings come from the append-only store (seeded from DeepFace's
+        ds_model_*.pkl on first run), then from the content-hash embedding
+        cache; only images none of them covers are embedded, and images
+        deleted from disk are dropped. A stored row whose photo was replaced
+        under the same file name (its content hash changed) is embedded again. store_path and index_path put the
+        store log and the index somewhere other than db_path.
+        """
+        store = GalleryStore(store_path or store_file(db_path, model_name, detector_backend))
+        gallery = cls(model_name, detector_backend, threshold, store)
+        gallery.db_path = db_path
+        cache = open_cache()
+        cache_key = (model_name, detector_backend, ALIGN, NORMALIZATION)
+
+        stored = store.load()
+        known = {} if stored else load_representations(representation_file(db_path, model_name, detector_backend))
+
+        # Vectors stored before the cache existed are copied into it once, so a
+        # later folder rename or detector switch still finds them by content
+        backfill = cache is not None and cache.count(*cache_key) < len(stored)
+
+        names, paths, embeddings = [], [], []
+        pending = []
+        added, removed, reused, changed, unhashed = 0, 0, 0, 0, 0
+        on_disk = set()
+        for image_path in list_images(db_path):
+            key = relative_key(image_path)
+            on_disk.add(key)
+            digest = content_hash(image_path)
+            if key in stored and store.hashes.get(key, digest) == digest:
+                name, embedding = stored[key]
+                if backfill:
+                    cache.put(digest, *cache_key, embedding)
+                if key not in store.hashes:
+                    # Row from before hashes were recorded: trust it, the log is rewritten with its hash below
+                    store.hashes[key] = digest
+                    unhashed += 1
+            else:
+                changed += key in stored
+                name, embedding = person_name(image_path), known.get(key)
+                if embedding is None and cache is not None:
+                    embedding = cache.get(digest, *cache_key)
+                    reused += embedding is not None
+                elif cache is not None:
+                    cache.put(digest, *cache_key, embedding)
+                if embedding is None:
+                    embedding = gallery.embed_image(image_path)
+                    if embedding is None:
+                        print(f"[WARN] No face found in {image_path}, skipped.")
+                        on_disk.discard(key)    # a replaced photo's old row goes too
+                        continue
+                    added += 1
+                    if cache is not None:
+                        cache.put(digest, *cache_key, embedding)
+                pending.append({"op": "add", "key": key, "name": name,
+                                "embedding": [float(v) for v in embedding], "hash": digest})
+                stored[key] = (name, embedding)
+            names.append(name)
+            paths.append(image_path)
+            embeddings.append(embedding)
+
+        for key in [k for k in stored if k not in on_disk]:
+            pending.append({"op": "remove", "key": key})
+            del stored[key]
+            removed += 1
+
+        if pending:
+            store.append(pending)
+        if cache is not None:
+            cache.flush()
+        if store.dead > len(stored) or unhashed:
+            store.compact(stored)
+
+        gallery.set_embeddings(names, paths, embeddings)
+        print(f"[INFO] Gallery loaded: {len(gallery)} images of {len(set(names))} people "
+              f"({added} newly embedded, {reused} from cache, {changed} changed, {removed} removed).")
+        gallery.attach_index(index_path or index_file(db_path, model_name, detector_backend))
+        return gallery
+
+    def attach_index(self, path=None, min_images=INDEX_MIN_IMAGES, **options):
+        """Search through an approximate index once the gallery has min_images rows.
+
+        The index is loaded from path when it still matches the gallery and
+        rebuilt (then saved) otherwise; options go to ann_index.open_index.
+        """
+        if self.count < min_images:
+            return None
+        matrix, names, _ = self.snapshot()
+        index = open_index(path, matrix, names, **options)
+        with self.lock:
+            # Rows enrolled while the index was built are added now
+            for row in range(len(matrix), self.count):
+                index.add(row, self._buffer[row], self._labels[row])
+            self.index = index
+        return index
+
+    # --- Shared gallery file ---
+    def save_file(self, path, dtype=GALLERY_DTYPE):
+        """Write the gallery as a gallery_file (float32, float16 or int8) for memory-mapped sharing."""
+        with self.lock:
+            matrix, names = self._buffer[:self.count], self._labels[:self.count]
+            paths = self.paths[:self.count]
+        write_gallery(path, np.asarray(matrix, dtype=np.float32), list(names), paths, dtype,
+                      {"model_name": self.model_name, "detector_backend": self.detector_backend})
+
+    @classmethod
+    def from_file(cls, path, threshold=None, store=None):
+        """Open a gallery file read-only; processes mapping the same file share its pages."""
+        matrix, names, paths, meta = open_gallery(path)
+        gallery = cls(meta["model_name"], meta["detector_backend"], threshold, store)
+        with gallery.lock:
+            gallery._buffer = matrix
+            gallery._labels = np.array(names, dtype=object)
+            gallery.paths = list(paths)
+            gallery.count = len(paths)
+        return gallery
+
+    def set_embeddings(self, names, paths, embeddings):
+        if len(embeddings):
+            matrix = normalize_rows(np.vstack(embeddings))
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        with self.lock:
+            self._buffer = np.ascontiguousarray(matrix)
+            self._labels = np.array(names, dtype=object)
+            self.paths = list(paths)
+            self.count = len(self.paths)
+            self.index = None
+
+    # --- Enrollment ---
+    def add(self, name, path, embedding, persist=True):
+        """Append one embedding row; amortized O(d) thanks to the spare capacity."""
+        row = normalize_rows(embedding)[0]
+        with self.lock:
+            if self.count == len(self._buffer) or self._buffer.shape[1] != len(row):
+                capacity = max(16, 2 * len(self._buffer))
+                buffer = np.zeros((capacity, len(row)), dtype=np.float32)
+                labels = np.empty(capacity, dtype=object)
+                if self.count:
+                    buffer[:self.count] = np.asarray(self._buffer[:self.count], dtype=np.float32)
+                    labels[:self.count] = self._labels[:self.count]
+                self._buffer, self._labels = buffer, labels
+            self._buffer[self.count] = row
+            self._labels[self.count] = name
+            self.paths.append(path)
+            if self.index is not None:
+                self.index.add(self.count, row, name)
+            self.count += 1
+        if persist and self.store is not None:
+            self.store.add(relative_key(path), name, embedding, content_hash(path) if os.path.exists(path) else None)
+
+    def enroll(self, name, path, img):
+        """Embed img (the photo just saved at path) and add it. Returns False if no face was found."""
+        if path in self.paths:
+            return True  # already picked up from disk, e.g. saved while the gallery was loading
+        embedding = self.embed_image(img)
+        if embedding is None:
+            return False
+        self.add(name, path, embedding)
+        return True
+
+    def remove_person(self, name):
+        """Drop every row of name; takes effect for the next match."""
+        with self.lock:
+            keep = np.flatnonzero(self._labels[:self.count] != name)
+            if len(keep) == self.count:
+                return 0
+            removed = self.count - len(keep)
+            old_count = self.count
+            self._buffer = np.ascontiguousarray(self._buffer[keep])
+            self._labels = self._labels[keep]
+            self.paths = [self.paths[i] for i in keep]
+            self.count = len(keep)
+            if self.index is not None:
+                self.index = self.index.remap(keep, old_count, self._buffer, self._labels)
+        if self.store is not None:
+            self.store.remove_person(name)
+        if self.hot_cache is not None:
+            self.hot_cache.forget(name)
+        return removed
+
+    # --- Embedding ---
+    def embed_image(self, img, detector_backend=None):
+        """Embedding of the most prominent face in img (path or BGR array), or None."""
+        reps = self.represent(img, detector_backend)
+        return reps[0]["embedding"] if reps else None
+
+    def represent(self, img, detector_backend=None):
+        from deepface import DeepFace
+        try:
+            reps = DeepFace.represent(
+                img,
+                model_name=self.model_name,
+                detector_backend=detector_backend or self.detector_backend,
+                enforce_detection=False,
+                align=ALIGN,
+                normalization=NORMALIZATION,
+            )
+        except ValueError as e:
+            print("[WARN]", str(e))
+            return []
+        return sorted(reps, key=lambda r: r["facial_area"]["w"] * r["facial_area"]["h"], reverse=True)
+
+    # --- Matching ---
+    def match(self, embeddings, k=1):
+        """Top-k gallery rows for each query embedding.
+
+        Returns (indices, distances), both of shape (n_queries, k), sorted by
+        ascending cosine distance.
+        """
+        indices, distances, _ = self._search(embeddings, k)
+        return indices, distances
+
+    def _search(self, embeddings, k):
+        queries = normalize_rows(embeddings)
+        matrix, names, index = self.snapshot()
+        count = len(matrix)
+        if count == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32), names
+
+        k = min(k, count)
+        if index is not None:
+            # Slots the index could not fill are id -1 at distance 2 (never under a threshold)
+            with metrics.timer("match"):
+                indices, similarity = index.search(queries, matrix, k)
+            return indices, 1.0 - similarity, names
+
+        with metrics.timer("match"):
+            # matrix @ queries.T rather than queries @ matrix.T: a float16/int8 file
+            # matrix is then dequantized a block at a time instead of all at once
+            similarity = (matrix @ queries.T).T
+            if k < count:
+                top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(count), (len(queries), count))
+            top_sim = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_sim, axis=1)
+            indices = np.take_along_axis(top, order, axis=1)
+            distances = 1.0 - np.take_along_axis(top_sim, order, axis=1)
+        return indices, distances, names
+
+    def identify(self, embeddings, threshold=None):
+        """(name, distance) of the best match per query; name is None above the threshold."""
+        threshold = self.threshold if threshold is None else threshold
+        indices, distances, names = self._search(embeddings, k=1)
+        metrics.incr("recognitions", len(indices))
+        results = []
+        for idx, dist in zip(indices, distances):
+            if len(idx) == 0 or dist[0] > threshold:
+                results.append((None, float(dist[0]) if len(dist) else 1.0))
+            else:
+                results.append((names[idx[0]], float(dist[0])))
+        return results
+
+    def get_embedder(self):
+        if self.embedder is None:
+            self.embedder = Embedder(self.model_name)
+        return self.embedder
+
+    def detect(self, frame):
+        """Faces found by the gallery's detector, largest first, as DeepFace.extract_faces dicts.
+
+        With `detector` set (e.g. a cascade.CascadeDetector) it is used instead
+        of a full-frame DeepFace.extract_faces call. Otherwise a `scaler`
+        (scaling.FrameScaler) lets DeepFace detect on a downscaled or
+        letterboxed copy; boxes and face crops come back at full resolution.
+        """
+        if self.detector is not None:
+            with metrics.timer("detect"):
+                faces = self.detector.detect(frame)
+            metrics.incr("faces_detected", len(faces))
+            return faces
+        from deepface import DeepFace
+        try:
+            with metrics.timer("detect"):
+                image, factor = self.scaler.resize(frame) if self.scaler is not None else (frame, 1.0)
+                faces = DeepFace.extract_faces(
+                    image,
+                    detector_backend=self.detector_backend,
+                    enforce_detection=False,
+                    align=True,
+                )
+                if factor != 1.0:
+                    faces = self.scaler.restore(faces, frame, factor)
+        except ValueError as e:
+            print("[WARN]", str(e))
+            return []
+        metrics.incr("faces_detected", len(faces))
+        return sorted(faces, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"], reverse=True)
+
+    def recognize(self, frame, threshold=None):
+        """Detect every face in frame and identify it.
+
+        All faces of the frame are embedded in a single batched forward pass.
+        Returns a list of dicts with "name" (None if unknown), "distance" and
+        "box" (x, y, w, h), largest face first.
+        """
+        faces = self.detect(frame)
+        if not faces:
+            return []
+        embeddings = self.get_embedder().embed_faces([f["face"] for f in faces])
+        # With a hot_cache.HotCache attached, recently seen people are matched first
+        matcher = self.hot_cache if self.hot_cache is not None else self
+        matches = matcher.identify(embeddings, threshold)
+        results = []
+        for face, (name, distance) in zip(faces, matches):
+            area = face["facial_area"]
+            results.append({
+                "name": name,
+                "distance": distance,
+                "box": (area["x"], area["y"], area["w"], area["h"]),
+            })
+        return results
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+# === Configuration ===
+GALLERY_DTYPE = "float16"   # "float32", "float16" or "int8" (per-row scale)
+MAGIC = b"FGAL"
+VERSION = 1
+ALIGN = 64
+DEQUANT_CHUNK = 16384       # rows converted to float32 at a time while matching
+
+# magic, version, dtype code, count, dim, matrix/scales/labels offsets, labels size
+HEADER = struct.Struct("<4sHB1xQI4xQQQQ8x")
+DTYPES = {"float32": (0, np.float32), "float16": (1, np.float16), "int8": (2, np.int8)}
+DTYPE_NAMES = {code: name for name, (code, _) in DTYPES.items()}
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+# === Quantized Rows ===
+class QuantizedRows:
+    """A float16/int8 embedding matrix that behaves like a float32 one where matching needs it.
+
+    Slicing returns another view over the same (memory-mapped) pages;
+    fancy indexing and np.asarray() return dequantized float32 copies;
+    `rows @ queries` runs in float32 chunks, so only DEQUANT_CHUNK rows are
+    ever expanded at once.
+    """
+
+    def __init__(self, data, scales=None):
+        self.data = data
+        self.scales = scales
+        self.shape = data.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return QuantizedRows(self.data[key], None if self.scales is None else self.scales[key])
+        rows = np.asarray(self.data[key], dtype=np.float32)
+        if self.scales is not None:
+            rows *= np.asarray(self.scales[key], dtype=np.float32)[..., np.newaxis]
+        return rows
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self[np.arange(len(self))] if len(self) else np.zeros(self.shape, dtype=np.float32)
+        return rows if dtype is None else rows.astype(dtype)
+
+    def __matmul__(self, other):
+        other = np.asarray(other, dtype=np.float32)
+        out = np.empty((len(self),) + other.shape[1:], dtype=np.float32)
+        for start in range(0, len(self), DEQUANT_CHUNK):
+            block = np.asarray(self.data[start:start + DEQUANT_CHUNK], dtype=np.float32)
+            result = block @ other
+            if self.scales is not None:
+                scales = np.asarray(self.scales[start:start + DEQUANT_CHUNK], dtype=np.float32)
+                result *= scales.reshape((-1,) + (1,) * (result.ndim - 1))
+            out[start:start + len(block)] = result
+        return out
+
+
+# === Reading and Writing ===
+def quantize(matrix, dtype):
+    """(data, scales) for an L2-normalized float32 matrix; scales is None except for int8."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, np.float32)
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        data = np.clip(np.rint(matrix / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+        return data, scales
+    return matrix.astype(DTYPES[dtype][1]), None
+
+
+def write_gallery(path, matrix, names, paths, dtype=GALLERY_DTYPE, meta=None):
+    """Write a gallery file atomically: header, matrix, optional scales, then the label table."""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown gallery dtype: {dtype}")
+    matrix = np.asarray(matrix, dtype=np.float32)
+    count = len(names)
+    dim = matrix.shape[1] if matrix.ndim == 2 and count else 0
+    data, scales = quantize(matrix.reshape(count, dim), dtype)
+    labels = json.dumps({"meta": meta or {}, "names": [str(n) for n in names],
+                         "paths": list(paths)}).encode("utf-8")
+
+    matrix_offset = _aligned(HEADER.size)
+    scales_offset = _aligned(matrix_offset + data.nbytes)
+    labels_offset = _aligned(scales_offset + (scales.nbytes if scales is not None else 0))
+    header = HEADER.pack(MAGIC, VERSION, DTYPES[dtype][0], count, dim,
+                         matrix_offset, scales_offset, labels_offset, len(labels))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.seek(matrix_offset)
+        f.write(data.tobytes())
+        if scales is not None:
+            f.seek(scales_offset)
+            f.write(scales.tobytes())
+        f.seek(labels_offset)
+        f.write(labels)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(HEADER.size)
+    if len(raw) < HEADER.size:
+        raise ValueError(f"{path} is not a gallery file (too short)")
+    magic, version, code, count, dim, matrix_offset, scales_offset, labels_offset, labels_size = \
+        HEADER.unpack(raw)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a gallery file")
+    if version > VERSION:
+        raise ValueError(f"{path} has gallery format version {version}; this reader supports {VERSION}")
+    return {"dtype": DTYPE_NAMES[code], "count": count, "dim": dim, "matrix_offset": matrix_offset,
+            "scales_offset": scales_offset, "labels_offset": labels_offset, "labels_size": labels_size}
+
+
+def open_gallery(path):
+    """(matrix, names, paths, meta) with the matrix memory-mapped read-only.
+
+    float32 files give a plain np.memmap; float16/int8 files a QuantizedRows
+    over the mapped pages. Processes opening the same file share them.
+    """
+    header = read_header(path)
+    count, dim, dtype = header["count"], header["dim"], header["dtype"]
+    with open(path, "rb") as f:
+        f.seek(header["labels_offset"])
+        labels = json.loads(f.read(header["labels_size"]).decode("utf-8"))
+    if count == 0:
+        return np.zeros((0, 0), dtype=np.float32), labels["names"], labels["paths"], labels["meta"]
+
+    data = np.memmap(path, dtype=DTYPES[dtype][1], mode="r", offset=header["matrix_offset"], shape=(count, dim))
+    if dtype == "float32":
+        matrix = data
+    else:
+        scales = None
+        if dtype == "int8":
+            scales = np.memmap(path, dtype=np.float32, mode="r", offset=header["scales_offset"], shape=(count,))
+        matrix = QuantizedRows(data, scales)
+    return matrix, labels["names"], labels["paths"], labels["meta"]
+
+
+# === Conversion ===
+def convert_pkl(pkl_path, out_path, dtype=GALLERY_DTYPE, model_name=None, detector_backend=None):
+    """Convert a DeepFace ds_model_*.pkl into a gallery file. Returns the number of images."""
+    from gallery import load_representations, normalize_rows, person_name
+
+    known = load_representations(pkl_path)
+    keys = sorted(known)
+    matrix = normalize_rows(np.vstack([known[k] for k in keys])) if keys else np.zeros((0, 0), np.float32)
+    meta = {"model_name": model_name, "detector_backend": detector_backend, "source": os.path.basename(pkl_path)}
+    write_gallery(out_path, matrix, [person_name(k) for k in keys], keys, dtype, meta)
+    return len(keys)
+
+
+def model_from_pkl_name(pkl_path):
+    """(model, detector) parsed from ds_model_<model>_detector_<detector>_... (lowercased by DeepFace)."""
+    name = os.path.basename(pkl_path)
+    if not name.startswith("ds_model_") or "_detector_" not in name:
+        return None, None
+    model, rest = name[len("ds_model_"):].split("_detector_", 1)
+    return model, rest.split("_", 1)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert DeepFace .pkl representations to memory-mappable gallery files.")
+    parser.add_argument("pkl_files", nargs="+", help="ds_model_*.pkl files")
+    parser.add_argument("--dtype", default=GALLERY_DTYPE, choices=sorted(DTYPES))
+    parser.add_argument("--out-dir", default=None, help="output folder (default: next to each .pkl)")
+    args = parser.parse_args()
+
+    for pkl_path in args.pkl_files:
+        out_dir = args.out_dir or os.path.dirname(pkl_path)
+        out_path = os.path.join(out_dir, os.path.splitext(os.path.basename(pkl_path))[0] + ".fgal")
+        model, detector = model_from_pkl_name(pkl_path)
+        count = convert_pkl(pkl_path, out_path, args.dtype, model, detector)
+        print(f"[INFO] {pkl_path}: {count} images -> {out_path} "
+              f"({os.path.getsize(pkl_path)} -> {os.path.getsize(out_path)} bytes)")
@@ -0,0 +1,11 @@
+# gunicorn -c gunicorn_conf.py service:app
+#
+# Workers are separate processes that memory-map the same gallery snapshot;
+# threads inside a worker let concurrent requests share embedding batches.
+bind = "0.0.0.0:5000"
+workers = 2
+worker_class = "gthread"
+threads = 8
+timeout = 120
+# The model must be built after fork (TensorFlow is not fork-safe)
+preload_app = False
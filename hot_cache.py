@@ -0,0 +1,140 @@
+import threading
+import time
+
+import numpy as np
+
+from gallery import normalize_rows
+from metrics import metrics
+
+# === Configuration ===
+HOT_TTL_SEC = 60            # people not seen for this long leave the hot set (unless pinned)
+HOT_MAX_PEOPLE = 32         # least recently seen people are evicted beyond this
+HOT_ROWS_PER_PERSON = 8     # gallery rows kept per person: those closest to the face that promoted them
+HOT_STRICT_RATIO = 0.8      # a hot match must be within this fraction of the normal threshold
+
+
+# === Hot Cache ===
+class HotCache:
+    """The gallery rows of people recognized moments ago, checked before the full gallery.
+
+    Whoever was just seen is by far the most likely face in the next
+    frames. identify() first matches every query against this small set
+    (at most max_people x rows_per_person rows, so its cost does not grow
+    with the gallery) and accepts a hit only under the stricter
+    threshold * strict_ratio; misses fall back to gallery.identify(), and a
+    person found there is promoted into the set. People leave after ttl
+    seconds without a sighting unless pinned (e.g. an open attendance
+    session), or when the set is full and they are the least recently seen.
+    """
+
+    def __init__(self, gallery, ttl=HOT_TTL_SEC, max_people=HOT_MAX_PEOPLE,
+                 rows_per_person=HOT_ROWS_PER_PERSON, strict_ratio=HOT_STRICT_RATIO):
+        self.gallery = gallery
+        self.ttl = ttl
+        self.max_people = max_people
+        self.rows_per_person = rows_per_person
+        self.strict_ratio = strict_ratio
+        self.people = {}            # name -> (rows, last_seen)
+        self.pinned = set()
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.labels = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def identify(self, embeddings, threshold=None):
+        """(name, distance) per query, like Gallery.identify."""
+        threshold = self.gallery.threshold if threshold is None else threshold
+        queries = normalize_rows(embeddings)
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            matrix, labels = self.matrix, self.labels
+
+        results = [None] * len(queries)
+        if len(matrix) and len(queries):
+            with metrics.timer("hot_match"):
+                similarity = queries @ matrix.T
+                best = similarity.argmax(axis=1)
+            for i, row in enumerate(best):
+                distance = 1.0 - float(similarity[i, row])
+                if distance <= threshold * self.strict_ratio:
+                    results[i] = (labels[row], distance)
+
+        hit_names = [r[0] for r in results if r is not None]
+        misses = [i for i, r in enumerate(results) if r is None]
+        if hit_names:
+            metrics.incr("recognitions", len(hit_names))
+        if misses:
+            for i, match in zip(misses, self.gallery.identify(queries[misses], threshold)):
+                results[i] = match
+                if match[0] is not None:
+                    self.promote(match[0], queries[i], now)
+
+        with self.lock:
+            for name in hit_names:
+                if name in self.people:
+                    self.people[name] = (self.people[name][0], now)
+            self.hits += len(hit_names)
+            self.misses += len(misses)
+        metrics.incr("hot_hits", len(hit_names))
+        metrics.incr("hot_misses", len(misses))
+        return results
+
+    def promote(self, name, query, now=None):
+        """Add name's gallery rows most similar to query (one pass over the gallery, on a miss only)."""
+        matrix, names, _ = self.gallery.snapshot()
+        idx = np.flatnonzero(names == name)
+        if len(idx) == 0:
+            return
+        rows = np.asarray(matrix[idx], dtype=np.float32)
+        if len(rows) > self.rows_per_person:
+            rows = rows[np.argsort(-(rows @ query))[:self.rows_per_person]]
+        with self.lock:
+            self.people[name] = (rows, time.time() if now is None else now)
+            self._evict()
+            self._rebuild()
+
+    def pin(self, names):
+        """Keep exactly these people from expiring (they still count towards max_people)."""
+        with self.lock:
+            self.pinned = set(names)
+
+    def forget(self, name):
+        with self.lock:
+            if self.people.pop(name, None) is not None:
+                self._rebuild()
+
+    def _expire(self, now):
+        expired = [name for name, (_, seen) in self.people.items()
+                   if now - seen > self.ttl and name not in self.pinned]
+        for name in expired:
+            del self.people[name]
+        if expired:
+            metrics.incr("hot_expired", len(expired))
+            self._rebuild()
+
+    def _evict(self):
+        while len(self.people) > self.max_people:
+            victim = min(self.people, key=lambda name: (name in self.pinned, self.people[name][1]))
+            del self.people[victim]
+            metrics.incr("hot_evicted")
+
+    def _rebuild(self):
+        # A fresh matrix per change: identify() works on whatever it took under the lock
+        if self.people:
+            self.matrix = np.vstack([rows for rows, _ in self.people.values()])
+            self.labels = [name for name, (rows, _) in self.people.items() for _ in range(len(rows))]
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.labels = []
+        metrics.set_gauge("hot_people", len(self.people))
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {"people": len(self.people), "rows": len(self.matrix), "hits": self.hits,
+                    "misses": self.misses, "hit_rate": round(self.hit_rate(), 3)}
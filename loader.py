@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+
+from gallery import Gallery
+from metrics import metrics
+
+# === Configuration ===
+LAZY_STARTUP = os.environ.get("FACE_LAZY_STARTUP", "1") != "0"   # 0: load everything before the UI
+
+_IMPORTED_AT = time.time()
+
+
+def process_start_time():
+    """When this process was created (psutil), else when this module was first imported."""
+    try:
+        import psutil
+        return psutil.Process().create_time()
+    except ImportError:
+        return _IMPORTED_AT
+
+
+# === Startup Timing ===
+class StartupTimer:
+    """Seconds from process start to named milestones, each recorded once.
+
+    Milestones are printed as they happen, exported as startup_<name>_sec
+    gauges, and summarized by report() once the first recognition ran.
+    """
+
+    def __init__(self):
+        self.start = process_start_time()
+        self.marks = {}
+        self.lock = threading.Lock()
+
+    def mark(self, name):
+        with self.lock:
+            if name in self.marks:
+                return
+            self.marks[name] = time.time() - self.start
+        print(f"[STARTUP] {name.replace('_', ' ')} after {self.marks[name]:.2f}s")
+        metrics.set_gauge(f"startup_{name}_sec", round(self.marks[name], 3))
+        if name == "first_recognition":
+            self.report()
+
+    def report(self):
+        with self.lock:
+            marks = sorted(self.marks.items(), key=lambda item: item[1])
+        print("[STARTUP] " + ", ".join(f"{name.replace('_', ' ')} {sec:.2f}s" for name, sec in marks))
+        return dict(marks)
+
+
+startup = StartupTimer()
+
+
+# === Background Loader ===
+class BackgroundLoader:
+    """Runs load(loader) - heavy imports, gallery and model construction - on a daemon thread.
+
+    The caller keeps showing frames meanwhile: get() returns None until the
+    result is ready, status tells a UI what is happening, and functions
+    passed to when_ready() run with the result as soon as it exists (e.g.
+    photos enrolled during startup). load() reports progress through
+    set_status(). With LAZY_STARTUP off, start() simply loads in place.
+    """
+
+    def __init__(self, load, name="recognition"):
+        self.load = load
+        self.name = name
+        self.status = "Starting..."
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name=f"{name}-loader", daemon=True)
+
+    def start(self, background=LAZY_STARTUP):
+        if background:
+            self.thread.start()
+        else:
+            self._run()
+        return self
+
+    def _run(self):
+        start = time.time()
+        try:
+            result = self.load(self)
+        except Exception as e:
+            print(f"[ERROR] Loading {self.name} failed:", str(e))
+            with self.lock:
+                self.error = e
+                self.status = f"{self.name.capitalize()} failed: {e}"
+            self.done.set()
+            return
+        with self.lock:
+            self.result = result
+            self.status = f"{self.name.capitalize()} ready"
+            callbacks, self.callbacks = self.callbacks, []
+        self.done.set()
+        print(f"[INFO] {self.name.capitalize()} loaded in {time.time() - start:.1f}s.")
+        startup.mark(f"{self.name}_ready")
+        for callback, args in callbacks:
+            self._call(callback, args)
+
+    def set_status(self, status):
+        with self.lock:
+            self.status = status
+
+    def ready(self):
+        return self.result is not None
+
+    def get(self, timeout=0):
+        """The loaded result, or None while loading (waits up to timeout seconds)."""
+        if timeout:
+            self.done.wait(timeout)
+        return self.result
+
+    def when_ready(self, callback, *args):
+        """Call callback(result, *args) now if loaded, otherwise right after loading (loader thread)."""
+        with self.lock:
+            if self.result is None:
+                self.callbacks.append((callback, args))
+                return
+        self._call(callback, args)
+
+    def _call(self, callback, args):
+        try:
+            callback(self.result, *args)
+        except Exception as e:
+            print(f"[WARN] {self.name} callback failed:", str(e))
+
+
+# === Standard Loads ===
+def import_deepface(loader=None):
+    """Import DeepFace (and with it TensorFlow/Keras), timing it as a startup milestone."""
+    if loader is not None:
+        loader.set_status("Loading TensorFlow...")
+    from deepface import DeepFace
+    startup.mark("deepface_imported")
+    return DeepFace
+
+
+def load_gallery(loader, db_path, model_name="Facenet", detector_backend="opencv", warm=True):
+    """The usual recognition load: import DeepFace, build the gallery, build and warm the model."""
+    from model_registry import warm_up  # model_registry itself imports this module
+
+    import_deepface(loader)
+    loader.set_status("Loading gallery...")
+    gallery = Gallery.from_database(db_path, model_name=model_name, detector_backend=detector_backend)
+    loader.set_status(f"Loading {model_name}...")
+    gallery.get_embedder()
+    if warm:
+        loader.set_status("Warming up...")
+        warm_up(gallery)
+    return gallery
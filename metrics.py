@@ -0,0 +1,202 @@
+import bisect
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# === Configuration ===
+METRICS_ENABLED = os.environ.get("FACE_METRICS", "1") != "0"
+LOG_INTERVAL_SEC = 30
+RECENT_SAMPLES = 512        # per histogram, for the percentiles shown in overlays and logs
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "face_"
+
+
+# === Metric Types ===
+class Histogram:
+    """Cumulative Prometheus-style buckets plus a window of recent samples for percentiles."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q):
+        return float(np.percentile(self.recent, q)) if self.recent else 0.0
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+# === Registry ===
+class Metrics:
+    """Stage timers, counters and gauges shared by every loop in the process.
+
+    Timers record seconds into a histogram named after the stage. When
+    disabled, timer() hands back one shared no-op context manager and the
+    other calls return immediately, so instrumented code costs an attribute
+    check and nothing more.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def timer(self, name):
+        """Context manager timing one run of stage `name`."""
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def incr(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+            self.started = time.time()
+
+    # --- Reporting ---
+    def summary_lines(self, counters=True):
+        """Short human-readable lines: one per stage (mean/p95 ms), then the counters."""
+        with self.lock:
+            lines = [f"{name}: {1000 * h.total / h.count:.1f}ms p95 {1000 * h.percentile(95):.1f}ms"
+                     for name, h in sorted(self.histograms.items()) if h.count]
+            values = dict(self.counters)
+            values.update(self.gauges)
+        if counters and values:
+            lines.append(" ".join(f"{name}={value}" for name, value in sorted(values.items())))
+        return lines
+
+    def log_line(self):
+        return " | ".join(self.summary_lines())
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        out = []
+        with self.lock:
+            if self.histograms:
+                out.append(f"# TYPE {PREFIX}stage_seconds histogram")
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    out.append(f'{PREFIX}stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                out.append(f'{PREFIX}stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+                out.append(f'{PREFIX}stage_seconds_sum{{stage="{name}"}} {h.total:.6f}')
+                out.append(f'{PREFIX}stage_seconds_count{{stage="{name}"}} {h.count}')
+            for name, value in sorted(self.counters.items()):
+                out.append(f"# TYPE {PREFIX}{name}_total counter")
+                out.append(f"{PREFIX}{name}_total {value}")
+            for name, value in sorted(self.gauges.items()):
+                out.append(f"# TYPE {PREFIX}{name} gauge")
+                out.append(f"{PREFIX}{name} {value}")
+        out.append(f"# TYPE {PREFIX}uptime_seconds gauge")
+        out.append(f"{PREFIX}uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(out) + "\n"
+
+    def start_logging(self, interval=LOG_INTERVAL_SEC):
+        """Print a [METRICS] line every interval seconds from a daemon thread."""
+        if not self.enabled:
+            return None
+
+        def run():
+            while True:
+                time.sleep(interval)
+                line = self.log_line()
+                if line:
+                    print("[METRICS]", line)
+
+        thread = threading.Thread(target=run, name="metrics-log", daemon=True)
+        thread.start()
+        return thread
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serve prometheus() on http://host:port/metrics from a daemon thread."""
+        if not self.enabled:
+            return None
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"[INFO] Metrics at http://{host}:{port}/metrics")
+        return server
+
+
+# Process-wide registry used by every module
+metrics = Metrics()
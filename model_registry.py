@@ -0,0 +1,256 @@
+import gc
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from gallery import Gallery
+from embedder import Embedder
+from loader import import_deepface, startup
+
+# === Configuration ===
+MAX_RESIDENT_MODELS = 2     # recognition networks kept in memory at once
+MEMORY_BUDGET_MB = 2048     # estimated weights + galleries of the resident models
+
+
+# === Model Registry ===
+class ModelRegistry:
+    """Loads, warms up and caches recognition models and their galleries.
+
+    Every model gets its own Gallery, which stays in memory once built, so
+    switching back to a model never re-embeds the database. The networks
+    themselves are heavier: at most max_resident stay loaded (least recently
+    used are dropped first) and their estimated size must fit
+    memory_budget_mb. Loading happens on one background thread and includes a
+    dummy inference, so the first real frame does not pay for graph tracing.
+
+    request() selects a model; active() keeps returning the previous gallery
+    until the requested one is ready, so the UI never waits on a load.
+    Recognition should go through recognize(), which keeps the network it
+    runs on from being unloaded until it returns.
+    """
+
+    def __init__(self, db_path, detector_backend="opencv", max_resident=MAX_RESIDENT_MODELS,
+                 memory_budget_mb=MEMORY_BUDGET_MB):
+        self.db_path = db_path
+        self.detector_backend = detector_backend
+        self.max_resident = max_resident
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.galleries_by_model = {}
+        self.resident = OrderedDict()   # model name -> estimated bytes, least recently used first
+        self.wanted = None
+        self.current = None
+        self.lock = threading.Lock()
+        self.pending = set()            # (model name, resident) loads queued or running
+        self.in_use = Counter()         # model name -> recognize() calls running on its network
+        self.enrolled = []              # photos added while loads are pending, replayed into new galleries
+        self.loads = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+        self.thread.start()
+
+    # --- Loading ---
+    def preload(self, model_names):
+        """Queue models for background loading, in order.
+
+        Only the first max_resident are loaded; the others just get their
+        galleries embedded, since their networks would be evicted right away.
+        """
+        for i, model_name in enumerate(model_names):
+            self._schedule(model_name, resident=i < self.max_resident)
+
+    def _schedule(self, model_name, resident=True):
+        with self.lock:
+            if (model_name, resident) in self.pending:
+                return
+            if model_name in (self.resident if resident else self.galleries_by_model):
+                return
+            self.pending.add((model_name, resident))
+        self.loads.put((model_name, resident))
+
+    def _run(self):
+        while True:
+            item = self.loads.get()
+            if item is None:
+                break
+            model_name, resident = item
+            try:
+                if resident:
+                    self.load(model_name)
+                else:
+                    self.prepare(model_name)
+            except Exception as e:
+                print(f"[ERROR] Could not load {model_name}:", str(e))
+            finally:
+                with self.lock:
+                    self.pending.discard(item)
+                    if not self.pending:
+                        # Galleries built from now on find these photos on disk
+                        self.enrolled = []
+
+    def load(self, model_name):
+        """Build (or reuse) the model and its gallery, warm them up and make them resident."""
+        with self.lock:
+            if model_name in self.resident:
+                self.resident.move_to_end(model_name)
+                return self.galleries_by_model[model_name]
+        start = time.time()
+        import_deepface()
+        embedder = Embedder(model_name)
+        gallery = self.galleries_by_model.get(model_name)
+        if gallery is None:
+            gallery = Gallery.from_database(self.db_path, model_name=model_name,
+                                            detector_backend=self.detector_backend)
+        gallery.embedder = embedder
+        for name, path, img in list(self.enrolled):
+            gallery.enroll(name, path, img)
+        warm_up(gallery)
+
+        with self.lock:
+            self.galleries_by_model[model_name] = gallery
+            self.resident[model_name] = estimate_size(embedder) + gallery.matrix.nbytes
+            if self.current is None:
+                self.current = model_name
+                startup.mark("recognition_ready")
+            if self.wanted == model_name:
+                self.current = model_name
+            self._evict()
+        print(f"[INFO] Model {model_name} ready in {time.time() - start:.1f}s "
+              f"({self.resident.get(model_name, 0) / 1e6:.0f} MB est.)")
+        return gallery
+
+    def prepare(self, model_name):
+        """Build model_name's gallery without keeping its network, so switching to it later skips embedding."""
+        with self.lock:
+            if model_name in self.galleries_by_model:
+                return self.galleries_by_model[model_name]
+        start = time.time()
+        import_deepface()
+        gallery = Gallery.from_database(self.db_path, model_name=model_name,
+                                        detector_backend=self.detector_backend)
+        for name, path, img in list(self.enrolled):
+            gallery.enroll(name, path, img)
+        with self.lock:
+            gallery = self.galleries_by_model.setdefault(model_name, gallery)
+            loaded = model_name in self.resident
+        if not loaded:
+            release_model(model_name)
+            gc.collect()
+        print(f"[INFO] Gallery for {model_name} ready in {time.time() - start:.1f}s (model not kept).")
+        return gallery
+
+    def _evict(self):
+        # Called under self.lock. Drop least recently used networks; the model in use,
+        # the one requested and any a recognize() call is still running on stay
+        evicted = 0
+        while len(self.resident) > 1 and (len(self.resident) > self.max_resident or
+                                          sum(self.resident.values()) > self.memory_budget):
+            victim = next((m for m in self.resident
+                           if m not in (self.current, self.wanted) and not self.in_use[m]), None)
+            if victim is None:
+                break   # retried when the recognize() call holding it returns
+            del self.resident[victim]
+            self.galleries_by_model[victim].embedder = None
+            release_model(victim)
+            evicted += 1
+            print(f"[INFO] Unloaded model {victim} (gallery kept).")
+        if evicted:
+            gc.collect()
+
+    # --- Switching ---
+    def request(self, model_name):
+        """Switch to model_name as soon as it is loaded."""
+        with self.lock:
+            self.wanted = model_name
+            if model_name in self.resident:
+                self.current = model_name
+                self.resident.move_to_end(model_name)
+                return
+        self._schedule(model_name)
+
+    def active(self):
+        """Gallery of the requested model if it is ready, else of the last ready one (None before any)."""
+        with self.lock:
+            if self.current is None:
+                return None
+            return self.galleries_by_model[self.current]
+
+    def recognize(self, frame):
+        """Gallery.recognize on the active model, or None before any is ready.
+
+        The network stays loaded until the call returns, even if a switch
+        makes it an eviction candidate meanwhile.
+        """
+        with self.lock:
+            model_name = self.current
+            if model_name is None:
+                return None
+            gallery = self.galleries_by_model[model_name]
+            self.in_use[model_name] += 1
+        try:
+            return gallery.recognize(frame)
+        finally:
+            with self.lock:
+                self.in_use[model_name] -= 1
+                if not self.in_use[model_name]:
+                    del self.in_use[model_name]
+                    self._evict()
+
+    def is_ready(self, model_name):
+        with self.lock:
+            return model_name in self.resident
+
+    def galleries(self):
+        """Every gallery built so far, including those whose network was unloaded."""
+        with self.lock:
+            return list(self.galleries_by_model.values())
+
+    def enroll(self, name, path, img):
+        """Add one photo to every gallery; networks loaded just for this are released again."""
+        with self.lock:
+            if self.pending:
+                self.enrolled.append((name, path, img))
+        for model_name, gallery in list(self.galleries_by_model.items()):
+            if not gallery.enroll(name, path, img):
+                print(f"[WARN] No face found in {path} for {model_name}.")
+            if not self.is_ready(model_name):
+                release_model(model_name)
+
+    def status(self):
+        with self.lock:
+            if self.wanted is not None and self.wanted != self.current:
+                return f"Loading {self.wanted}..."
+            return f"{self.current or 'No model'} ready"
+
+    def stop(self):
+        self.loads.put(None)
+        self.thread.join(timeout=1)
+
+
+# === Helpers ===
+def warm_up(gallery):
+    """One dummy detection and embedding, so the first real frame runs at full speed."""
+    h, w = gallery.embedder.input_shape
+    gallery.embedder.embed_batch([np.zeros((h, w, 3), dtype=np.uint8)])
+    try:
+        gallery.detect(np.zeros((h * 2, w * 2, 3), dtype=np.uint8))
+    except Exception as e:
+        print("[WARN] Detector warm-up failed:", str(e))
+
+
+def estimate_size(embedder):
+    """Approximate weight memory of a model; Keras models report their parameter count."""
+    network = embedder.model.model
+    if hasattr(network, "count_params"):
+        return network.count_params() * 4
+    return 0
+
+
+def release_model(model_name):
+    """Drop DeepFace's cached instance so the unloaded network can be garbage collected."""
+    try:
+        from deepface.modules import modeling
+        getattr(modeling, "cached_models", {}).get("facial_recognition", {}).pop(model_name, None)
+    except ImportError:
+        pass
@@ -0,0 +1,130 @@
+import time
+
+import cv2
+import numpy as np
+
+from metrics import metrics
+from scaling import FrameScaler
+
+# === Configuration ===
+MOTION_METHOD = "diff"          # "diff" (running-average background) or "mog2"
+MOTION_SCALE = 0.25             # the gate looks at a frame this fraction of full size
+PIXEL_THRESHOLD = 25            # grey-level change that counts as motion ("diff")
+MIN_MOTION_AREA = 0.002         # fraction of the frame that must change
+BACKGROUND_ALPHA = 0.05         # running-average update rate ("diff")
+MOTION_HOLD_SEC = 2.0           # keep detecting on the full frame this long after motion stops
+IDLE_DETECT_INTERVAL_SEC = 2.0  # keep-alive detection rate on a static scene
+ROI_PADDING = 0.25              # motion box grows by this fraction of its size on each side
+FULL_FRAME_RATIO = 0.5          # motion boxes larger than this share of the frame use the full frame
+
+
+# === Motion Gate ===
+class MotionGate:
+    """Decides per frame whether detection must run, and where.
+
+    A downscaled, blurred grayscale copy of each frame is compared with a
+    background model. When something moved, detection runs on the padded
+    bounding box of the motion (or the full frame if most of it moved). For
+    MOTION_HOLD_SEC after motion stops it runs on the full frame, so a
+    person who stopped in front of the camera is still seen. On a static
+    scene it only runs a keep-alive detection every idle_interval seconds,
+    which keeps a motionless person's last sighting fresh: as long as
+    idle_interval is below the exit timeout, exits are still detected.
+
+    update() returns (run_detection, region), with region (x, y, w, h) in
+    full-frame pixels or None for the whole frame.
+    """
+
+    def __init__(self, method=MOTION_METHOD, scale=MOTION_SCALE, hold_sec=MOTION_HOLD_SEC,
+                 idle_interval=IDLE_DETECT_INTERVAL_SEC, min_area=MIN_MOTION_AREA):
+        if method not in ("diff", "mog2"):
+            raise ValueError(f"Unknown motion method: {method}")
+        self.method = method
+        self.scale = scale
+        self.hold_sec = hold_sec
+        self.idle_interval = idle_interval
+        self.min_area = min_area
+        self.scaler = FrameScaler(scale)
+        self.background = None
+        self.subtractor = None
+        if method == "mog2":
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(history=300, varThreshold=25,
+                                                                 detectShadows=False)
+        self.kernel = np.ones((3, 3), np.uint8)
+        self.last_motion = None
+        self.last_detection = None
+        self.frames = 0
+        self.skipped = 0
+
+    @property
+    def idle(self):
+        """True while the scene has been static for longer than the hold period."""
+        return self.last_motion is None or time.time() - self.last_motion > self.hold_sec
+
+    def motion_mask(self, frame):
+        small, _ = self.scaler.resize(frame)
+        gray = self.scaler.gray(small)
+        cv2.GaussianBlur(gray, (5, 5), 0, dst=gray)
+        if self.subtractor is not None:
+            mask = self.subtractor.apply(gray)
+        else:
+            if self.background is None:
+                self.background = gray.astype(np.float32)
+            diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+            cv2.accumulateWeighted(gray, self.background, BACKGROUND_ALPHA)
+            _, mask = cv2.threshold(diff, PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY)
+        return cv2.dilate(mask, self.kernel, iterations=2)
+
+    def motion_region(self, frame):
+        """Padded bounding box (full-frame pixels) of everything that moved, or None."""
+        mask = self.motion_mask(frame)
+        if cv2.countNonZero(mask) < self.min_area * mask.size:
+            return None
+        x, y, w, h = cv2.boundingRect(cv2.findNonZero(mask))
+        height, width = frame.shape[:2]
+        x, y, w, h = (int(v / self.scale) for v in (x, y, w, h))
+        pad_x, pad_y = int(w * ROI_PADDING), int(h * ROI_PADDING)
+        x1, y1 = max(0, x - pad_x), max(0, y - pad_y)
+        x2, y2 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+        return x1, y1, x2 - x1, y2 - y1
+
+    def update(self, frame, now=None):
+        now = time.time() if now is None else now
+        self.frames += 1
+        with metrics.timer("motion"):
+            region = self.motion_region(frame)
+        first = self.last_detection is None
+
+        if region is not None:
+            self.last_motion = now
+            height, width = frame.shape[:2]
+            if first or region[2] * region[3] > FULL_FRAME_RATIO * width * height:
+                region = None
+        elif self.last_motion is not None and now - self.last_motion <= self.hold_sec:
+            pass
+        elif first or now - self.last_detection >= self.idle_interval:
+            metrics.incr("motion_keepalive")
+        else:
+            self.skipped += 1
+            metrics.incr("motion_skipped")
+            return False, None
+
+        self.last_detection = now
+        return True, region
+
+
+# === Region Helpers ===
+def crop(frame, region):
+    """The part of frame inside region, or frame itself for None."""
+    if region is None:
+        return frame
+    x, y, w, h = region
+    return frame[y:y + h, x:x + w]
+
+
+def shift_box(box, region):
+    """Map an (x, y, w, h) box found inside region back to full-frame coordinates."""
+    if region is None:
+        return box
+    x, y, w, h = box
+    return x + region[0], y + region[1], w, h
@@ -0,0 +1,223 @@
+import argparse
+import os
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+from gallery import Gallery
+from embedder import Embedder, BatchEmbedder
+from pipeline import LatestFrameCapture, draw_faces
+from attendance_log import AttendanceWriter
+from attendance_store import AttendanceStore
+from sessions import SessionTable
+
+# === Configuration ===
+DB_PATH = "database"
+CSV_FILE = "attendance_multicam.csv"
+STORE_DIR = "attendance_store"
+EXIT_TIMEOUT_SEC = 10
+INFERENCE_WORKERS = 2
+MODEL_NAME = "Facenet"
+DETECTOR_BACKEND = "opencv"
+MULTICAM_COLUMNS = ["Name", "Entry Time", "Exit Time", "Camera"]
+
+
+# === Sources ===
+def open_source(spec):
+    """cv2.VideoCapture for a camera index ("0"), an RTSP/HTTP URL or a video file."""
+    if spec.isdigit():
+        return cv2.VideoCapture(int(spec)), False
+    cap = cv2.VideoCapture(spec)
+    is_file = os.path.isfile(spec)
+    return cap, is_file
+
+
+class Source:
+    """One camera/door: its decode thread and its latest recognition results."""
+
+    def __init__(self, spec, door):
+        self.spec = spec
+        self.door = door
+        cap, self.is_file = open_source(spec)
+        if not cap.isOpened():
+            raise ValueError(f"Cannot open source {spec}")
+        # Files play at their native rate, like a live camera
+        fps = cap.get(cv2.CAP_PROP_FPS) if self.is_file else None
+        self.capture = LatestFrameCapture(cap, name=f"capture-{door}", pace_fps=fps or None)
+        self.cap = cap
+        self.last_processed = 0
+        self.busy = False
+        self.latest_faces = []
+        self.frames_processed = 0
+
+
+# === Multi-source Runner ===
+class MultiSourceRunner:
+    """Decodes every source on its own thread and shares one model and gallery.
+
+    Inference workers take sources in round-robin order, skipping sources
+    that have no new frame or are already being processed, so a busy camera
+    cannot starve the others. Crops from concurrent workers are batched
+    together by the shared BatchEmbedder. Sessions are kept per door in one
+    SessionTable, and every attendance row records the door it was seen at.
+    """
+
+    def __init__(self, sources, gallery, writer, workers=INFERENCE_WORKERS, sessions=None):
+        self.sources = sources
+        self.gallery = gallery
+        self.writer = writer
+        self.sessions = sessions or SessionTable(EXIT_TIMEOUT_SEC, per_camera=True)
+        self.workers = workers
+        self.cursor = 0
+        self.lock = threading.Lock()
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for source in self.sources:
+            source.capture.start()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"inference-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self._expire, name="exit-check", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return self
+
+    def _next_source(self):
+        with self.lock:
+            for offset in range(len(self.sources)):
+                index = (self.cursor + offset) % len(self.sources)
+                source = self.sources[index]
+                if not source.busy and source.capture.seq > source.last_processed:
+                    source.busy = True
+                    self.cursor = index + 1
+                    return source
+        return None
+
+    def _work(self):
+        while self.running:
+            source = self._next_source()
+            if source is None:
+                time.sleep(0.005)
+                continue
+            try:
+                seq, timestamp, frame = source.capture.read(after_seq=source.last_processed, timeout=0)
+                faces = self.gallery.recognize(frame)
+                self._record(source, timestamp, faces)
+                source.last_processed = seq
+                source.frames_processed += 1
+            except Exception as e:
+                print(f"[ERROR] {source.door}:", str(e))
+            finally:
+                source.busy = False
+
+    def _record(self, source, timestamp, faces):
+        source.latest_faces = faces
+        for face in faces:
+            name = face["name"]
+            if name is None:
+                continue
+            session = self.sessions.seen(name, source.door, wall_time=timestamp)
+            if session is not None:
+                self.writer.open_session((source.door, name), session.entry_time)
+                print(f"[INFO] Entry marked: {name} at {source.door} ({session.entry_time})")
+
+    def _expire(self):
+        while self.running:
+            self.check_exits()
+            time.sleep(0.5)
+
+    def check_exits(self, force=False):
+        # Only sessions that fell due, across all doors at once
+        closed = self.sessions.close_all() if force else self.sessions.expire()
+        for session in closed:
+            row = self.sessions.row(session)
+            row["Camera"] = session.camera
+            self.writer.close_session((session.camera, session.name), row)
+            print(f"[INFO] Exit marked: {session.name} at {session.camera} ({row['Exit Time']})")
+
+    def finished(self):
+        return all(not source.capture.running and source.capture.seq <= source.last_processed
+                   for source in self.sources)
+
+    def stop(self):
+        self.running = False
+        for source in self.sources:
+            source.capture.stop()
+            source.cap.release()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.check_exits(force=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Attendance from several cameras with one shared model.")
+    parser.add_argument("--source", action="append", required=True,
+                        help="camera index, RTSP URL or video file (repeat for each source)")
+    parser.add_argument("--door", action="append", default=[],
+                        help="door name for the matching --source (defaults to cam<N>)")
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKERS, help="inference worker threads")
+    parser.add_argument("--db", default=DB_PATH, help="face database folder")
+    parser.add_argument("--csv", default=CSV_FILE, help="attendance log")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--detector", default=DETECTOR_BACKEND)
+    parser.add_argument("--display", action="store_true", help="show one window per source")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    doors = args.door + [f"cam{i}" for i in range(len(args.door), len(args.source))]
+    sources = [Source(spec, door) for spec, door in zip(args.source, doors)]
+
+    # One model and one gallery for every source
+    embedder = BatchEmbedder(Embedder(args.model))
+    gallery = Gallery.from_database(args.db, model_name=args.model, detector_backend=args.detector)
+    gallery.embedder = embedder
+
+    store = AttendanceStore.open(STORE_DIR)
+    writer = AttendanceWriter(args.csv, columns=MULTICAM_COLUMNS, store=store)
+    # Sessions left open by a crash resume at their door; doors no longer configured are closed
+    sessions = SessionTable(EXIT_TIMEOUT_SEC, per_camera=True)
+    for key, entry_time in writer.recover().items():
+        if isinstance(key, str):
+            # Journals written before keys were (door, name): person folder names cannot contain "/"
+            door, name = key.rsplit("/", 1)
+        else:
+            door, name = key
+        if door in doors:
+            sessions.restore(name, entry_time, camera=door)
+        else:
+            writer.close_session(key, {"Name": name, "Entry Time": entry_time,
+                                       "Exit Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                       "Camera": door})
+    runner = MultiSourceRunner(sources, gallery, writer, workers=args.workers, sessions=sessions).start()
+    print(f"[INFO] Multi-camera attendance started on {len(sources)} source(s). Press Ctrl+C to stop.")
+
+    try:
+        while not runner.finished():
+            if args.display:
+                for source in sources:
+                    latest = source.capture.read(timeout=0)
+                    if latest is not None:
+                        frame = draw_faces(latest[2].copy(), source.latest_faces)
+                        cv2.imshow(f"Attendance - {source.door}", frame)
+                if cv2.waitKey(30) & 0xFF == ord('q'):
+                    break
+            else:
+                time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("[INFO] Interrupted by user.")
+    finally:
+        runner.stop()
+        embedder.stop()
+        writer.close()
+        cv2.destroyAllWindows()
+        for source in sources:
+            print(f"[INFO] {source.door}: {source.frames_processed} frames recognized.")
+        print(f"[INFO] {embedder.batches} embedding batches for {embedder.items} faces.")
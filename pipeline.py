@@ -0,0 +1,288 @@
+import queue
+import threading
+import time
+
+import cv2
+
+from metrics import metrics
+
+
+# === Queues ===
+class StageQueue:
+    """Bounded queue between pipeline stages.
+
+    With drop_oldest=True a put on a full queue discards the oldest item
+    instead of blocking, so a slow consumer always works on fresh data.
+    Otherwise put blocks (back-pressure), which is what stages that must not
+    lose items (attendance logging) use. Depth counters are kept for stats().
+    """
+
+    def __init__(self, maxsize, drop_oldest=True):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.drop_oldest = drop_oldest
+        self.put_count = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        if self.drop_oldest:
+            with self.lock:
+                while True:
+                    try:
+                        self.queue.put_nowait(item)
+                        break
+                    except queue.Full:
+                        try:
+                            self.queue.get_nowait()
+                            self.dropped += 1
+                            metrics.incr("queue_dropped")
+                        except queue.Empty:
+                            pass
+        else:
+            self.queue.put(item)
+        self.put_count += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {"depth": self.depth(), "max_depth": self.max_depth,
+                "put": self.put_count, "dropped": self.dropped}
+
+
+# === Capture ===
+class LatestFrameCapture:
+    """Reads a cv2.VideoCapture on its own thread and keeps only the newest frame.
+
+    The driver buffer is drained continuously, so read() never returns a stale
+    frame. Each frame is also offered to `output` (a StageQueue) when given.
+    With pace_fps set (video files) reading is throttled to that rate, so a
+    file plays like a live camera instead of being decoded as fast as possible.
+    """
+
+    def __init__(self, cap, output=None, name="capture", pace_fps=None):
+        self.cap = cap
+        self.output = output
+        self.name = name
+        self.pace_interval = 1.0 / pace_fps if pace_fps else 0.0
+        self.frame = None
+        self.seq = 0
+        self.timestamp = None
+        self.running = False
+        self.failed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def _run(self):
+        next_read = time.time()
+        while self.running:
+            if self.pace_interval:
+                delay = next_read - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                next_read += self.pace_interval
+            ret, frame = self.cap.read()
+            if not ret:
+                print(f"[WARN] {self.name}: failed to read frame.")
+                self.failed = True
+                break
+            now = time.time()
+            metrics.incr("frames_captured")
+            with self.condition:
+                self.seq += 1
+                self.frame = frame
+                self.timestamp = now
+                self.condition.notify_all()
+            if self.output is not None:
+                self.output.put((self.seq, now, frame))
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def read(self, after_seq=0, timeout=1.0):
+        """(seq, timestamp, frame) of the newest frame newer than after_seq, or None."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > after_seq or not self.running, timeout):
+                return None
+            if self.seq <= after_seq:
+                return None
+            return self.seq, self.timestamp, self.frame
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=2)
+
+
+# === Stages ===
+class Stage:
+    """A pool of worker threads that apply `func` to items from `inbox`.
+
+    Non-None return values are put on `outbox`. `on_idle` is called when a
+    worker waits `idle_interval` seconds without input, for time-driven work
+    such as exit detection.
+    """
+
+    def __init__(self, name, func, inbox, outbox=None, workers=1, on_idle=None, idle_interval=0.5):
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.on_idle = on_idle
+        self.idle_interval = idle_interval
+        self.processed = 0
+        self.errors = 0
+        self.busy_sec = 0.0
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def _run(self):
+        while self.running:
+            try:
+                item = self.inbox.get(timeout=self.idle_interval)
+            except queue.Empty:
+                if self.on_idle is not None:
+                    self._call(self.on_idle)
+                continue
+            if item is None:
+                break
+            start = time.perf_counter()
+            result = self._call(self.func, item)
+            elapsed = time.perf_counter() - start
+            self.busy_sec += elapsed
+            metrics.observe(f"stage_{self.name}", elapsed)
+            self.processed += 1
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+
+    def _call(self, func, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            self.errors += 1
+            print(f"[ERROR] {self.name}:", str(e))
+            return None
+
+    def stop(self, drain=False):
+        """Stop the workers; with drain=True they finish what is already queued."""
+        if drain:
+            for _ in self.threads:
+                self.inbox.queue.put(None)
+        else:
+            self.running = False
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.running = False
+
+    def stats(self):
+        stats = {"workers": self.workers, "processed": self.processed, "errors": self.errors}
+        stats.update({f"queue_{k}": v for k, v in self.inbox.stats().items()})
+        return stats
+
+
+def format_stats(stages):
+    return " | ".join(
+        f"{stage.name}: q={s['queue_depth']}/{s['queue_max_depth']} drop={s['queue_dropped']} done={s['processed']}"
+        for stage, s in ((stage, stage.stats()) for stage in stages)
+    )
+
+
+# === Overlay ===
+def draw_faces(frame, faces, color=(0, 255, 0)):
+    """Draw the boxes and names of recognized faces onto frame in place."""
+    for face in faces:
+        if face["name"] is None:
+            continue
+        x, y, w, h = face["box"]
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+        cv2.putText(frame, face["name"], (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+    return frame
+
+
+# === Background Recognition ===
+class RecognitionWorker:
+    """Runs recognition on a background thread for a UI that owns the camera.
+
+    The UI hands over frames with submit() (only the newest pending frame is
+    kept) and collects (timestamp, faces) results from `results` on its own
+    thread, e.g. from a Tk after() callback, so the preview never waits for
+    the model.
+    """
+
+    def __init__(self, recognize_fn, min_interval=0.0):
+        self.recognize_fn = recognize_fn
+        self.min_interval = min_interval
+        self.results = queue.Queue()
+        self.frame = None
+        self.timestamp = None
+        self.condition = threading.Condition()
+        self.running = False
+        self.processed = 0
+        self.thread = threading.Thread(target=self._run, name="recognition-worker", daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def submit(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                # The previous frame was never picked up by the worker
+                metrics.incr("frames_dropped")
+            self.frame = frame
+            self.timestamp = time.time()
+            self.condition.notify()
+
+    def _run(self):
+        while self.running:
+            with self.condition:
+                self.condition.wait_for(lambda: self.frame is not None or not self.running)
+                frame, timestamp = self.frame, self.timestamp
+                self.frame = None
+            if frame is None:
+                break
+            start = time.time()
+            try:
+                faces = self.recognize_fn(frame)
+            except Exception as e:
+                print("[WARN]", str(e))
+                faces = []
+            self.processed += 1
+            self.results.put((timestamp, faces))
+            elapsed = time.time() - start
+            if elapsed < self.min_interval:
+                time.sleep(self.min_interval - elapsed)
+
+    def poll(self):
+        """All results produced since the last poll, oldest first."""
+        items = []
+        while True:
+            try:
+                items.append(self.results.get_nowait())
+            except queue.Empty:
+                return items
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout=2)
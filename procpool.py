@@ -0,0 +1,337 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from metrics import metrics
+
+# === Configuration ===
+PROCESS_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+SLOTS_PER_WORKER = 2        # frames in flight per worker: one being recognized, one waiting
+SUBMIT_TIMEOUT_SEC = 1.0    # submit() gives up (frame dropped) when no slot frees up in time
+RESULT_TIMEOUT_SEC = 30.0   # a frame whose result is this late is skipped (its slot waits for the result)
+WORKER_START_TIMEOUT_SEC = 300
+
+
+# === Shared Memory ===
+def attach_shared_memory(name):
+    """Attach to an existing block without registering it with this process's resource tracker."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always tracks; the owner unlinks the block, workers only close it
+        return shared_memory.SharedMemory(name=name)
+
+
+class FrameRing:
+    """Fixed-size frame slots in one shared_memory block.
+
+    A frame is copied into a free slot once; workers view the slot in place
+    through np.ndarray(buffer=...), so only (slot, shape) crosses the process
+    boundary instead of a pickled array.
+    """
+
+    def __init__(self, slots, slot_bytes):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, slot, frame):
+        view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        view[...] = frame
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def slot_view(shm, slot, slot_bytes, shape):
+    return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+
+
+# === Worker Process ===
+def limit_threads(threads):
+    """Keep each worker's math libraries to its share of the cores instead of all of them."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except (ImportError, RuntimeError):
+        pass  # no TensorFlow, or its thread pools already exist
+
+
+def worker_main(shm_name, slot_bytes, tasks, results, gallery_path, cascade, use_hot_cache, threads, detection=None):
+    limit_threads(threads)
+    from gallery import Gallery
+    from model_registry import warm_up
+    from motion import shift_box
+
+    gallery = Gallery.from_file(gallery_path)
+    if cascade:
+        from cascade import CascadeDetector
+        gallery.detector = CascadeDetector(gallery.detector_backend)
+    if use_hot_cache:
+        from hot_cache import HotCache
+        gallery.hot_cache = HotCache(gallery)
+    if detection is not None:
+        from scaling import FrameScaler
+        gallery.scaler = FrameScaler(*detection)
+    gallery.get_embedder()
+    # Detector build and graph tracing happen here, not on the first frame's result deadline
+    warm_up(gallery)
+    shm = attach_shared_memory(shm_name)
+    results.put(("ready", os.getpid()))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, slot, shape, region = task
+        results.put(("busy", seq, os.getpid()))
+        frame = slot_view(shm, slot, slot_bytes, shape)
+        try:
+            faces = gallery.recognize(frame)
+        except Exception as e:
+            print(f"[WARN] worker {os.getpid()}:", str(e))
+            faces = []
+        del frame
+        for face in faces:
+            face["box"] = shift_box(face["box"], region)
+        results.put((seq, faces))
+    shm.close()
+
+
+# === Process Pool ===
+class RecognitionPool:
+    """Gallery.recognize on a pool of worker processes, one model per process.
+
+    Capture, UI and attendance stay in the calling process; detection and
+    embedding (TensorFlow plus the GIL-bound pre/post-processing around it)
+    run in `workers` processes that each load the model and memory-map the
+    same gallery file (gallery_file format). Frames travel through a
+    FrameRing, so submitting one costs a memcpy, not a pickle.
+
+    Results are put on `output` as (seq, timestamp, faces) strictly in
+    submission order, whichever worker finishes first; entries added with
+    skip() keep their place with faces=None. A frame whose result is
+    overdue after RESULT_TIMEOUT_SEC is skipped; its slot is only reused
+    once the late result arrives or its worker is found dead (dead workers
+    are replaced), since a live worker may still be reading it.
+
+    detection=(scale, letterbox) gives every worker a scaling.FrameScaler.
+    Worker processes are spawned, so the calling script must keep its
+    side effects under `if __name__ == "__main__":`.
+    """
+
+    def __init__(self, gallery_path, frame_shape, output, workers=PROCESS_WORKERS,
+                 slots=None, cascade=False, use_hot_cache=False, detection=None):
+        self.gallery_path = gallery_path
+        self.output = output
+        self.workers = workers
+        self.cascade = cascade
+        self.use_hot_cache = use_hot_cache
+        self.detection = detection
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        self.slot_bytes = int(np.prod(frame_shape))
+        self.ring = FrameRing(slots or SLOTS_PER_WORKER * workers, self.slot_bytes)
+        self.context = mp.get_context("spawn")
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        self.processes = []
+
+        self.condition = threading.Condition()
+        self.free_slots = list(range(self.ring.slots))
+        self.next_seq = 0
+        self.next_emit = 0
+        self.pending = {}       # seq -> (timestamp, slot or None, submitted_at)
+        self.done = {}          # seq -> faces, waiting for earlier frames
+        self.owners = {}        # seq -> pid of the worker recognizing it, until its result arrives
+        self.quarantined = {}   # seq -> slot of a skipped frame a worker may still be reading
+        self.running = False
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.lost = 0
+        self.collector = threading.Thread(target=self._collect, name="pool-collector", daemon=True)
+
+    def start(self):
+        """Start the workers and wait until every one has its model loaded."""
+        for _ in range(self.workers):
+            self._spawn()
+        ready = 0
+        deadline = time.time() + WORKER_START_TIMEOUT_SEC
+        while ready < self.workers:
+            try:
+                message = self.results.get(timeout=max(0.1, deadline - time.time()))
+            except queue.Empty:
+                raise RuntimeError(f"Only {ready} of {self.workers} pool workers started.")
+            if message[0] == "ready":
+                ready += 1
+        print(f"[INFO] Recognition pool started: {self.workers} processes x "
+              f"{self.threads_per_worker} threads, {self.ring.slots} frame slots.")
+        self.running = True
+        self.collector.start()
+        return self
+
+    def _spawn(self):
+        process = self.context.Process(
+            target=worker_main, name=f"recognition-{len(self.processes)}", daemon=True,
+            args=(self.ring.name, self.slot_bytes, self.tasks, self.results,
+                  self.gallery_path, self.cascade, self.use_hot_cache, self.threads_per_worker, self.detection))
+        process.start()
+        self.processes.append(process)
+        return process
+
+    # --- Submitting ---
+    def submit(self, frame, timestamp, region=None, timeout=SUBMIT_TIMEOUT_SEC):
+        """Queue frame for recognition; region (x, y, w, h) shifts boxes back to full-frame pixels.
+
+        Blocks while every slot is in use; returns the frame's seq, or None
+        if it was dropped (no slot within timeout, or frame larger than a slot).
+        """
+        if frame.nbytes > self.slot_bytes or frame.dtype != np.uint8:
+            print(f"[WARN] Frame {frame.shape} {frame.dtype} does not fit the pool's frame slots, dropped.")
+            return self._drop()
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.free_slots or not self.running, timeout):
+                return self._drop()
+            if not self.running:
+                return None
+            slot = self.free_slots.pop()
+        self.ring.write(slot, frame)
+        with self.condition:
+            seq = self._reserve(timestamp, slot)
+        self.tasks.put((seq, slot, frame.shape, region))
+        self.submitted += 1
+        metrics.incr("pool_submitted")
+        return seq
+
+    def skip(self, timestamp):
+        """Add an ordered entry with no recognition (faces=None), e.g. for a motion-gated frame."""
+        with self.condition:
+            seq = self._reserve(timestamp, None)
+            self.done[seq] = None
+            self._emit_ready()
+        return seq
+
+    def _reserve(self, timestamp, slot):
+        seq = self.next_seq
+        self.next_seq += 1
+        self.pending[seq] = (timestamp, slot, time.time())
+        return seq
+
+    def _drop(self):
+        self.dropped += 1
+        metrics.incr("frames_dropped")
+        return None
+
+    # --- Collecting ---
+    def _collect(self):
+        while self.running:
+            try:
+                message = self.results.get(timeout=0.5)
+            except queue.Empty:
+                message = None
+            with self.condition:
+                if message is None or message[0] == "ready":
+                    pass
+                elif message[0] == "busy":
+                    self.owners[message[1]] = message[2]
+                else:
+                    self._finish(*message)
+                self._expire()
+                self._emit_ready()
+            self._replace_dead()
+
+    def _release(self, slot):
+        self.free_slots.append(slot)
+        self.condition.notify_all()
+
+    def _finish(self, seq, faces):
+        self.owners.pop(seq, None)
+        if seq in self.quarantined:
+            self._release(self.quarantined.pop(seq))    # late result: the worker is done with the slot
+            return
+        entry = self.pending.get(seq)
+        if entry is None or seq in self.done:
+            return  # already given up on
+        timestamp, slot, submitted_at = entry
+        self._release(slot)
+        self.done[seq] = faces
+        self.completed += 1
+        metrics.observe("pool_latency", time.time() - submitted_at)
+
+    def _expire(self):
+        """Give up on the oldest frame if its result is overdue, so ordering never stalls."""
+        entry = self.pending.get(self.next_emit)
+        if entry is None or self.next_emit in self.done:
+            return
+        timestamp, slot, submitted_at = entry
+        if time.time() - submitted_at > RESULT_TIMEOUT_SEC:
+            print(f"[WARN] No result for frame {self.next_emit} after {RESULT_TIMEOUT_SEC:.0f}s, skipped.")
+            owner = self.owners.get(self.next_emit)
+            if owner is not None and not self._alive(owner):
+                self.owners.pop(self.next_emit)
+                self._release(slot)
+            else:
+                # Still queued or still being recognized: the slot stays out of use until the result arrives
+                self.quarantined[self.next_emit] = slot
+            self.done[self.next_emit] = None
+            self.lost += 1
+            metrics.incr("pool_results_lost")
+
+    def _emit_ready(self):
+        while self.next_emit in self.done:
+            seq = self.next_emit
+            faces = self.done.pop(seq)
+            timestamp = self.pending.pop(seq)[0]
+            self.next_emit += 1
+            self.output.put((seq, timestamp, faces))
+        metrics.set_gauge("pool_in_flight", len(self.pending))
+
+    def _alive(self, pid):
+        return any(process.pid == pid and process.is_alive() for process in self.processes)
+
+    def _replace_dead(self):
+        for i, process in enumerate(self.processes):
+            if self.running and not process.is_alive():
+                print(f"[ERROR] Recognition worker {process.name} exited ({process.exitcode}); restarting.")
+                with self.condition:
+                    # Its skipped frames will never get a result; nothing reads their slots any more
+                    for seq in [s for s in self.quarantined if self.owners.get(s) == process.pid]:
+                        self.owners.pop(seq)
+                        self._release(self.quarantined.pop(seq))
+                self.processes.pop(i)
+                self._spawn()
+                break
+
+    # --- Shutdown ---
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.collector.is_alive():
+            self.collector.join(timeout=2)
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.ring.close()
+
+    def stats(self):
+        return {"workers": sum(p.is_alive() for p in self.processes), "in_flight": len(self.pending),
+                "submitted": self.submitted, "completed": self.completed,
+                "dropped": self.dropped, "lost": self.lost, "quarantined": len(self.quarantined)}
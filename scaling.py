@@ -0,0 +1,136 @@
+import threading
+
+import cv2
+import numpy as np
+
+from metrics import metrics
+
+# === Configuration ===
+DETECTION_SCALE = 1.0       # detectors see frames at this fraction of full size (1.0: unchanged)
+DETECTION_LETTERBOX = None  # e.g. (640, 384): fit every frame into this fixed size instead, padding the rest
+FULL_RES_CROPS = True       # embed faces cut from the full-resolution frame, not the detector's copy
+
+
+# === Frame Scaler ===
+class FrameScaler:
+    """Downscales frames for detection into reused buffers and maps boxes back.
+
+    With letterbox=(width, height) every frame is resized to fit that
+    fixed size, keeping its aspect ratio, and placed in the top-left corner
+    of a black canvas; otherwise it is resized by scale. Detection cost
+    follows the pixel count, so a 1080p frame at scale 0.5 costs about a
+    quarter, and large entrance faces are still found.
+
+    Buffers are per thread and only grow, so steady-state frames allocate
+    nothing. An image returned by resize() or gray() stays valid until the
+    same thread's next call.
+    """
+
+    def __init__(self, scale=DETECTION_SCALE, letterbox=DETECTION_LETTERBOX, interpolation=cv2.INTER_AREA):
+        if letterbox is None and not 0 < scale <= 1:
+            raise ValueError(f"Detection scale must be in (0, 1], got {scale}")
+        self.scale = scale
+        self.letterbox = tuple(letterbox) if letterbox else None
+        self.interpolation = interpolation
+        self.local = threading.local()
+
+    @property
+    def active(self):
+        return self.letterbox is not None or self.scale != 1.0
+
+    def _buffer(self, name, shape):
+        """A contiguous uint8 array of shape, carved from this thread's reusable buffer name."""
+        size = int(np.prod(shape))
+        flat = getattr(self.local, name, None)
+        if flat is None or flat.size < size:
+            flat = np.empty(size, dtype=np.uint8)
+            setattr(self.local, name, flat)
+            metrics.incr("scaler_allocations")
+        return flat[:size].reshape(shape)
+
+    # --- Frames ---
+    def resize(self, frame):
+        """(image, factor): frame as the detector should see it; image pixels = frame pixels * factor."""
+        height, width = frame.shape[:2]
+        if self.letterbox is None:
+            if self.scale == 1.0:
+                return frame, 1.0
+            factor = self.scale
+        else:
+            factor = min(self.letterbox[0] / width, self.letterbox[1] / height)
+        size = (max(1, int(round(width * factor))), max(1, int(round(height * factor))))
+        small = self._buffer("small", (size[1], size[0]) + frame.shape[2:])
+        cv2.resize(frame, size, dst=small, interpolation=self.interpolation)
+        if self.letterbox is None:
+            return small, factor
+
+        canvas = self._buffer("canvas", (self.letterbox[1], self.letterbox[0]) + frame.shape[2:])
+        canvas[:size[1], :size[0]] = small
+        canvas[size[1]:] = 0
+        canvas[:size[1], size[0]:] = 0
+        return canvas, factor
+
+    def gray(self, image):
+        """Grayscale copy of a BGR image in this thread's reusable buffer."""
+        gray = self._buffer("gray", image.shape[:2])
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+
+    # --- Boxes ---
+    def to_full(self, box, factor, shape):
+        """Map an (x, y, w, h) box found on a resized image back to pixels of a frame of shape."""
+        if factor == 1.0:
+            return box
+        height, width = shape[:2]
+        x1, y1 = (max(0, int(v / factor)) for v in box[:2])
+        x2 = min(width, int(np.ceil((box[0] + box[2]) / factor)))
+        y2 = min(height, int(np.ceil((box[1] + box[3]) / factor)))
+        return x1, y1, max(0, x2 - x1), max(0, y2 - y1)
+
+    def restore(self, faces, frame, factor, full_res_crops=FULL_RES_CROPS):
+        """Put DeepFace.extract_faces results found on resize(frame) back into frame's coordinates.
+
+        With full_res_crops the "face" of each result is cut again from the
+        full-resolution frame and eye-aligned like extract_faces(align=True)
+        does (RGB, 0..1), so embedding does not suffer from the detector's
+        reduced resolution and queries match gallery preprocessing.
+        Faces that fall entirely into the letterbox padding are dropped.
+        """
+        if factor == 1.0:
+            return faces
+        restored = []
+        for face in faces:
+            area = dict(face["facial_area"])
+            x, y, w, h = self.to_full((area["x"], area["y"], area["w"], area["h"]), factor, frame.shape)
+            if w == 0 or h == 0:
+                continue
+            area.update(x=x, y=y, w=w, h=h)
+            for eye in ("left_eye", "right_eye"):
+                if area.get(eye) is not None:
+                    area[eye] = (int(area[eye][0] / factor), int(area[eye][1] / factor))
+            face["facial_area"] = area
+            if full_res_crops:
+                face["face"] = align_crop(frame, (x, y, w, h), area.get("left_eye"), area.get("right_eye"))
+            restored.append(face)
+        return restored
+
+
+def align_crop(frame, box, left_eye, right_eye):
+    """The (x, y, w, h) box of frame rotated so the eyes are level, as RGB 0..1.
+
+    Uses DeepFace's own rotation on a square region around the box that the
+    rotated box always fits in (padded black past the frame edges), instead
+    of the whole frame, so the crop matches extract_faces(align=True).
+    """
+    from deepface.modules.detection import align_img_wrt_eyes, project_facial_area
+
+    x, y, w, h = box
+    half = int(np.ceil(np.hypot(w, h) / 2))
+    x0, y0 = x + w // 2 - half, y + h // 2 - half
+    height, width = frame.shape[:2]
+    region = frame[max(0, y0):max(0, y0 + 2 * half), max(0, x0):max(0, x0 + 2 * half)]
+    region = cv2.copyMakeBorder(region, max(0, -y0), max(0, y0 + 2 * half - height),
+                                max(0, -x0), max(0, x0 + 2 * half - width), cv2.BORDER_CONSTANT, value=[0, 0, 0])
+    eyes = [(e[0] - x0, e[1] - y0) if e is not None else None for e in (left_eye, right_eye)]
+    aligned, angle = align_img_wrt_eyes(region, *eyes)
+    x1, y1, x2, y2 = project_facial_area((x - x0, y - y0, x - x0 + w, y - y0 + h), angle, region.shape[:2])
+    return aligned[int(y1):int(y2), int(x1):int(x2), ::-1] / 255.0
@@ -0,0 +1,202 @@
+import base64
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import cv2
+import numpy as np
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+
+from gallery import Gallery, GalleryStore, store_file
+from embedder import Embedder, BatchEmbedder
+from attendance_store import AttendanceStore, FileLock
+from metrics import metrics
+
+# === Configuration ===
+DB_PATH = os.environ.get("FACE_DB_PATH", "database")
+STORE_DIR = os.environ.get("ATTENDANCE_STORE_DIR", "attendance_store")
+MODEL_NAME = os.environ.get("FACE_MODEL", "Facenet")
+DETECTOR_BACKEND = os.environ.get("FACE_DETECTOR", "opencv")
+MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH", "32"))
+MAX_LATENCY_MS = float(os.environ.get("EMBED_MAX_LATENCY_MS", "20"))
+SNAPSHOT_DIR = os.environ.get("GALLERY_SNAPSHOT_DIR", "gallery_cache")
+SNAPSHOT_DTYPE = os.environ.get("GALLERY_DTYPE", "float16")   # float32, float16 or int8
+SNAPSHOT_BASE = os.path.join(SNAPSHOT_DIR, f"gallery_{MODEL_NAME}_{DETECTOR_BACKEND}".replace("-", "").lower())
+SNAPSHOT_PATH = SNAPSHOT_BASE + ".fgal"
+
+
+# === Shared Gallery ===
+def database_mtime():
+    """Newest change to the store log or any person folder (adding/removing files touches the folder)."""
+    mtimes = [os.path.getmtime(root_dir) for root_dir, _, _ in os.walk(DB_PATH)]
+    store_path = store_file(DB_PATH, MODEL_NAME, DETECTOR_BACKEND)
+    if os.path.exists(store_path):
+        mtimes.append(os.path.getmtime(store_path))
+    return max(mtimes)
+
+
+class SharedGallery:
+    """The gallery snapshot every service worker maps from the same file.
+
+    The first worker to start (under an flock) rebuilds the snapshot if the
+    database changed; all workers then memory-map the same gallery file
+    (float16 by default, half the size of float32), so the embedding matrix
+    exists once in physical memory. After an enrollment the
+    worker re-exports the snapshot and the others remap it on their next
+    request.
+    """
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.lock = threading.Lock()
+        self.store = GalleryStore(store_file(DB_PATH, MODEL_NAME, DETECTOR_BACKEND))
+        self.gallery = None
+        self.snapshot_mtime = None
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with self.file_lock():
+            if not os.path.exists(SNAPSHOT_PATH) or \
+                    os.path.getmtime(SNAPSHOT_PATH) < database_mtime():
+                Gallery.from_database(DB_PATH, MODEL_NAME, DETECTOR_BACKEND).save_file(SNAPSHOT_PATH, SNAPSHOT_DTYPE)
+        self.reload()
+
+    def file_lock(self):
+        return FileLock(SNAPSHOT_BASE + ".lock")
+
+    def reload(self):
+        mtime = os.path.getmtime(SNAPSHOT_PATH)
+        gallery = Gallery.from_file(SNAPSHOT_PATH, store=self.store)
+        gallery.embedder = self.embedder
+        gallery.db_path = DB_PATH
+        gallery.attach_index(SNAPSHOT_BASE + ".index.npz")
+        with self.lock:
+            self.gallery = gallery
+            self.snapshot_mtime = mtime
+
+    def get(self):
+        if os.path.getmtime(SNAPSHOT_PATH) != self.snapshot_mtime:
+            self.reload()
+        return self.gallery
+
+    def update(self, change):
+        """Apply change(gallery) to the latest snapshot and republish it, serialized across workers."""
+        with self.file_lock():
+            gallery = self.get()
+            result = change(gallery)
+            gallery.save_file(SNAPSHOT_PATH, SNAPSHOT_DTYPE)
+            self.snapshot_mtime = os.path.getmtime(SNAPSHOT_PATH)
+        return result
+
+
+# === Helpers ===
+def read_image():
+    """BGR image from a multipart 'image' file, a JSON base64 'image' field or the raw body."""
+    if "image" in request.files:
+        data = request.files["image"].read()
+    elif request.is_json and "image" in (request.get_json(silent=True) or {}):
+        encoded = request.get_json()["image"]
+        data = base64.b64decode(encoded.split(",", 1)[-1])
+    else:
+        data = request.get_data()
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+    if img is None:
+        raise ValueError("Request does not contain a decodable image.")
+    return img
+
+
+def to_json_faces(faces):
+    return [{"name": f["name"], "distance": round(float(f["distance"]), 4),
+             "box": [int(v) for v in f["box"]]} for f in faces]
+
+
+# === App ===
+app = Flask(__name__)
+CORS(app)
+
+batcher = BatchEmbedder(Embedder(MODEL_NAME), max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_LATENCY_MS)
+shared = SharedGallery(batcher)
+store = AttendanceStore(STORE_DIR)
+
+
+@app.errorhandler(ValueError)
+def bad_request(e):
+    return jsonify({"error": str(e)}), 400
+
+
+@app.route("/health")
+def health():
+    gallery = shared.get()
+    return jsonify({"status": "ok", "model": gallery.model_name, "images": len(gallery),
+                    "batches": batcher.batches, "embedded": batcher.items})
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return metrics.prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+@app.route("/recognize", methods=["POST"])
+def recognize():
+    """Identify faces in a frame, or in a single face crop with ?crop=1."""
+    img = read_image()
+    gallery = shared.get()
+    threshold = request.args.get("threshold", type=float)
+    if request.args.get("crop", "0") in ("1", "true"):
+        # A client-side crop stands in for a detected face, which DeepFace hands over as RGB
+        embedding = batcher.embed([img[:, :, ::-1]])
+        name, distance = gallery.identify(embedding, threshold)[0]
+        faces = [{"name": name, "distance": distance, "box": (0, 0, img.shape[1], img.shape[0])}]
+    else:
+        faces = gallery.recognize(img, threshold)
+    return jsonify({"faces": to_json_faces(faces)})
+
+
+@app.route("/enroll", methods=["POST"])
+def enroll():
+    name = (request.form.get("name") or request.args.get("name") or "").strip()
+    if not name or os.path.sep in name or name.startswith("."):
+        raise ValueError("A valid 'name' is required.")
+    img = read_image()
+    person_path = os.path.join(DB_PATH, name)
+    os.makedirs(person_path, exist_ok=True)
+    filepath = os.path.join(person_path, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg")
+    cv2.imwrite(filepath, img)
+
+    # Embed outside the cross-worker lock; only the row append is serialized
+    embedding = shared.get().embed_image(img)
+    if embedding is None:
+        os.remove(filepath)
+        raise ValueError("No face found in the image.")
+    images = shared.update(lambda gallery: (gallery.add(name, filepath, embedding), len(gallery))[1])
+    return jsonify({"name": name, "path": filepath, "images": images}), 201
+
+
+@app.route("/people", methods=["GET"])
+def people():
+    return jsonify({"people": sorted(set(shared.get().names))})
+
+
+@app.route("/people/<name>", methods=["DELETE"])
+def delete_person(name):
+    removed = shared.update(lambda gallery: gallery.remove_person(name))
+    if not removed:
+        return jsonify({"error": f"Unknown person: {name}"}), 404
+    shutil.rmtree(os.path.join(DB_PATH, name), ignore_errors=True)
+    return jsonify({"name": name, "removed": removed})
+
+
+@app.route("/attendance", methods=["GET"])
+def attendance():
+    """Sessions for ?date=YYYY-MM-DD (default today) or one person's history with ?name=."""
+    store.refresh()
+    name = request.args.get("name")
+    if name:
+        df = store.history(name)
+    else:
+        df = store.read_day(request.args.get("date", datetime.now().strftime("%Y-%m-%d")))
+    return jsonify({"rows": df.to_dict("records")})
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "5000")), threaded=True)
@@ -0,0 +1,262 @@
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+
+# === Configuration ===
+EXIT_TIMEOUT_SEC = 10
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# === Clocks ===
+class SystemClock:
+    """Monotonic time for ordering and timeouts, mapped to wall time only for display and logs."""
+
+    def __init__(self):
+        self.offset = time.time() - time.monotonic()
+
+    def now(self):
+        return time.monotonic()
+
+    def wall(self, moment):
+        return moment + self.offset
+
+    def from_wall(self, wall_time):
+        """Monotonic moment of a time.time() timestamp (e.g. a frame's capture time)."""
+        return wall_time - self.offset
+
+
+class SimulatedClock(SystemClock):
+    """A clock that only moves when told to, for replaying sighting streams."""
+
+    def __init__(self, start_wall=0.0):
+        self.offset = start_wall
+        self.moment = 0.0
+
+    def now(self):
+        return self.moment
+
+    def advance(self, seconds):
+        self.moment += seconds
+        return self.moment
+
+    def set(self, moment):
+        self.moment = max(self.moment, moment)
+        return self.moment
+
+
+def format_time(wall_time):
+    return datetime.fromtimestamp(wall_time).strftime(TIME_FORMAT)
+
+
+# === Session Table ===
+class Session:
+    __slots__ = ("key", "name", "camera", "last_camera", "entry", "entry_wall", "last_seen",
+                 "sightings", "token")
+
+    def __init__(self, key, name, camera, moment, wall_time, token):
+        self.key = key
+        self.name = name
+        self.camera = camera
+        self.last_camera = camera
+        self.entry = moment
+        self.entry_wall = wall_time
+        self.last_seen = moment
+        self.sightings = 1
+        self.token = token
+
+    @property
+    def entry_time(self):
+        return format_time(self.entry_wall)
+
+
+class SessionTable:
+    """Open attendance sessions with heap-based exit detection.
+
+    seen() records a sighting in O(1) (O(log n) when it opens a session).
+    Every open session has exactly one entry in a heap ordered by its
+    possible exit moment; expire() only looks at entries that are due, and
+    an entry whose person was seen again since is pushed back with the new
+    deadline. Finding exits therefore costs O(log n) per event instead of a
+    pass over everyone present on every frame.
+
+    Times are monotonic (clock.now()), so wall-clock jumps cannot end or
+    stretch sessions; they are converted to wall time only for entry/exit
+    strings. Sightings from several cameras may arrive late or out of
+    order: last_seen only moves forward. With per_camera=True each
+    (camera, name) has its own session, otherwise a person seen on any
+    camera keeps one session alive.
+    """
+
+    def __init__(self, exit_timeout=EXIT_TIMEOUT_SEC, clock=None, per_camera=False):
+        self.exit_timeout = exit_timeout
+        self.clock = clock or SystemClock()
+        self.per_camera = per_camera
+        self.sessions = {}
+        self.heap = []
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, key):
+        return key in self.sessions
+
+    def get(self, name, camera=None):
+        return self.sessions.get(self._key(name, camera))
+
+    def names(self):
+        with self.lock:
+            return {session.name for session in self.sessions.values()}
+
+    def _key(self, name, camera):
+        return (camera, name) if self.per_camera else name
+
+    def _push(self, session):
+        self.counter += 1
+        session.token = self.counter
+        heapq.heappush(self.heap, (session.last_seen + self.exit_timeout, self.counter, session.key))
+
+    # --- Sightings ---
+    def seen(self, name, camera=None, wall_time=None):
+        """Record a sighting (now, or at the time.time() timestamp wall_time).
+
+        Returns the new Session if this sighting opened one, else None.
+        """
+        moment = self.clock.now() if wall_time is None else self.clock.from_wall(wall_time)
+        key = self._key(name, camera)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None:
+                session.sightings += 1
+                if moment > session.last_seen:
+                    session.last_seen = moment
+                    session.last_camera = camera
+                return None
+            session = Session(key, name, camera, moment, self.clock.wall(moment), 0)
+            self.sessions[key] = session
+            self._push(session)
+            return session
+
+    def restore(self, name, entry_time, camera=None):
+        """Reopen a session recovered after a crash; it exits normally if the person is gone."""
+        now = self.clock.now()
+        key = self._key(name, camera)
+        with self.lock:
+            session = Session(key, name, camera, now, datetime.strptime(entry_time, TIME_FORMAT).timestamp(), 0)
+            self.sessions[key] = session
+            self._push(session)
+            return session
+
+    # --- Exits ---
+    def expire(self, now=None):
+        """Close and return the sessions whose person has been absent longer than exit_timeout."""
+        now = self.clock.now() if now is None else now
+        closed = []
+        with self.lock:
+            while self.heap and self.heap[0][0] < now:
+                _, token, key = heapq.heappop(self.heap)
+                session = self.sessions.get(key)
+                if session is None or session.token != token:
+                    continue
+                if session.last_seen + self.exit_timeout >= now:
+                    self._push(session)     # seen again since this entry was pushed
+                    continue
+                del self.sessions[key]
+                closed.append(session)
+        return closed
+
+    def close_all(self):
+        """Close every open session (shutdown)."""
+        with self.lock:
+            closed = sorted(self.sessions.values(), key=lambda s: s.entry)
+            self.sessions.clear()
+            self.heap = []
+        return closed
+
+    def exit_time(self, now=None):
+        """Wall-clock exit string for sessions closed at now (default: the current moment)."""
+        return format_time(self.clock.wall(self.clock.now() if now is None else now))
+
+    def duration(self, session, until=None):
+        """Time from entry to until (default: the last sighting) as a timedelta."""
+        until = session.last_seen if until is None else until
+        return timedelta(seconds=max(0.0, self.clock.wall(until) - session.entry_wall))
+
+    def row(self, session, now=None):
+        """The attendance log row for a closed session."""
+        return {"Name": session.name, "Entry Time": session.entry_time, "Exit Time": self.exit_time(now)}
+
+
+# === Replay Harness ===
+def replay(sightings, exit_timeout=EXIT_TIMEOUT_SEC, tick=0.1, per_camera=False):
+    """Run (seconds, name, camera) sightings through a SessionTable on a simulated clock.
+
+    The clock advances in tick steps, calling expire() on each like a
+    polling loop would. Returns (name, camera, entry_sec, exit_sec) per
+    session in the order they closed.
+    """
+    clock = SimulatedClock()
+    table = SessionTable(exit_timeout, clock, per_camera)
+    closed = []
+    events = sorted(sightings, key=lambda s: s[0])
+    end = (events[-1][0] if events else 0.0) + exit_timeout + 2 * tick
+    i = 0
+    while clock.now() <= end:
+        while i < len(events) and events[i][0] <= clock.now():
+            moment, name, camera = events[i]
+            table.seen(name, camera, wall_time=clock.wall(moment))
+            i += 1
+        closed.extend((s.name, s.camera, s.entry, clock.now()) for s in table.expire())
+        clock.advance(tick)
+    closed.extend((s.name, s.camera, s.entry, clock.now()) for s in table.close_all())
+    return closed
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+    print("[OK]", message)
+
+
+def selftest():
+    """Replay scenarios with known outcomes: python sessions.py."""
+    every = [(t * 0.5, "alice", "door") for t in range(41)]
+    result = replay(every, exit_timeout=10)
+    check(len(result) == 1 and abs(result[0][3] - 30.1) < 0.15, "steady sightings give one session, exit after timeout")
+
+    gap = [(0, "bob", "door"), (5, "bob", "door"), (16.5, "bob", "door")]
+    check([r[2] for r in replay(gap, exit_timeout=10)] == [0, 16.5], "a gap longer than the timeout splits the session")
+
+    cams = [(t, "carol", "door" if t % 8 else "hall") for t in range(0, 30, 4)]
+    check(len(replay(cams, exit_timeout=10)) == 1, "alternating cameras keep one session")
+    check(len(replay(cams, exit_timeout=10, per_camera=True)) == 2, "per_camera keeps one session per camera")
+
+    clock = SimulatedClock()
+    table = SessionTable(10, clock)
+    table.seen("dave", wall_time=clock.wall(5))
+    table.seen("dave", wall_time=clock.wall(2))     # a late result from a slower worker
+    clock.set(14.9)
+    check(not table.expire() and table.get("dave").last_seen == 5, "late sightings never move last_seen back")
+    clock.set(15.1)
+    check([s.name for s in table.expire()] == ["dave"], "the exit falls due timeout after the newest sighting")
+
+    people = 2000
+    table = SessionTable(10, SimulatedClock())
+    for frame in range(100):
+        table.clock.set(frame * 0.1)
+        for p in range(people):
+            table.seen(f"p{p}")
+        table.expire()
+    check(len(table.heap) == people, "one heap entry per open session, however many sightings")
+    start = time.perf_counter()
+    for _ in range(1000):
+        table.expire()
+    elapsed = time.perf_counter() - start
+    # Timing depends on the machine, so it is reported, not asserted
+    print(f"[INFO] expire() with {people} present and nobody due: {elapsed * 1000:.3f} us per call")
+
+
+if __name__ == "__main__":
+    selftest()
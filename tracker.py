@@ -0,0 +1,165 @@
+import itertools
+import time
+
+import cv2
+import numpy as np
+
+from metrics import metrics
+
+# === Configuration ===
+IOU_MATCH_THRESHOLD = 0.3       # minimum overlap to continue a track
+CENTROID_MATCH_RATIO = 0.5      # fallback: centroid within this fraction of the box size
+MAX_MISSED_SEC = 1.0            # drop a track after this long without a detection
+REVERIFY_INTERVAL_SEC = 5.0     # re-run recognition on a known track this often
+MIN_TRACK_CONFIDENCE = 0.9      # below this similarity (or unknown) a track is retried sooner
+RETRY_INTERVAL_SEC = 0.5        # re-run recognition on unknown / low-confidence tracks this often
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def create_cv_tracker(tracker_type):
+    """OpenCV KCF/CSRT tracker, or None if this OpenCV build doesn't ship it."""
+    factory_name = f"Tracker{tracker_type.upper()}_create"
+    for module in (cv2, getattr(cv2, "legacy", None)):
+        factory = getattr(module, factory_name, None) if module is not None else None
+        if factory is not None:
+            return factory()
+    return None
+
+
+class Track:
+    __slots__ = ("track_id", "box", "name", "confidence", "first_seen", "last_seen",
+                 "last_recognized", "recognitions", "cv_tracker")
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.name = None
+        self.confidence = 0.0
+        self.first_seen = now
+        self.last_seen = now
+        self.last_recognized = None
+        self.recognitions = 0
+        self.cv_tracker = None
+
+
+class FaceTracker:
+    """Associates per-frame face boxes into tracks with stable IDs.
+
+    Detections are matched to existing tracks greedily by IoU, falling back
+    to centroid distance for fast movement. Recognition results are stored on
+    the track and carried forward; needs_recognition() says when a track must
+    be (re)identified: when it is new, when its confidence is low, or when
+    the re-verification interval has passed.
+
+    With tracker_type ("KCF" or "CSRT") an OpenCV tracker follows each track
+    between detections via predict(), so detection can run every few frames.
+    """
+
+    def __init__(self, tracker_type=None, iou_threshold=IOU_MATCH_THRESHOLD,
+                 max_missed_sec=MAX_MISSED_SEC, reverify_sec=REVERIFY_INTERVAL_SEC,
+                 min_confidence=MIN_TRACK_CONFIDENCE, retry_sec=RETRY_INTERVAL_SEC):
+        self.tracker_type = tracker_type
+        self.iou_threshold = iou_threshold
+        self.max_missed_sec = max_missed_sec
+        self.reverify_sec = reverify_sec
+        self.min_confidence = min_confidence
+        self.retry_sec = retry_sec
+        self.tracks = {}
+        self.ids = itertools.count(1)
+        self.recognition_calls = 0
+        self.carried_forward = 0
+
+    def update(self, boxes, frame=None, now=None):
+        """Associate this frame's detections (x, y, w, h) with tracks.
+
+        Returns the tracks seen in this frame, in the order of `boxes`.
+        """
+        now = time.time() if now is None else now
+        unmatched = set(self.tracks)
+        pairs = []
+        for i, box in enumerate(boxes):
+            for track_id in unmatched:
+                score = iou(box, self.tracks[track_id].box)
+                if score < self.iou_threshold:
+                    score = self._centroid_score(box, self.tracks[track_id].box)
+                if score > 0:
+                    pairs.append((score, i, track_id))
+
+        assigned = {}
+        for score, i, track_id in sorted(pairs, reverse=True):
+            if i in assigned or track_id not in unmatched:
+                continue
+            assigned[i] = track_id
+            unmatched.discard(track_id)
+
+        seen = []
+        for i, box in enumerate(boxes):
+            box = tuple(int(v) for v in box)
+            if i in assigned:
+                track = self.tracks[assigned[i]]
+                track.box = box
+                track.last_seen = now
+            else:
+                track = Track(next(self.ids), box, now)
+                self.tracks[track.track_id] = track
+            if self.tracker_type and frame is not None:
+                track.cv_tracker = create_cv_tracker(self.tracker_type)
+                if track.cv_tracker is not None:
+                    track.cv_tracker.init(frame, box)
+            seen.append(track)
+
+        for track_id in list(unmatched):
+            if now - self.tracks[track_id].last_seen > self.max_missed_sec:
+                del self.tracks[track_id]
+        return seen
+
+    def predict(self, frame, now=None):
+        """Advance tracks with their OpenCV trackers on a frame without detection."""
+        now = time.time() if now is None else now
+        seen = []
+        for track in self.tracks.values():
+            if track.cv_tracker is None:
+                continue
+            ok, box = track.cv_tracker.update(frame)
+            if ok:
+                track.box = tuple(int(v) for v in box)
+                track.last_seen = now
+                seen.append(track)
+        return seen
+
+    def _centroid_score(self, a, b):
+        ax, ay = a[0] + a[2] / 2, a[1] + a[3] / 2
+        bx, by = b[0] + b[2] / 2, b[1] + b[3] / 2
+        limit = CENTROID_MATCH_RATIO * max(b[2], b[3], 1)
+        distance = np.hypot(ax - bx, ay - by)
+        # Scaled below any IoU match so overlap always wins
+        return (1 - distance / limit) * self.iou_threshold if distance < limit else 0.0
+
+    # --- Recognition policy ---
+    def needs_recognition(self, track, now=None):
+        now = time.time() if now is None else now
+        if track.last_recognized is None:
+            return True
+        confident = track.name is not None and track.confidence >= self.min_confidence
+        interval = self.reverify_sec if confident else self.retry_sec
+        if now - track.last_recognized >= interval:
+            return True
+        self.carried_forward += 1
+        metrics.incr("track_hits")
+        return False
+
+    def set_identity(self, track, name, confidence, now=None):
+        track.name = name
+        track.confidence = confidence
+        track.last_recognized = time.time() if now is None else now
+        track.recognitions += 1
+        self.recognition_calls += 1